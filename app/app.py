@@ -1,16 +1,28 @@
+import logging
+import os
 import uuid
-import uvicorn
+
+from app.monitoring.import_profiler import ImportProfiler
+
+# IMPORT_PROFILE=1 times every import made while the application initializes
+import_profiler = None
+if os.environ.get('IMPORT_PROFILE') == '1':
+    import_profiler = ImportProfiler()
+    import_profiler.install()
 
 from fastapi import FastAPI, HTTPException
 from mangum import Mangum
 from starlette.middleware.cors import CORSMiddleware
 
-from app.routes import helloworld_router, account_router, auth_router, portfolio_router, user_router
+from app.routes import helloworld_router, account_router, admin_router, auth_router, portfolio_router, user_router
 from app.monitoring import logging_config
 from app.middlewares.correlation_id_middleware import CorrelationIdMiddleware
+from app.middlewares.deadline_middleware import DeadlineMiddleware
 from app.middlewares.logging_middleware import LoggingMiddleware
 from app.handlers.exception_handler import exception_handler
 from app.handlers.http_exception_handler import http_exception_handler
+from app.handlers.storage_unavailable_handler import storage_unavailable_handler
+from app.storage.Resilience import StorageUnavailableError
 
 ###############################################################################
 #   Application object                                                        #
@@ -32,7 +44,9 @@ app.add_middleware(
 #   Logging configuration                                                     #
 ###############################################################################
 
-logging_config.configure_logging(level='DEBUG', service='gojenga', instance=str(uuid.uuid4()))
+# LOG_LEVEL, LOG_SAMPLE_RATES and LOG_PIPELINE tune the pipeline, see the README
+logging_config.configure_logging(service='gojenga', instance=str(uuid.uuid4()))
+logger = logging.getLogger(__name__)
 
 ###############################################################################
 #   Error handlers configuration                                              #
@@ -40,12 +54,14 @@ logging_config.configure_logging(level='DEBUG', service='gojenga', instance=str(
 
 app.add_exception_handler(Exception, exception_handler)
 app.add_exception_handler(HTTPException, http_exception_handler)
+app.add_exception_handler(StorageUnavailableError, storage_unavailable_handler)
 
 ###############################################################################
 #   Middlewares configuration                                                 #
 ###############################################################################
 
-# Tip : middleware order : CorrelationIdMiddleware > LoggingMiddleware -> reverse order
+# Tip : middleware order : CorrelationIdMiddleware > LoggingMiddleware > DeadlineMiddleware -> reverse order
+app.add_middleware(DeadlineMiddleware)
 app.add_middleware(LoggingMiddleware)
 app.add_middleware(CorrelationIdMiddleware)
 
@@ -55,13 +71,13 @@ app.add_middleware(CorrelationIdMiddleware)
 ###############################################################################
 @app.get("/")
 async def root():
-    print("---> Hello From Gojenga")
+    logger.debug('Hello From Gojenga')
     return {"message": "Hello From Gojenga"}
 
 
 @app.get("/health")
 async def health():
-    print("---> Health Check")
+    logger.debug('Health Check')
     return {"message": "Health Check"}
 
 
@@ -70,16 +86,46 @@ app.include_router(account_router.router, prefix='/account', tags=['account'])
 app.include_router(auth_router.router, prefix='/auth', tags=['auth'])
 app.include_router(portfolio_router.router, prefix='/portfolio', tags=['portfolio'])
 app.include_router(user_router.router, prefix='/user', tags=['user'])
+app.include_router(admin_router.router, prefix='/admin', tags=['admin'])
 
 ###############################################################################
 #   Handler for AWS Lambda                                                    #
 ###############################################################################
 
-handler = Mangum(app)
+mangum_handler = Mangum(app)
+
+
+def handler(event, context):
+    # queued log records are written before the invocation returns, a frozen Lambda would hold them otherwise
+    try:
+        return mangum_handler(event, context)
+    finally:
+        logging_config.flush_logs()
+
+###############################################################################
+#   Startup mode                                                              #
+###############################################################################
+
+# Heavy clients (boto3, passlib, python-jose) are built on first use by default, which keeps
+# them out of the Lambda cold start. STARTUP_MODE=eager builds them now instead, for long lived
+# servers where the first request should not pay for it.
+if os.environ.get('STARTUP_MODE', 'lazy') == 'eager':
+    from app.common import Auth
+    from app.storage import Dynamo
+
+    Dynamo.get_resource()
+    Auth.get_pwd_context()
+    import jose.jwt
+
+if import_profiler is not None:
+    import_profiler.uninstall()
+    logger.info("Import profile", extra={'type': 'import-profile', **import_profiler.report()})
 
 ###############################################################################
 #   Run the self contained application                                        #
 ###############################################################################
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=5000)
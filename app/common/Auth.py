@@ -1,14 +1,18 @@
+import hashlib
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
 import pytz
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt, ExpiredSignatureError
-from passlib.context import CryptContext
 from pydantic import BaseModel
 
-from app.storage.Dynamo import Dynamo, logger
+from app.common.Cache import MISSING, TTLCache
+from app.common.WorkerPool import BoundedPool
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import logger
+from app.storage.Resilience import StorageUnavailableError
 
 class MyAuth:
     def __init__(self):
@@ -20,6 +24,8 @@ class MyAuth:
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# table the bearer token's user is looked up in by get_current_user
+AUTH_USERS_TABLE = "usersTest"
 REFRESH_ACCESS_TOKEN_EXPIRE_DAYS = 7
 
 fake_users_db = {
@@ -53,59 +59,105 @@ class UserInDB(User):
     hashed_password: str
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib and python-jose are imported on first use to keep them out of the cold start
+pwd_context = None
+
+
+def get_pwd_context():
+    global pwd_context
+    if pwd_context is None:
+        from passlib.context import CryptContext
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return pwd_context
+
+# bcrypt is deliberately slow, hashing and verification run on this pool instead of the event loop.
+# HASH_POOL_KIND=process is not available on AWS Lambda (no shared memory for multiprocessing).
+hash_pool = BoundedPool('password-hashing',
+                        kind=os.environ.get('HASH_POOL_KIND', 'thread'),
+                        max_workers=int(os.environ.get('HASH_POOL_WORKERS', '0')) or None,
+                        max_queue=int(os.environ.get('HASH_POOL_QUEUE', '32')))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# users looked up by every authenticated request, keyed by (table_name, username)
+user_cache = TTLCache('users',
+                      max_size=int(os.environ.get('USER_CACHE_SIZE', '1024')),
+                      ttl_seconds=float(os.environ.get('USER_CACHE_TTL_SECONDS', '60')))
+
+# verified claims keyed by a digest of the bearer token, kept until the token expires (capped by the ttl)
+token_cache = TTLCache('tokens',
+                       max_size=int(os.environ.get('TOKEN_CACHE_SIZE', '4096')),
+                       ttl_seconds=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# rejected tokens are remembered briefly so replaying garbage does not cost a decode each time
+INVALID_TOKEN_TTL_SECONDS = float(os.environ.get('INVALID_TOKEN_TTL_SECONDS', '30'))
+
 app = FastAPI()
 
 
 def verify_password(plain_password, hashed_password):
-    print("--> running verify_password")
+    logger.debug('running verify_password')
     try:
-        verify_result = pwd_context.verify(plain_password, hashed_password)
-        print(f'--> verify_result: {verify_result}')
+        verify_result = get_pwd_context().verify(plain_password, hashed_password)
+        logger.debug('verify_result: %s', verify_result)
         return verify_result
     except Exception as e:
-        print(f'error verifying password: {e}')
+        logger.debug('error verifying password: %s', e)
         logger.error(e)
     return False
 
 
 def get_password_hash(password):
-    print("--> running get_password_hash")
-    return pwd_context.hash(password)
+    logger.debug('running get_password_hash')
+    return get_pwd_context().hash(password)
+
 
+async def verify_password_async(plain_password, hashed_password):
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
 
-def get_user(table_name, username: str):
-    print("--> running get_user")
+
+async def get_password_hash_async(password):
+    return await hash_pool.run(get_password_hash, password)
+
+
+async def get_user(table_name, username: str):
+    logger.debug('running get_user')
     query: dict = {'name': username}
     try:
-        user = Dynamo.get_item(table_name, query)
+        # only existing users are cached so a freshly created user is visible right away
+        user = await user_cache.get_or_load((table_name, username),
+                                            lambda: AsyncDynamo.get_item(table_name, query),
+                                            cache_if=lambda item: "message" not in item)
         # user["disabled"] = False
         return user
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
 
 
-def authenticate_user(table_name, username: str, password: str):
-    print("--> running authenticate_user")
-    user = get_user(table_name, username)
+def invalidate_user(table_name, username: str):
+    user_cache.invalidate((table_name, username))
+
+
+async def authenticate_user(table_name, username: str, password: str):
+    logger.debug('running authenticate_user')
+    user = await get_user(table_name, username)
     if "message" in user:
         if user["message"] == "item not found":
-            print("--> user not found")
+            logger.debug('user not found')
             return False
     if not user:
-        print("--> user not found")
+        logger.debug('user not found')
         return False
-    if not verify_password(password, user["password"]):
+    if not await verify_password_async(password, user["password"]):
         return False
-    print("--> user authenticated")
+    logger.debug('user authenticated')
     return user
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
-    print("--> running create_access_token")
+    logger.debug('running create_access_token')
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(pytz.utc) + expires_delta
@@ -117,7 +169,8 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 def renew_access_token(data: dict, expires_delta: int | None = None):
-    print("--> running renew_access_token")
+    logger.debug('running renew_access_token')
+    from jose import jwt
     to_encode = data.copy()
 
     expire = datetime.now(pytz.utc) + timedelta(minutes=15)
@@ -127,14 +180,14 @@ def renew_access_token(data: dict, expires_delta: int | None = None):
 
 
 def get_token_payload(token: str):
-    print("--> running get_token_payload")
+    logger.debug('running get_token_payload')
+    from jose import jwt
     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     return payload
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    table_name = "usersTest"
-    print("--> running get_current_user")
+def decode_token(token: str) -> TokenData:
+    from jose import JWTError, jwt, ExpiredSignatureError
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -145,17 +198,49 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         username: str = payload.get("sub")
         expires = payload.get("exp")
         if username is None:
-            print('username is None')
+            logger.debug('username is None')
             raise credentials_exception
-        token_data = TokenData(username=username, expires=expires)
+        return TokenData(username=username, expires=expires)
     except ExpiredSignatureError:
         raise HTTPException(status_code=403, detail="token has been expired")
     except JWTError:
-        print('JWTError')
+        logger.debug('JWTError')
         raise credentials_exception
-    user = get_user(table_name=table_name, username=token_data.username)
+
+
+def verify_token(token: str) -> TokenData:
+    key = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(key, MISSING)
+    if isinstance(cached, TokenData):
+        return cached
+    if cached is not MISSING:
+        status_code, detail, headers = cached
+        raise HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+    try:
+        token_data = decode_token(token)
+    except HTTPException as e:
+        token_cache.set(key, (e.status_code, e.detail, e.headers), INVALID_TOKEN_TTL_SECONDS)
+        raise
+    ttl_seconds = None
+    if token_data.expires:
+        ttl_seconds = min((token_data.expires - datetime.now(pytz.utc)).total_seconds(), token_cache.ttl_seconds)
+    token_cache.set(key, token_data, ttl_seconds)
+    return token_data
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    table_name = AUTH_USERS_TABLE
+    logger.debug('running get_current_user')
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_data = verify_token(token)
+    user = await get_user(table_name=table_name, username=token_data.username)
     if user is None:
-        print('user is None')
+        logger.debug('user is None')
         raise credentials_exception
     if datetime.now(pytz.utc) > token_data.expires:
         raise HTTPException(status_code=403, detail="token has been expired")
@@ -164,7 +249,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     # if current_user["disabled"]:
-    print("--> running get_current_active_user")
+    logger.debug('running get_current_active_user')
     if current_user is None:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+MISSING = object()
+
+
+class LoadAbandoned(Exception):
+    # set on a shared load whose caller was cancelled, the callers that joined it load again
+    pass
+
+# every cache registers itself here so its counters can be exposed by the admin router
+caches: dict[str, 'TTLCache'] = {}
+
+
+class TTLCache:
+    # bounded LRU cache with a per entry time to live. get_or_load coalesces concurrent
+    # misses for the same key onto a single loader call (stampede protection).
+    def __init__(self, name: str, max_size: int = 1024, ttl_seconds: float = 60.0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.inflight: dict[Hashable, asyncio.Future] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        caches[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float | None = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+        # a load started before the invalidation may return the old value, later callers do not join it
+        self.inflight.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl_seconds: float | None = None,
+                          cache_if: Callable[[Any], bool] | None = None) -> Any:
+        while True:
+            value = self.get(key, MISSING)
+            if value is not MISSING:
+                return value
+
+            inflight = self.inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except LoadAbandoned:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            # the request that started the load went away, not the ones that joined it: they are
+            # woken up to load again rather than cancelled with it
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+            future.set_exception(LoadAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when nobody else was waiting on it
+            future.exception()
+            raise
+        else:
+            if self.inflight.get(key) is future and (cache_if is None or cache_if(value)):
+                self.set(key, value, ttl_seconds)
+            future.set_result(value)
+            return value
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in caches.items()}
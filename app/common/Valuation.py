@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from operator import itemgetter
+
+import numpy as np
+
+from app.common.Cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Values portfolios against an in-memory price table (coin id -> price), loaded from a pluggable
+# price source and reloaded every PRICE_REFRESH_SECONDS. When a reload fails the last table keeps
+# being served. PRICE_SOURCE=file reads PRICE_FILE, a JSON object of coin id to price, which stands
+# in for a market data feed.
+#
+# A batch is valued with array operations over all its holdings at once: the coins of every
+# portfolio are flattened into arrays of coin, amount and owner, priced with one gather from the
+# price array and summed per portfolio with bincount. Values are float64.
+PRICE_SOURCE = os.environ.get('PRICE_SOURCE', 'file')
+PRICE_FILE = os.environ.get('PRICE_FILE', 'prices.json')
+PRICE_REFRESH_SECONDS = float(os.environ.get('PRICE_REFRESH_SECONDS', '60'))
+
+
+class FilePriceSource:
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict[str, float]:
+        with open(self.path) as f:
+            prices = json.load(f)
+        return {str(coin_id): float(price) for coin_id, price in prices.items()}
+
+
+class PriceTable:
+    # immutable snapshot of the prices. Coins without a price map to the extra last slot, priced 0
+    def __init__(self, prices: dict[str, float], loaded_at: float):
+        self.index = {coin_id: position for position, coin_id in enumerate(prices)}
+        self.unpriced = len(prices)
+        self.prices = np.zeros(len(prices) + 1, dtype=np.float64)
+        self.prices[:-1] = np.fromiter(prices.values(), dtype=np.float64, count=len(prices))
+        self.loaded_at = loaded_at
+
+    def price(self, coin_id: str) -> float | None:
+        position = self.index.get(coin_id)
+        return None if position is None else float(self.prices[position])
+
+
+def create_price_source():
+    if PRICE_SOURCE == 'file':
+        return FilePriceSource(PRICE_FILE)
+    raise ValueError(f'unknown price source {PRICE_SOURCE}')
+
+
+price_source = create_price_source()
+price_tables = TTLCache('price-table', max_size=1, ttl_seconds=PRICE_REFRESH_SECONDS)
+last_table: PriceTable | None = None
+
+
+async def price_table() -> PriceTable:
+    async def load() -> PriceTable:
+        global last_table
+        try:
+            prices = await asyncio.to_thread(price_source.load)
+        except Exception as e:
+            if last_table is None:
+                raise
+            logger.warning('price reload failed, serving the prices loaded %.0fs ago: %s',
+                           time.time() - last_table.loaded_at, e)
+            return last_table
+        last_table = PriceTable(prices, time.time())
+        return last_table
+
+    return await price_tables.get_or_load('prices', load)
+
+
+class Holdings:
+    # the coins of a batch of portfolios flattened into arrays, built once and valued against any
+    # price table. Turning the items into arrays is the Python part of a valuation, pricing them is
+    # a gather and a bincount over all the holdings.
+    def __init__(self, portfolios: list[list[dict]]):
+        coins = [coin for coins in portfolios for coin in coins]
+        codes: dict[str, int] = {}
+        self.codes = np.fromiter((codes.setdefault(coin_id, len(codes)) for coin_id in map(itemgetter('id'), coins)),
+                                 dtype=np.int64, count=len(coins))
+        self.coin_ids = list(codes)
+        self.amounts = np.fromiter(map(float, map(itemgetter('amount'), coins)), dtype=np.float64, count=len(coins))
+        self.owners = np.repeat(np.arange(len(portfolios)), list(map(len, portfolios)))
+        self.portfolios = len(portfolios)
+
+    def value(self, table: PriceTable) -> tuple[np.ndarray, np.ndarray]:
+        # the value of every portfolio and the mask of the holdings without a price
+        positions = np.fromiter((table.index.get(coin_id, table.unpriced) for coin_id in self.coin_ids),
+                                dtype=np.int64, count=len(self.coin_ids))[self.codes]
+        values = np.bincount(self.owners, weights=self.amounts * table.prices[positions], minlength=self.portfolios)
+        return values.astype(np.float64, copy=False), positions == table.unpriced
+
+
+def value_batch(portfolios: list[list[dict]], table: PriceTable) -> list[dict]:
+    # portfolios are lists of {id, amount} coins, the result has the value and the unpriced coins of each
+    holdings = Holdings(portfolios)
+    values, unpriced = holdings.value(table)
+    results = [{'value': value, 'unpriced': []} for value in values.tolist()]
+    for holding in np.flatnonzero(unpriced).tolist():
+        results[holdings.owners[holding]]['unpriced'].append(holdings.coin_ids[holdings.codes[holding]])
+    return results
+
+
+def value_portfolio(coins: list[dict], table: PriceTable) -> dict:
+    # one portfolio with the price and value of each coin
+    priced = []
+    for coin in coins:
+        price = table.price(coin['id'])
+        priced.append({'id': coin['id'], 'amount': coin['amount'], 'price': price,
+                       'value': None if price is None else float(coin['amount']) * price})
+    return {**value_batch([coins], table)[0], 'coins': priced}
@@ -0,0 +1,65 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(Exception):
+    def __init__(self, name: str, retry_after: int = 1):
+        super().__init__(f'{name} pool is saturated')
+        self.retry_after = retry_after
+
+
+class BoundedPool:
+    # runs CPU heavy calls off the event loop. At most max_workers calls run and max_queue wait,
+    # anything beyond that is rejected immediately with PoolSaturatedError instead of queueing.
+    def __init__(self, name: str, kind: str = 'thread', max_workers: int | None = None, max_queue: int = 64):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f'unknown pool kind {kind}')
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.slots = threading.BoundedSemaphore(self.max_workers + max_queue)
+        self.executor: Executor | None = None
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+
+    def get_executor(self) -> Executor:
+        # created on first use, a process pool forks workers and should not exist before it is needed
+        with self.lock:
+            if self.executor is None:
+                if self.kind == 'process':
+                    self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            return self.executor
+
+    async def run(self, func, *args, **kwargs):
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            logger.warning(f'{self.name} pool saturated, rejecting call')
+            raise PoolSaturatedError(self.name)
+        self.submitted += 1
+        try:
+            future = self.get_executor().submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self.slots.release()
+            raise
+        # the slot is freed when the worker is done, even if the awaiting request was cancelled
+        future.add_done_callback(lambda _: self.slots.release())
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        return {
+            'kind': self.kind,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+        }
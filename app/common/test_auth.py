@@ -0,0 +1,38 @@
+import os
+import unittest
+from datetime import timedelta
+
+from fastapi import HTTPException
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.common import Auth
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        Auth.token_cache.clear()
+
+    def test_valid_token_is_decoded_once(self):
+        token = Auth.create_access_token({'sub': 'alice'}, timedelta(minutes=5))
+        first = Auth.verify_token(token)
+        second = Auth.verify_token(token)
+        self.assertIs(first, second)
+        self.assertEqual(second.username, 'alice')
+
+    def test_invalid_token_is_remembered(self):
+        for _ in range(2):
+            with self.assertRaises(HTTPException) as ctx:
+                Auth.verify_token('not-a-jwt')
+            self.assertEqual(ctx.exception.status_code, 401)
+        self.assertEqual(Auth.token_cache.stats()['size'], 1)
+
+    def test_expired_token_is_rejected(self):
+        token = Auth.create_access_token({'sub': 'alice'}, timedelta(seconds=-1))
+        with self.assertRaises(HTTPException) as ctx:
+            Auth.verify_token(token)
+        self.assertEqual(ctx.exception.status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import time
+import unittest
+
+from app.common.Cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache('test-lru', max_size=2, ttl_seconds=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expiry(self):
+        cache = TTLCache('test-ttl', max_size=2, ttl_seconds=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_concurrent_misses_call_loader_once(self):
+        cache = TTLCache('test-stampede', max_size=8, ttl_seconds=60)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {'name': 'alice'}
+
+        async def load_many():
+            return await asyncio.gather(*(cache.get_or_load('alice', loader) for _ in range(20)))
+
+        results = asyncio.run(load_many())
+        self.assertEqual(calls, 1)
+        self.assertTrue(all(r == {'name': 'alice'} for r in results))
+        self.assertEqual(cache.stats()['coalesced'], 19)
+
+    def test_cancelled_first_caller_does_not_cancel_the_others(self):
+        cache = TTLCache('test-abandoned', max_size=8, ttl_seconds=60)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return calls
+
+        async def scenario():
+            first = asyncio.create_task(cache.get_or_load('alice', loader))
+            await asyncio.sleep(0)
+            joiners = [asyncio.create_task(cache.get_or_load('alice', loader)) for _ in range(5)]
+            await asyncio.sleep(0.005)
+            first.cancel()
+            return await asyncio.gather(*joiners), first
+
+        values, first = asyncio.run(scenario())
+        self.assertTrue(first.cancelled())
+        # one of the joiners took the load over, the others joined it
+        self.assertEqual((calls, values), (2, [2] * 5))
+
+    def test_cache_if_skips_negative_results(self):
+        cache = TTLCache('test-negative', max_size=8, ttl_seconds=60)
+
+        async def loader():
+            return {'message': 'item not found'}
+
+        asyncio.run(cache.get_or_load('bob', loader, cache_if=lambda item: 'message' not in item))
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
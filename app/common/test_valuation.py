@@ -0,0 +1,47 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import unittest
+from decimal import *
+from unittest import mock
+
+from app.common import Valuation
+
+
+class TestValuation(unittest.TestCase):
+    def test_batch_matches_coin_by_coin_values(self):
+        rng = random.Random(5)
+        prices = {f'coin{i}': rng.uniform(0.01, 50000) for i in range(50)}
+        table = Valuation.PriceTable(prices, 0)
+        portfolios = [[{'id': f'coin{rng.randrange(60)}', 'amount': Decimal(rng.randrange(1, 10 ** 6)) / 1000}
+                       for _ in range(rng.randrange(8))] for _ in range(500)]
+
+        results = Valuation.value_batch(portfolios, table)
+
+        for coins, result in zip(portfolios, results):
+            expected = sum(float(coin['amount']) * prices[coin['id']] for coin in coins if coin['id'] in prices)
+            self.assertAlmostEqual(result['value'], expected, delta=1e-6 * max(1.0, expected))
+            self.assertEqual(result['unpriced'], [coin['id'] for coin in coins if coin['id'] not in prices])
+
+    def test_last_prices_are_served_when_a_reload_fails(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'prices.json')
+            with open(path, 'w') as f:
+                json.dump({'bitcoin': 60000, 'ether': 3000.5}, f)
+            with mock.patch.object(Valuation, 'price_source', Valuation.FilePriceSource(path)), \
+                    mock.patch.object(Valuation, 'last_table', None):
+                Valuation.price_tables.clear()
+                first = asyncio.run(Valuation.price_table())
+                os.remove(path)
+                Valuation.price_tables.clear()
+                second = asyncio.run(Valuation.price_table())
+            Valuation.price_tables.clear()
+
+        self.assertIs(second, first)
+        self.assertEqual(Valuation.value_portfolio([{'id': 'ether', 'amount': Decimal(2)}], first)['value'], 6001.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,75 @@ import logging
 from decimal import *
 from opentelemetry import trace
 
-from app.storage.Dynamo import Dynamo
+from app.common.Auth import invalidate_user
+from app.common.Lib import Lib
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage import Journal, Leaderboard, LedgerShards
+from app.storage.Dynamo import ConditionalCheckFailedError, TransactionCancelledError, TRANSACT_MAX_ITEMS
+from app.storage.Resilience import StorageUnavailableError
 
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
 
+# a balance write is planned again from fresh balances when a concurrent write or a shard migration
+# broke one of its conditions
+BALANCE_WRITE_ATTEMPTS = 3
+
+
+class BatchRevertError(Exception):
+    # a batch transfer is left partly applied: a chunk failed after others committed and they could
+    # not all be reverted. The batch is logged and never retried
+    def __init__(self, batch_id: str, written: list[list[dict]]):
+        super().__init__(f'batch {batch_id} partly applied, {len(written)} chunks could not be reverted')
+        self.batch_id = batch_id
+        self.written = written
+
+
+def plan_transfers(transfers: list[dict], balances: dict[str, Decimal]) -> tuple[list[dict], dict[str, Decimal]]:
+    # replays the transfers in order against the balances, a transfer the sender can not cover is
+    # rejected and the later ones see the balances without it. Returns the result of every transfer
+    # and the net balance change of every account.
+    balances = dict(balances)
+    results: list[dict] = []
+    deltas: dict[str, Decimal] = {}
+    for transfer in transfers:
+        sender, receiver, amount = transfer['sender'], transfer['receiver'], transfer['amount']
+        reason = None
+        if Lib.detect_special_characters(sender) or Lib.detect_special_characters(receiver):
+            reason = 'please send legal sender and receiver'
+        elif amount <= 0:
+            reason = 'transaction amount must be positive'
+        elif sender == receiver:
+            reason = 'sender and receiver must be different accounts'
+        elif receiver not in balances:
+            reason = 'recipient not found'
+        elif sender not in balances or balances[sender] < amount:
+            reason = 'sender not found or insufficient funds'
+        if reason is not None:
+            results.append({**transfer, 'status': 'rejected', 'reason': reason})
+            continue
+        balances[sender] -= amount
+        balances[receiver] += amount
+        deltas[sender] = deltas.get(sender, Decimal(0)) - amount
+        deltas[receiver] = deltas.get(receiver, Decimal(0)) + amount
+        results.append({**transfer, 'status': 'committed'})
+    return results, {name: delta for name, delta in deltas.items() if delta != 0}
+
+
+async def apply_update(action: dict) -> dict:
+    # runs a single balance action as an UpdateItem, which returns the new item
+    request = action['Update']
+    return await AsyncDynamo.update_item(request['TableName'], request['Key'], request['UpdateExpression'],
+                                         expression_values=request['ExpressionAttributeValues'],
+                                         expression_names=request['ExpressionAttributeNames'],
+                                         condition_expression=request['ConditionExpression'],
+                                         return_values='ALL_NEW')
+
+
 class AccountHandler:
     @staticmethod
-    def handle_get_account(username: str, is_test: bool) -> dict:
+    async def handle_get_account(username: str, is_test: bool) -> dict:
         # table_name: str = 'ledger'
         # if is_test:
         #     table_name = 'ledgerTest'
@@ -18,123 +78,414 @@ class AccountHandler:
         table_name: str = 'ledgerTest'
 
         try:
-            print(f'--> handle getting account {username}')
-            user = Dynamo.get_item(table_name, {'name': username})
+            logger.debug('handle getting account %s', username)
+            user = await AsyncDynamo.get_item(table_name, {'name': username})
+            if 'shards' in user:
+                user = (await LedgerShards.with_totals(table_name, [user]))[0]
             return user
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.info(f'error {e}')
             raise ValueError(e)
 
     @staticmethod
-    def handle_create_account(username: str, balance: Decimal, is_test: bool) -> str:
+    async def handle_batch_get_accounts(usernames: list[str], is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_batch_get_accounts",
+                attributes={'attr.count': len(usernames), 'is_test': is_test}):
+            table_name: str = 'ledger'
+            if is_test:
+                table_name = 'ledgerTest'
+            try:
+                items = (await AsyncDynamo.batch_get({table_name: [{'name': name} for name in usernames]}))[table_name]
+                items = await LedgerShards.with_totals(table_name, items)
+                found: dict = {item['name']: item for item in items}
+                return {name: found.get(name, {'message': 'item not found'}) for name in usernames}
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_create_account(username: str, balance: Decimal, is_test: bool) -> str:
         table_name: str = 'ledger'
         if is_test:
             table_name = 'ledgerTest'
         try:
-            resp = Dynamo.create_item(table_name, {'name': username,
-                                                   'balance': balance})
+            # an existing account is not overwritten, that would orphan the shards of a sharded one
+            try:
+                resp = await AsyncDynamo.create_item(table_name, {'name': username, 'balance': balance},
+                                                     'attribute_not_exists(#n)', None, {'#n': 'name'})
+            except ConditionalCheckFailedError:
+                raise ValueError('account already exists')
+            await Leaderboard.update(table_name, [username])
             return resp
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.info(f'error {e}')
             raise ValueError(e)
 
     @staticmethod
-    def handle_update_account(username: str, balance: Decimal, is_test: bool) -> str:
+    async def handle_update_account(username: str, balance: Decimal, is_test: bool) -> str:
         table_name: str = 'ledger'
         if is_test:
             table_name = 'ledgerTest'
         try:
-            resp = Dynamo.update_account_balance(table_name, {'name': username,
-                                                              'balance': balance})
+            shards = (await LedgerShards.read_balances(table_name, [username])).get(username)
+            if shards is not None and len(shards) > 1:
+                # the new balance goes to the base item, the other shards are emptied
+                await AsyncDynamo.transact_write_items(
+                    LedgerShards.set_balance_actions(table_name, username, balance, shards))
+                LedgerShards.forget(table_name, username)
+                resp = 'update item success'
+            else:
+                resp = await AsyncDynamo.update_account_balance(table_name, {'name': username,
+                                                                             'balance': balance})
+            await Leaderboard.update(table_name, [username])
             return resp
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.info(f'error {e}')
             raise ValueError(e)
 
     @staticmethod
-    def handle_modify_account(username: str, balance: Decimal, is_test: bool) -> str:
+    async def handle_modify_account(username: str, balance: Decimal, is_test: bool) -> dict:
         with tracer.start_as_current_span(
                 "handle_modify_user",
                 attributes={'attr.username': username, 'is_test': is_test}):
             table_name: str = 'ledger'
+            journal_table: str = 'journal'
             if is_test:
                 table_name = 'ledgerTest'
-            try:
-                current_balance = Dynamo.get_item(table_name, {'name': username})
-                new_balance: float = current_balance["balance"] + balance
+                journal_table = 'journalTest'
 
-                resp = Dynamo.update_account_balance(table_name, {'name': username,
-                                                                  'balance': new_balance})
-                return resp
+            # the delta is applied server side, a withdrawal may not overdraw the account. A credit to a
+            # sharded account goes to one of its shards, a debit may take from several. The journal entry
+            # commits in the same transaction, the account is then read back and written through to the
+            # shared cache (a single update without the journal returns the new item itself).
+            try:
+                for _ in range(BALANCE_WRITE_ATTEMPTS):
+                    shards = None
+                    if balance < 0 and LedgerShards.known_shards(table_name, username) > 1:
+                        shards = (await LedgerShards.read_balances(table_name, [username], True)).get(username)
+                        if shards is None:
+                            raise ValueError('account not found or insufficient funds')
+                    if balance >= 0:
+                        actions = [LedgerShards.credit_action(table_name, username, balance)]
+                    else:
+                        actions = LedgerShards.debit_actions(table_name, username, -balance, shards)
+                    if not actions:
+                        raise ValueError('account not found or insufficient funds')
+                    if Journal.JOURNAL_ENABLED:
+                        actions.append(Journal.entry_action(journal_table, username,
+                                                            'deposit' if balance >= 0 else 'withdrawal', balance,
+                                                            Journal.new_entry_id()))
+                    attributes = None
+                    try:
+                        if len(actions) == 1:
+                            attributes = await apply_update(actions[0])
+                            if attributes['name'] == username:
+                                LedgerShards.remember(table_name, attributes)
+                        else:
+                            await AsyncDynamo.transact_write_items(actions)
+                    except (ConditionalCheckFailedError, TransactionCancelledError) as e:
+                        logger.info(f'error {e}')
+                        # the account may have been sharded or unsharded since its shard count was read
+                        if await LedgerShards.recheck(table_name, username):
+                            continue
+                        raise ValueError('account not found or insufficient funds')
+                    if attributes is None or attributes['name'] != username:
+                        attributes = await AsyncDynamo.refresh_item(table_name, {'name': username})
+                        LedgerShards.remember(table_name, attributes)
+                    await Leaderboard.update(table_name, [username])
+                    if 'shards' not in attributes:
+                        return {'name': username, 'balance': attributes['balance']}
+                    shards = await LedgerShards.load_shards(table_name, [attributes], consistent_read=True)
+                    return {'name': username, 'balance': sum(shards[username].values())}
+                raise ValueError('account not found or insufficient funds')
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
     @staticmethod
-    def handle_delete_account(username: str, is_test: bool) -> str:
+    async def handle_delete_account(username: str, is_test: bool) -> str:
         with tracer.start_as_current_span(
                 "handle_delete_account",
                 attributes={'username': username, 'is_test': is_test}):
+            ledger_table: str = 'ledger'
+            portfolio_table: str = 'portfolio'
+            users_table: str = 'users'
+            if is_test:
+                ledger_table = 'ledgerTest'
+                portfolio_table = 'portfolioTest'
+                users_table = 'usersTest'
+
+            # the ledger (with its shards), portfolio and user items go away together or not at all
+            actions: list[dict] = [{'Delete': {'TableName': table_name, 'Key': {'name': username}}}
+                                   for table_name in (ledger_table, portfolio_table, users_table)]
+            try:
+                shards = (await LedgerShards.read_balances(ledger_table, [username])).get(username, {})
+                actions += [{'Delete': {'TableName': ledger_table,
+                                        'Key': {'name': LedgerShards.shard_name(username, index)}}}
+                            for index in shards if index != 0]
+                await AsyncDynamo.transact_write_items(actions)
+                LedgerShards.forget(ledger_table, username)
+                invalidate_user(users_table, username)
+                await Leaderboard.update(ledger_table, [username])
+                return 'delete item success'
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_transaction(sender: str, receiver: str, amount: Decimal, is_test: bool) -> str:
+        with tracer.start_as_current_span(
+                "handle_transaction",
+                attributes={'attr.sender': sender, 'attr.receiver': receiver, 'is_test': is_test}):
             table_name: str = 'ledger'
+            journal_table: str = 'journal'
             if is_test:
                 table_name = 'ledgerTest'
-            try:
-                resp = Dynamo.delete_item(table_name, {'name': username})
+                journal_table = 'journalTest'
+
+            if amount <= 0:
+                raise ValueError('transaction amount must be positive')
+            if sender == receiver:
+                raise ValueError('sender and receiver must be different accounts')
 
+            # debit, credit and their journal entries commit together in one round trip, so there is
+            # nothing to roll back. The debit of a sharded sender may take from several of its shards,
+            # the credit goes to one shard.
+            try:
+                for _ in range(BALANCE_WRITE_ATTEMPTS):
+                    shards = None
+                    if LedgerShards.known_shards(table_name, sender) > 1:
+                        shards = (await LedgerShards.read_balances(table_name, [sender], True)).get(sender)
+                        if shards is None:
+                            raise ValueError('sender not found or insufficient funds')
+                    debits = LedgerShards.debit_actions(table_name, sender, amount, shards)
+                    if not debits:
+                        raise ValueError('sender not found or insufficient funds')
+                    credit = LedgerShards.credit_action(table_name, receiver, amount)
+                    entries: list[dict] = []
+                    if Journal.JOURNAL_ENABLED:
+                        entry_id = Journal.new_entry_id()
+                        entries = [Journal.entry_action(journal_table, sender, 'transfer_out', -amount, entry_id,
+                                                        counterparty=receiver),
+                                   Journal.entry_action(journal_table, receiver, 'transfer_in', amount, entry_id,
+                                                        counterparty=sender)]
+                    try:
+                        await AsyncDynamo.transact_write_items(debits + [credit] + entries)
+                        await Leaderboard.update(table_name, [sender, receiver])
+                        return 'update item success'
+                    except TransactionCancelledError as e:
+                        logger.info(f'error {e}')
+                        reasons = (e.reasons + ['None'] * len(debits))[:len(debits) + 1]  # the entries can not fail
+                        if reasons[-1] == 'ConditionalCheckFailed':
+                            if credit['Update']['Key']['name'] == receiver:
+                                raise ValueError('recipient not found')
+                            # the receiver was unsharded since its shard count was read
+                            LedgerShards.forget(table_name, receiver)
+                            continue
+                        if 'ConditionalCheckFailed' in reasons[:-1]:
+                            if await LedgerShards.recheck(table_name, sender):
+                                continue
+                            raise ValueError('sender not found or insufficient funds')
+                        raise ValueError(e)
+                raise ValueError('sender not found or insufficient funds')
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
+    @staticmethod
+    async def handle_batch_transactions(transfers: list[dict], is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_batch_transactions",
+                attributes={'attr.count': len(transfers), 'is_test': is_test}):
+            table_name: str = 'ledger'
+            journal_table: str | None = 'journal'
             if is_test:
-                table_name = 'portfolioTest'
-            else:
-                table_name = 'portfolio'
+                table_name = 'ledgerTest'
+                journal_table = 'journalTest'
+            if not Journal.JOURNAL_ENABLED:
+                journal_table = None
+
+            names = sorted({name for transfer in transfers for name in (transfer['sender'], transfer['receiver'])
+                            if not Lib.detect_special_characters(name)})
             try:
-                resp = Dynamo.delete_item(table_name, {'name': username})
+                for attempt in range(1, BALANCE_WRITE_ATTEMPTS + 1):
+                    shards = await LedgerShards.read_balances(table_name, names, consistent_read=True)
+                    results, deltas = plan_transfers(transfers, {name: sum(balances.values())
+                                                                 for name, balances in shards.items()})
+                    try:
+                        await AccountHandler.apply_deltas(table_name, deltas, shards, journal_table)
+                        await Leaderboard.update(table_name, sorted(deltas))
+                        return {'committed': sum(result['status'] == 'committed' for result in results),
+                                'rejected': sum(result['status'] == 'rejected' for result in results),
+                                'accounts_written': len(deltas),
+                                'results': results}
+                    except TransactionCancelledError as e:
+                        logger.info(f'batch transfer attempt {attempt} cancelled {e.reasons}')
+                raise ValueError(f'balances kept changing, batch not applied after {BALANCE_WRITE_ATTEMPTS} attempts')
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
-            if is_test:
-                table_name = 'usersTest'
+    @staticmethod
+    async def apply_deltas(table_name: str, deltas: dict[str, Decimal], shards: dict[str, dict[int, Decimal]],
+                           journal_table: str | None = None):
+        # one update per account (several for the debit of a sharded account) and its journal entry, at
+        # most TRANSACT_MAX_ITEMS actions per transaction. Debits go first since only they can fail on
+        # funds; when a chunk is cancelled the chunks already written are reverted, with reversal
+        # entries in the journal, so the batch is all or nothing.
+        batch_id = Journal.new_entry_id()
+        chunks: list[list[dict]] = [[]]
+        for name in sorted(deltas, key=lambda name: (deltas[name] > 0, name)):
+            if deltas[name] > 0:
+                actions = [LedgerShards.credit_action(table_name, name, deltas[name])]
             else:
-                table_name = 'users'
+                actions = LedgerShards.debit_actions(table_name, name, -deltas[name], shards[name])
+            if journal_table is not None:
+                actions.append(Journal.entry_action(journal_table, name, 'batch', deltas[name], batch_id))
+            if len(chunks[-1]) + len(actions) > TRANSACT_MAX_ITEMS:
+                chunks.append([])
+            chunks[-1].extend(actions)
+        written: list[list[dict]] = []
+        for chunk in chunks:
+            if not chunk:
+                continue
             try:
-                resp = Dynamo.delete_item(table_name, {'name': username})
+                await AsyncDynamo.transact_write_items(chunk)
+            except Exception as e:
+                # a cancelled first chunk wrote nothing, the batch may be planned again. Once a chunk
+                # committed it never is
+                if not written:
+                    raise
+                if not isinstance(e, TransactionCancelledError):
+                    # the chunk may have committed, reverting the others would not undo it
+                    AccountHandler.log_partial_batch(batch_id, written + [chunk], e)
+                    raise BatchRevertError(batch_id, written + [chunk]) from e
+                await AccountHandler.revert_chunks(batch_id, written)
+                raise ValueError(f'balances changed while batch {batch_id} was applied, it was reverted')
+            written.append(chunk)
+
+    @staticmethod
+    async def revert_chunks(batch_id: str, written: list[list[dict]]):
+        # the reverts are unconditional, a failure here is a storage failure
+        for reverted, done in enumerate(reversed(written)):
+            try:
+                await AsyncDynamo.transact_write_items([
+                    LedgerShards.inverse_action(action) if 'Update' in action else Journal.reversal_action(action)
+                    for action in done])
+            except Exception as e:
+                remaining = written[:len(written) - reverted]
+                AccountHandler.log_partial_batch(batch_id, remaining, e)
+                raise BatchRevertError(batch_id, remaining) from e
+
+    @staticmethod
+    def log_partial_batch(batch_id: str, written: list[list[dict]], error: Exception):
+        movements = [(request['TableName'], request['Key']['name'], request['ExpressionAttributeValues'][':delta'])
+                     for chunk in written for request in (action.get('Update') for action in chunk) if request]
+        logger.error('batch %s partly applied and not reverted, movements %s: %s', batch_id, movements, error,
+                     extra={'type': 'batch-revert', 'batch_id': batch_id})
+
+    @staticmethod
+    async def handle_shard_account(username: str, count: int, is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_shard_account",
+                attributes={'attr.username': username, 'attr.count': count, 'is_test': is_test}):
+            table_name: str = 'ledger'
+            if is_test:
+                table_name = 'ledgerTest'
+            try:
+                # a new shard count goes through the unsharded layout, which keeps the whole balance
+                await LedgerShards.unshard_account(table_name, username)
+                if count <= 1:
+                    return {'name': username, 'shards': 1}
+                return await LedgerShards.shard_account(table_name, username, count)
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
-            return resp
-
     @staticmethod
-    def handle_transaction(sender: str, receiver: str, amount: Decimal, is_test: bool) -> str:
+    async def handle_get_leaderboard(n: int, is_test: bool) -> list[dict]:
         with tracer.start_as_current_span(
-                "handle_transaction",
-                attributes={'attr.sender': sender, 'attr.receiver': receiver, 'is_test': is_test}):
+                "handle_get_leaderboard",
+                attributes={'attr.n': n, 'is_test': is_test}):
             table_name: str = 'ledger'
             if is_test:
                 table_name = 'ledgerTest'
+            try:
+                return await Leaderboard.top(table_name, n)
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
 
-            #     todo check usernames are valid before transaction
+    @staticmethod
+    async def handle_get_history(username: str, limit: int, cursor: str | None, is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_get_history",
+                attributes={'attr.username': username, 'attr.limit': limit, 'is_test': is_test}):
+            journal_table: str = 'journal'
+            if is_test:
+                journal_table = 'journalTest'
+            try:
+                return await Journal.history(journal_table, username, limit, cursor)
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_get_journal_balance(username: str, is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_get_journal_balance",
+                attributes={'attr.username': username, 'is_test': is_test}):
+            journal_table: str = 'journal'
+            if is_test:
+                journal_table = 'journalTest'
+            try:
+                resp = await Journal.balance(journal_table, username)
+                # a long tail is folded for the next reads
+                if resp['tail'] >= Journal.JOURNAL_SNAPSHOT_EVERY:
+                    await Journal.compact(journal_table, username)
+                return resp
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_compact_journal(username: str, is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_compact_journal",
+                attributes={'attr.username': username, 'is_test': is_test}):
+            journal_table: str = 'journal'
+            if is_test:
+                journal_table = 'journalTest'
             try:
-                ping_recipient = AccountHandler.handle_get_account(receiver, is_test)
-                if "message" in ping_recipient and ping_recipient["message"] == 'item not found':
-                    raise ValueError('recipient not found')
-
-                sender_resp = AccountHandler.handle_modify_account(sender, amount * -1, is_test)
-                if sender_resp == 'update item success':
-                    receiver_resp = AccountHandler.handle_modify_account(receiver, amount, is_test)
-                    if receiver_resp != 'update item success':
-                        return 'transaction failed'
-                else:
-                    return 'transaction failed'
-
-                return sender_resp
+                snapshot = await Journal.compact(journal_table, username, min_entries=1)
+                return {**await Journal.balance(journal_table, username), 'compacted': snapshot}
+            except StorageUnavailableError:
+                raise
             except Exception as e:
-                if sender_resp == 'update item success':
-                    rollback_resp = AccountHandler.handle_modify_account(sender, amount, is_test)
-                    if rollback_resp != 'update item success':
-                        logger.info(f'failed to rollback transaction')
                 logger.info(f'error {e}')
                 raise ValueError(e)
@@ -0,0 +1,40 @@
+import logging
+
+from opentelemetry import trace
+
+from app.storage import Aggregates
+from app.storage.Resilience import StorageUnavailableError
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+
+class AggregatesHandler:
+    @staticmethod
+    async def handle_get_aggregates(is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_get_aggregates",
+                attributes={'is_test': is_test}):
+            aggregates_table: str = 'aggregates'
+            if is_test:
+                aggregates_table = 'aggregatesTest'
+            try:
+                totals = await Aggregates.read_totals(aggregates_table)
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+            # the holdings are valued at the current prices, without prices the totals are still served
+            try:
+                from app.common import Valuation
+
+                table = await Valuation.price_table()
+                coins = [{'id': coin_id, 'amount': amount} for coin_id, amount in totals['holdings'].items()]
+                holdings = Valuation.value_batch([coins], table)[0]
+                totals['holdings_value'] = holdings['value']
+                totals['unpriced'] = holdings['unpriced']
+                totals['assets_under_management'] = float(totals['ledger_balance']) + holdings['value']
+            except Exception as e:
+                logger.warning(f'holdings not valued: {e}')
+            return totals
@@ -9,5 +9,6 @@ async def http_exception_handler (request: Request, exc: HTTPException):
     logger.exception(exc, extra={'uuid':request.state.correlation_id, 'type':'api-error'})
     return JSONResponse(
         status_code=exc.status_code, 
-        content={"uuid": request.state.correlation_id, "message": exc.detail}
+        content={"uuid": request.state.correlation_id, "message": exc.detail},
+        headers=exc.headers
         )
@@ -1,19 +1,37 @@
 import logging
+import time
 from typing import List
 from decimal import *
 
 from opentelemetry import trace
 
 from app.models.Portfolio import Portfolio
-from app.storage.Dynamo import Dynamo
+from app.storage import ValueHistory
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import ConditionalCheckFailedError
+from app.storage.Resilience import StorageUnavailableError
 
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
 
+# portfolios are stored as a map keyed by coin id so a single coin can be set or removed in place.
+# Items written before that are lists of coins and get migrated the first time they are updated.
+def portfolio_to_map(coins: list | dict) -> dict:
+    if isinstance(coins, dict):
+        return coins
+    return {coin["id"]: coin for coin in coins}
+
+
+def portfolio_to_list(coins: list | dict) -> list:
+    if isinstance(coins, dict):
+        return list(coins.values())
+    return coins
+
+
 class PortfolioHandler:
     @staticmethod
-    def handle_get_portfolio(username: str, is_test: bool) -> dict:
+    async def handle_get_portfolio(username: str, is_test: bool) -> dict:
         with tracer.start_as_current_span(
                 "handle_get_portfolio",
                 attributes={'attr.username': username, 'attr.is_test': is_test},
@@ -23,14 +41,110 @@ class PortfolioHandler:
             if is_test:
                 table_name = 'portfolioTest'
             try:
-                user = Dynamo.get_item(table_name, {'name': username})
+                user = await AsyncDynamo.get_item(table_name, {'name': username})
+                if 'portfolio' in user:
+                    user['portfolio'] = portfolio_to_list(user['portfolio'])
                 return user
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_batch_get_portfolios(usernames: list[str], is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_batch_get_portfolios",
+                attributes={'attr.count': len(usernames), 'attr.is_test': is_test}
+        ):
+            table_name: str = 'portfolio'
+            if is_test:
+                table_name = 'portfolioTest'
+            try:
+                items = (await AsyncDynamo.batch_get({table_name: [{'name': name} for name in usernames]}))[table_name]
+                found: dict = {}
+                for item in items:
+                    item['portfolio'] = portfolio_to_list(item.get('portfolio', []))
+                    found[item['name']] = item
+                return {name: found.get(name, {'message': 'item not found'}) for name in usernames}
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_get_portfolio_value(username: str, is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_get_portfolio_value",
+                attributes={'attr.username': username, 'attr.is_test': is_test}
+        ):
+            # numpy is imported by the first valuation, not by the cold start
+            from app.common import Valuation
+
+            table_name: str = 'portfolio'
+            if is_test:
+                table_name = 'portfolioTest'
+            try:
+                item = await AsyncDynamo.get_item(table_name, {'name': username})
+                if 'portfolio' not in item:
+                    return item
+                table = await Valuation.price_table()
+                return {'name': username, **Valuation.value_portfolio(portfolio_to_list(item['portfolio']), table),
+                        'prices_loaded_at': table.loaded_at}
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
     @staticmethod
-    def handle_create_portfolio(username: str, portfolio: Portfolio, is_test: bool) -> str:
+    async def handle_batch_value_portfolios(usernames: list[str], is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_batch_value_portfolios",
+                attributes={'attr.count': len(usernames), 'attr.is_test': is_test}
+        ):
+            from app.common import Valuation
+
+            table_name: str = 'portfolio'
+            if is_test:
+                table_name = 'portfolioTest'
+            try:
+                items = (await AsyncDynamo.batch_get({table_name: [{'name': name} for name in usernames]}))[table_name]
+                table = await Valuation.price_table()
+                values = Valuation.value_batch([portfolio_to_list(item.get('portfolio', [])) for item in items], table)
+                found = {item['name']: value for item, value in zip(items, values)}
+                return {'values': {name: found.get(name, {'message': 'item not found'}) for name in usernames},
+                        'prices_loaded_at': table.loaded_at}
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_get_portfolio_history(username: str, range_name: str, resolution: str | None,
+                                           is_test: bool) -> dict:
+        with tracer.start_as_current_span(
+                "handle_get_portfolio_history",
+                attributes={'attr.username': username, 'attr.range': range_name, 'attr.is_test': is_test}
+        ):
+            history_table: str = 'portfolioHistory'
+            if is_test:
+                history_table = 'portfolioHistoryTest'
+            try:
+                span, step = ValueHistory.resolve(range_name, resolution)
+                end = int(time.time())
+                return {'name': username, 'range': range_name,
+                        **await ValueHistory.history(history_table, username, end - span, end, step)}
+            except StorageUnavailableError:
+                raise
+            except Exception as e:
+                logger.info(f'error {e}')
+                raise ValueError(e)
+
+    @staticmethod
+    async def handle_create_portfolio(username: str, portfolio: Portfolio, is_test: bool) -> str:
         with tracer.start_as_current_span(
                 "handle_create_portfolio",
                 attributes={'username': username, 'attr.is_test': is_test}
@@ -39,14 +153,17 @@ class PortfolioHandler:
             if is_test:
                 table_name = 'portfolioTest'
             try:
-                resp = Dynamo.create_item(table_name, {'name': portfolio.username, 'portfolio': portfolio.portfolio})
+                resp = await AsyncDynamo.create_item(table_name, {'name': portfolio.username,
+                                                                  'portfolio': portfolio_to_map(portfolio.portfolio)})
                 return resp
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
     @staticmethod
-    def handle_update_portfolio(username: str, portfolio: Portfolio, is_test: bool, update_type: str) -> str:
+    async def handle_update_portfolio(username: str, portfolio: Portfolio, is_test: bool, update_type: str) -> str:
         with tracer.start_as_current_span(
                 "handle_create_portfolio",
                 attributes={'username': username, 'attr.is_test': is_test}
@@ -55,40 +172,65 @@ class PortfolioHandler:
             if is_test:
                 table_name = 'portfolioTest'
             try:
-                original_portfolio = PortfolioHandler.handle_get_portfolio(username, is_test)
-                new_portfolio: list = original_portfolio['portfolio']
                 coin_portfolio: list[object] = portfolio.portfolio
+                names: dict = {}
+                values: dict = {':map': 'M', ':one': 1}
 
                 if update_type == 'buy':
-
-                    for coin in coin_portfolio:
-                        coin["amount"] = Decimal(coin["amount"])
-                        print(f'coin is: {coin}')
-                        print(f'coin id is: {coin["id"]}')
-                        coin_id = coin["id"]
-                        found_coins = [item for item in new_portfolio if item.get('id') == coin_id]
-                        # this section modifies existing quantity of coin already in portfolio
-
-                        if len(found_coins) > 0:
-                            coin_index = new_portfolio.index(found_coins[0])
-                            # overwrite existing coin with updated quantity
-                            new_portfolio[coin_index] = coin
-                        else:
-                            new_portfolio.append(coin)
-
+                    # overwrite each coin in place, whatever else the portfolio holds is not read or rewritten.
+                    # Two paths to the same coin would overlap, the last entry of a coin wins
+                    assignments = []
+                    for index, coin in enumerate(portfolio_to_map(coin_portfolio).values()):
+                        coin["amount"] = Decimal(str(coin["amount"]))
+                        logger.debug('coin is: %s', coin)
+                        names[f'#c{index}'] = coin["id"]
+                        values[f':c{index}'] = coin
+                        assignments.append(f'portfolio.#c{index} = :c{index}')
+                    update_expression = 'SET ' + ', '.join(assignments) + ' ADD version :one'
                 elif update_type == 'sell':
-                    coin_id = coin_portfolio[0]["id"]
-
-                    new_portfolio = [coin for coin in new_portfolio if coin["id"] != coin_id]
+                    names['#c0'] = coin_portfolio[0]["id"]
+                    update_expression = 'REMOVE portfolio.#c0 ADD version :one'
+                else:
+                    raise ValueError(f'unknown update type {update_type}')
 
-                resp = Dynamo.create_item(table_name, {'name': portfolio.username, 'portfolio': new_portfolio})
-                return resp
+                key: dict = {'name': portfolio.username}
+                condition: str = 'attribute_type(portfolio, :map)'
+                # the new item is returned to be written through to the shared cache
+                try:
+                    await AsyncDynamo.update_item(table_name, key, update_expression, expression_values=values,
+                                                  expression_names=names, condition_expression=condition,
+                                                  return_values='ALL_NEW')
+                except ConditionalCheckFailedError:
+                    await PortfolioHandler.migrate_portfolio(table_name, portfolio.username)
+                    await AsyncDynamo.update_item(table_name, key, update_expression, expression_values=values,
+                                                  expression_names=names, condition_expression=condition,
+                                                  return_values='ALL_NEW')
+                return 'insert item succeeded'
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
 
     @staticmethod
-    def handle_delete_portfolio(username: str, is_test: bool) -> str:
+    async def migrate_portfolio(table_name: str, username: str):
+        # rewrite a list shaped portfolio as a map, unless another writer changed it in the meantime
+        item = await AsyncDynamo.get_item(table_name, {'name': username})
+        if 'portfolio' not in item:
+            raise ValueError(f'portfolio not found for {username}')
+        if isinstance(item['portfolio'], dict):
+            return
+        logger.info(f'migrating portfolio of {username} to a map')
+        try:
+            await AsyncDynamo.create_item(table_name, {**item, 'portfolio': portfolio_to_map(item['portfolio']),
+                                                       'version': item.get('version', 0) + 1},
+                                          condition_expression='portfolio = :old',
+                                          expression_values={':old': item['portfolio']})
+        except ConditionalCheckFailedError:
+            logger.info(f'portfolio of {username} changed during migration')
+
+    @staticmethod
+    async def handle_delete_portfolio(username: str, is_test: bool) -> str:
         with tracer.start_as_current_span(
                 "handle_delete_portfolio",
                 attributes={'username': username, 'is_test': is_test}):
@@ -96,8 +238,10 @@ class PortfolioHandler:
             if is_test:
                 table_name = 'portfolioTest'
             try:
-                resp = Dynamo.delete_item(table_name, {'name': username})
+                resp = await AsyncDynamo.delete_item(table_name, {'name': username})
                 return resp
+            except StorageUnavailableError:
+                raise
             except Exception as e:
                 logger.info(f'error {e}')
                 raise ValueError(e)
@@ -0,0 +1,16 @@
+import logging
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from app.storage.Resilience import StorageUnavailableError
+
+logger = logging.getLogger()
+
+async def storage_unavailable_handler (request: Request, exc: StorageUnavailableError):
+    logger.warning(exc, extra={'uuid':request.state.correlation_id, 'type':'storage-unavailable'})
+    return JSONResponse(
+        status_code=503,
+        content={"uuid": request.state.correlation_id, "message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+        )
@@ -0,0 +1,264 @@
+import asyncio
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.handlers import account_handler
+from app.handlers.account_handler import AccountHandler
+from app.storage import AsyncDynamo as async_dynamo_module
+from app.storage import Dynamo as dynamo_module
+from app.storage import Journal, LedgerShards
+from app.storage.AsyncDynamo import AsyncDynamo, read_coalescer
+from app.storage.LocalDynamo import LocalDynamoResource
+from app.storage.Resilience import StorageUnavailableError
+
+
+class TestBatchTransactions(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        patcher = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        read_coalescer.clear()
+        self.addCleanup(read_coalescer.clear)
+        patcher = mock.patch.object(Journal, 'JOURNAL_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ledger = self.resource.Table('ledgerTest')
+        for name, balance in (('alice', 100), ('bob', 50), ('carol', 0)):
+            self.ledger.put_item(Item={'name': name, 'balance': Decimal(balance)})
+
+    def balances(self) -> dict:
+        return {item['name']: item['balance'] for item in self.ledger.items.values()}
+
+    def test_transfers_are_netted_per_account(self):
+        transfers = [{'sender': 'alice', 'receiver': 'bob', 'amount': Decimal(30)},
+                     {'sender': 'bob', 'receiver': 'carol', 'amount': Decimal(70)},
+                     {'sender': 'carol', 'receiver': 'alice', 'amount': Decimal(70)},
+                     {'sender': 'bob', 'receiver': 'alice', 'amount': Decimal(20)},
+                     {'sender': 'alice', 'receiver': 'alice', 'amount': Decimal(5)},
+                     {'sender': 'alice', 'receiver': 'dave', 'amount': Decimal(5)}]
+        resp = asyncio.run(AccountHandler.handle_batch_transactions(transfers, True))
+
+        # bob only covers his transfer to carol thanks to alice's, carol nets to zero and is not written
+        self.assertEqual([result['status'] for result in resp['results']],
+                         ['committed'] * 3 + ['rejected'] * 3)
+        self.assertEqual([result.get('reason') for result in resp['results'][3:]],
+                         ['sender not found or insufficient funds', 'sender and receiver must be different accounts',
+                          'recipient not found'])
+        self.assertEqual((resp['committed'], resp['rejected'], resp['accounts_written']), (3, 3, 2))
+        self.assertEqual(self.balances(), {'alice': 140, 'bob': 10, 'carol': 0})
+
+    def racing(self, race):
+        # runs race once, between the first read of the batch and its write
+        batch_get = AsyncDynamo.batch_get
+        calls = []
+
+        async def racing_batch_get(keys_by_table, *args):
+            items = await batch_get(keys_by_table, *args)
+            if 'aggregatesTest' in keys_by_table:
+                # the leaderboard read after the write
+                return items
+            if not calls:
+                race()
+            calls.append(keys_by_table)
+            return items
+
+        return mock.patch.object(AsyncDynamo, 'batch_get', racing_batch_get), calls
+
+    def journal(self, name: str) -> list[tuple]:
+        entries = sorted((item['entry_id'], item['kind'], item['amount'])
+                         for item in self.resource.Table('journalTest').items.values() if item['name'] == name)
+        return [(kind, amount) for _, kind, amount in entries]
+
+    def test_cancelled_first_chunk_is_replanned(self):
+        # alice spends between the read and the write of the first attempt, nothing was written yet
+        patch, calls = self.racing(lambda: self.ledger.put_item(Item={'name': 'alice', 'balance': Decimal(35)}))
+        transfers = [{'sender': 'alice', 'receiver': 'bob', 'amount': Decimal(30)},
+                     {'sender': 'alice', 'receiver': 'carol', 'amount': Decimal(10)}]
+        with mock.patch.object(account_handler, 'TRANSACT_MAX_ITEMS', 1), patch:
+            resp = asyncio.run(AccountHandler.handle_batch_transactions(transfers, True))
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([result['status'] for result in resp['results']], ['committed', 'rejected'])
+        self.assertEqual(self.balances(), {'alice': 5, 'bob': 80, 'carol': 0})
+
+    def test_failed_chunk_after_a_commit_is_reverted_and_not_retried(self):
+        # bob is deleted between the read and the write, the debit of alice commits before his credit fails
+        patch, calls = self.racing(lambda: self.ledger.delete_item(Key={'name': 'bob'}))
+        transfers = [{'sender': 'alice', 'receiver': 'bob', 'amount': Decimal(30)},
+                     {'sender': 'alice', 'receiver': 'carol', 'amount': Decimal(10)}]
+        with mock.patch.object(account_handler, 'TRANSACT_MAX_ITEMS', 1), patch:
+            with self.assertRaises(ValueError):
+                asyncio.run(AccountHandler.handle_batch_transactions(transfers, True))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.balances(), {'alice': 100, 'carol': 0})
+        # the reverted debit stays in the journal next to its reversal
+        self.assertEqual(self.journal('alice'), [('batch', -40), ('reversal', 40)])
+
+    def test_failed_revert_is_logged_and_not_retried(self):
+        patch, calls = self.racing(lambda: self.ledger.delete_item(Key={'name': 'bob'}))
+        transact_write_items = AsyncDynamo.transact_write_items
+
+        async def failing_revert(actions):
+            if any(action.get('Put', {}).get('Item', {}).get('kind') == 'reversal' for action in actions):
+                raise StorageUnavailableError('ledgerTest')
+            return await transact_write_items(actions)
+
+        transfers = [{'sender': 'alice', 'receiver': 'bob', 'amount': Decimal(30)}]
+        with mock.patch.object(account_handler, 'TRANSACT_MAX_ITEMS', 1), patch, \
+                mock.patch.object(AsyncDynamo, 'transact_write_items', failing_revert), \
+                self.assertLogs(account_handler.logger, 'ERROR') as logs:
+            with self.assertRaises(ValueError) as raised:
+                asyncio.run(AccountHandler.handle_batch_transactions(transfers, True))
+
+        self.assertIsInstance(raised.exception.args[0], account_handler.BatchRevertError)
+        self.assertEqual(len(calls), 1)
+        self.assertIn(f"('ledgerTest', 'alice', Decimal('-30'))", logs.output[0])
+        self.assertEqual(self.balances(), {'alice': 70, 'carol': 0})
+
+
+class TestShardedAccounts(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        patcher = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for cache in (read_coalescer, LedgerShards.shard_counts, LedgerShards.shard_totals):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.ledger = self.resource.Table('ledgerTest')
+        for name, balance in (('house', 100), ('bob', 50)):
+            self.ledger.put_item(Item={'name': name, 'balance': Decimal(balance)})
+
+    def items(self) -> dict:
+        return {item['name']: item['balance'] for item in self.ledger.items.values()}
+
+    def test_sharded_account_reads_and_writes_like_a_single_item(self):
+        asyncio.run(AccountHandler.handle_shard_account('house', 4, True))
+        self.assertEqual(self.items(), {'house': 100, 'house#1': 0, 'house#2': 0, 'house#3': 0, 'bob': 50})
+
+        for _ in range(20):
+            asyncio.run(AccountHandler.handle_modify_account('house', Decimal(5), True))
+        self.assertGreater(sum(1 for name, balance in self.items().items() if name.startswith('house#') and balance), 0)
+        self.assertEqual(asyncio.run(AccountHandler.handle_get_account('house', True))['balance'], 200)
+
+        # more than any single shard holds
+        resp = asyncio.run(AccountHandler.handle_modify_account('house', Decimal(-150), True))
+        self.assertEqual(resp, {'name': 'house', 'balance': 50})
+        with self.assertRaises(ValueError):
+            asyncio.run(AccountHandler.handle_transaction('house', 'bob', Decimal(51), True))
+        asyncio.run(AccountHandler.handle_transaction('house', 'bob', Decimal(50), True))
+        asyncio.run(AccountHandler.handle_transaction('bob', 'house', Decimal(30), True))
+        accounts = asyncio.run(AccountHandler.handle_batch_get_accounts(['house', 'bob'], True))
+        self.assertEqual({name: item['balance'] for name, item in accounts.items()}, {'house': 30, 'bob': 70})
+
+        asyncio.run(AccountHandler.handle_shard_account('house', 1, True))
+        self.assertEqual(self.items(), {'house': 30, 'bob': 70})
+        self.assertNotIn('shards', self.ledger.get_item(Key={'name': 'house'})['Item'])
+
+    def test_stale_shard_count_is_retried(self):
+        asyncio.run(AccountHandler.handle_shard_account('house', 4, True))
+        asyncio.run(AccountHandler.handle_get_account('house', True))
+        # another container folds the shards back, this one still takes the account as sharded
+        asyncio.run(LedgerShards.unshard_account('ledgerTest', 'house'))
+        LedgerShards.shard_counts.set(('ledgerTest', 'house'), 4)
+
+        with mock.patch.object(LedgerShards.random, 'randrange', side_effect=lambda count: count - 1):
+            asyncio.run(AccountHandler.handle_transaction('bob', 'house', Decimal(10), True))
+        self.assertEqual(self.items(), {'house': 110, 'bob': 40})
+
+    def test_creating_a_sharded_account_again_keeps_its_shards(self):
+        asyncio.run(AccountHandler.handle_shard_account('house', 2, True))
+        with self.assertRaises(ValueError):
+            asyncio.run(AccountHandler.handle_create_account('house', Decimal(0), True))
+        self.assertEqual(self.items(), {'house': 100, 'house#1': 0, 'bob': 50})
+        self.assertEqual(self.ledger.get_item(Key={'name': 'house'})['Item']['shards'], 2)
+
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        patcher = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        read_coalescer.clear()
+        self.addCleanup(read_coalescer.clear)
+        patcher = mock.patch.object(Journal, 'JOURNAL_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name, balance in (('alice', 0), ('bob', 0)):
+            self.resource.Table('ledgerTest').put_item(Item={'name': name, 'balance': Decimal(balance)})
+
+    def test_movements_are_journaled_and_paginated_newest_first(self):
+        asyncio.run(AccountHandler.handle_modify_account('alice', Decimal(100), True))
+        for amount in range(1, 6):
+            asyncio.run(AccountHandler.handle_transaction('alice', 'bob', Decimal(amount), True))
+        asyncio.run(AccountHandler.handle_modify_account('alice', Decimal(-10), True))
+
+        pages, cursor = [], None
+        while True:
+            page = asyncio.run(AccountHandler.handle_get_history('alice', 3, cursor, True))
+            pages.append([(entry['kind'], entry['amount']) for entry in page['entries']])
+            cursor = page['cursor']
+            if cursor is None:
+                break
+        self.assertEqual(sum(pages, []), [('withdrawal', -10)]
+                         + [('transfer_out', -amount) for amount in range(5, 0, -1)] + [('deposit', 100)])
+        bob = asyncio.run(AccountHandler.handle_get_history('bob', 10, None, True))['entries']
+        self.assertEqual({entry['counterparty'] for entry in bob}, {'alice'})
+
+    def test_a_cursor_outside_the_entries_is_rejected(self):
+        from fastapi.testclient import TestClient
+        from app.app import app
+        from app.common.Auth import get_current_active_user
+
+        asyncio.run(AccountHandler.handle_modify_account('alice', Decimal(100), True))
+        with mock.patch.object(Journal, 'JOURNAL_SETTLE_SECONDS', 0):
+            asyncio.run(AccountHandler.handle_compact_journal('alice', True))
+        app.dependency_overrides[get_current_active_user] = lambda: {'name': 'alice'}
+        self.addCleanup(app.dependency_overrides.clear)
+        client = TestClient(app)
+        for cursor in ('s#99999999999999999999', 'garbage', 'e#~'):
+            response = client.get('/account/alice/history', params={'cursor': cursor}, headers={'is-test': 'true'})
+            self.assertEqual(response.status_code, 400, cursor)
+        response = client.get('/account/alice/history', params={'cursor': 'e#99999999999999999999'},
+                              headers={'is-test': 'true'})
+        self.assertEqual((response.status_code, len(response.json()['response']['entries'])), (200, 1))
+        with self.assertRaises(ValueError):
+            asyncio.run(AccountHandler.handle_get_history('alice', 10, 's#1', True))
+
+    def test_compaction_folds_settled_entries_into_a_snapshot(self):
+        for _ in range(4):
+            asyncio.run(AccountHandler.handle_modify_account('alice', Decimal(5), True))
+        with mock.patch.object(Journal, 'JOURNAL_SETTLE_SECONDS', 0):
+            resp = asyncio.run(AccountHandler.handle_compact_journal('alice', True))
+        self.assertEqual((resp['compacted']['balance'], resp['compacted']['entries']), (20, 4))
+        asyncio.run(AccountHandler.handle_modify_account('alice', Decimal(-5), True))
+
+        resp = asyncio.run(AccountHandler.handle_get_journal_balance('alice', True))
+        self.assertEqual((resp['balance'], resp['tail']), (15, 1))
+        # the snapshot is not an entry of the history
+        self.assertEqual(len(asyncio.run(AccountHandler.handle_get_history('alice', 10, None, True))['entries']), 5)
+
+    def test_a_deposit_is_one_round_trip_unless_journaled(self):
+        def storage_calls() -> list[str]:
+            with mock.patch.object(async_dynamo_module, 'run_in_executor',
+                                   wraps=async_dynamo_module.run_in_executor) as run:
+                resp = asyncio.run(AccountHandler.handle_modify_account('alice', Decimal(5), True))
+            self.assertEqual(resp['name'], 'alice')
+            return [call.args[0].__name__ for call in run.call_args_list]
+
+        # the update returns the new balance, a journaled deposit reads it back after the transaction
+        with mock.patch.object(Journal, 'JOURNAL_ENABLED', False):
+            self.assertEqual(storage_calls(), ['update_item'])
+        self.assertEqual(storage_calls(), ['transact_write_items', 'batch_get'])
+
+
+if __name__ == '__main__':
+    unittest.main()
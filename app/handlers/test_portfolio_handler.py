@@ -0,0 +1,87 @@
+import asyncio
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.common import Valuation
+from app.handlers.portfolio_handler import PortfolioHandler
+from app.models.Portfolio import Portfolio
+from app.storage import Dynamo as dynamo_module
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+class TestPortfolioHandler(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        patcher = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored(self, name: str) -> dict:
+        return self.resource.Table('portfolioTest').get_item(Key={'name': name})['Item']['portfolio']
+
+    def test_buy_and_sell_update_single_coins(self):
+        asyncio.run(PortfolioHandler.handle_create_portfolio('alice', Portfolio(username='alice', portfolio=[
+            {'name': 'litecoin', 'amount': 1, 'id': 'litecoin'}]), True))
+        asyncio.run(PortfolioHandler.handle_update_portfolio('alice', Portfolio(username='alice', portfolio=[
+            {'name': 'bitcoin', 'amount': '0.5', 'id': 'bitcoin'}]), True, 'buy'))
+        self.assertEqual(set(self.stored('alice')), {'litecoin', 'bitcoin'})
+
+        asyncio.run(PortfolioHandler.handle_update_portfolio('alice', Portfolio(username='alice', portfolio=[
+            {'id': 'litecoin'}]), True, 'sell'))
+        self.assertEqual(self.stored('alice'), {'bitcoin': {'name': 'bitcoin', 'amount': Decimal('0.5'),
+                                                            'id': 'bitcoin'}})
+        resp = asyncio.run(PortfolioHandler.handle_get_portfolio('alice', True))
+        self.assertEqual(resp['portfolio'], [{'name': 'bitcoin', 'amount': Decimal('0.5'), 'id': 'bitcoin'}])
+
+    def test_buy_of_a_coin_listed_twice_keeps_the_last_entry(self):
+        asyncio.run(PortfolioHandler.handle_create_portfolio('alice', Portfolio(username='alice', portfolio=[
+            {'name': 'litecoin', 'amount': 1, 'id': 'litecoin'}]), True))
+        update_item = mock.patch('app.handlers.portfolio_handler.AsyncDynamo.update_item',
+                                 wraps=AsyncDynamo.update_item)
+        with update_item as update:
+            asyncio.run(PortfolioHandler.handle_update_portfolio('alice', Portfolio(username='alice', portfolio=[
+                {'name': 'bitcoin', 'amount': 1, 'id': 'bitcoin'},
+                {'name': 'bitcoin', 'amount': 2, 'id': 'bitcoin'}]), True, 'buy'))
+
+        # DynamoDB rejects an update expression with two paths to the same coin
+        self.assertEqual(list(update.call_args.kwargs['expression_names'].values()), ['bitcoin'])
+        self.assertEqual(self.stored('alice')['bitcoin']['amount'], 2)
+
+    def test_list_portfolio_is_migrated_on_first_update(self):
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'bob', 'portfolio': [
+            {'name': 'litecoin', 'amount': Decimal(1), 'id': 'litecoin'}]})
+        asyncio.run(PortfolioHandler.handle_update_portfolio('bob', Portfolio(username='bob', portfolio=[
+            {'name': 'litecoin', 'amount': 3, 'id': 'litecoin'}]), True, 'buy'))
+        self.assertEqual(self.stored('bob'), {'litecoin': {'name': 'litecoin', 'amount': Decimal(3),
+                                                           'id': 'litecoin'}})
+
+    def test_missing_portfolio_is_an_error(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(PortfolioHandler.handle_update_portfolio('carol', Portfolio(username='carol', portfolio=[
+                {'name': 'litecoin', 'amount': 3, 'id': 'litecoin'}]), True, 'buy'))
+
+    def test_portfolios_are_valued_at_the_loaded_prices(self):
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'alice', 'portfolio': {
+            'bitcoin': {'name': 'bitcoin', 'amount': Decimal('0.5'), 'id': 'bitcoin'},
+            'dogecoin': {'name': 'dogecoin', 'amount': Decimal(100), 'id': 'dogecoin'}}})
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'bob', 'portfolio': [
+            {'name': 'litecoin', 'amount': Decimal(4), 'id': 'litecoin'}]})
+        table = Valuation.PriceTable({'bitcoin': 60000.0, 'litecoin': 80.25}, 0)
+        with mock.patch.object(Valuation.price_tables, 'get_or_load', mock.AsyncMock(return_value=table)):
+            alice = asyncio.run(PortfolioHandler.handle_get_portfolio_value('alice', True))
+            batch = asyncio.run(PortfolioHandler.handle_batch_value_portfolios(['alice', 'bob', 'carol'], True))
+
+        self.assertEqual((alice['value'], alice['unpriced']), (30000.0, ['dogecoin']))
+        self.assertEqual([coin['value'] for coin in alice['coins']], [30000.0, None])
+        self.assertEqual(batch['values'], {'alice': {'value': 30000.0, 'unpriced': ['dogecoin']},
+                                           'bob': {'value': 321.0, 'unpriced': []},
+                                           'carol': {'message': 'item not found'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.handlers import user_handler
+from app.handlers.user_handler import UserHandler
+from app.storage import Dynamo as dynamo_module
+from app.storage.AsyncDynamo import read_coalescer
+from app.storage.Dynamo import Dynamo
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+class TestUserHandler(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        for patch in (mock.patch.object(dynamo_module, 'dyn_resource', self.resource),
+                      mock.patch.object(user_handler, 'get_password_hash_async',
+                                        mock.AsyncMock(side_effect=lambda password: f'hashed {password}'))):
+            patch.start()
+            self.addCleanup(patch.stop)
+        read_coalescer.clear()
+        self.addCleanup(read_coalescer.clear)
+        self.ledger = self.resource.Table('ledgerTest')
+
+    def test_sign_up_does_not_overwrite_an_existing_account_or_portfolio(self):
+        # an account left without its user, sharded
+        self.ledger.put_item(Item={'name': 'alice', 'balance': Decimal(40), 'shards': 2})
+        self.ledger.put_item(Item={'name': 'alice#1', 'balance': Decimal(60)})
+
+        resp = asyncio.run(UserHandler.handle_create_user('alice', 'secret', True))
+        self.assertEqual(resp, {'message': 'account already exists'})
+        self.assertEqual(self.ledger.get_item(Key={'name': 'alice'})['Item']['shards'], 2)
+        self.assertNotIn('Item', self.resource.Table('usersTest').get_item(Key={'name': 'alice'}))
+
+        # a portfolio left without its user and account
+        portfolio = {'name': 'carol',
+                     'portfolio': {'bitcoin': {'name': 'bitcoin', 'amount': Decimal(2), 'id': 'bitcoin'}}}
+        self.resource.Table('portfolioTest').put_item(Item=portfolio)
+        resp = asyncio.run(UserHandler.handle_create_user('carol', 'secret', True))
+        self.assertEqual(resp, {'message': 'account already exists'})
+        self.assertEqual(self.resource.Table('portfolioTest').get_item(Key={'name': 'carol'})['Item'], portfolio)
+        self.assertNotIn('Item', self.ledger.get_item(Key={'name': 'carol'}))
+
+        self.assertIn('access_token', asyncio.run(UserHandler.handle_create_user('bob', 'secret', True)))
+        self.assertEqual(asyncio.run(UserHandler.handle_create_user('bob', 'secret', True)),
+                         {'message': 'username already exists'})
+
+    def test_dashboard_is_one_round_trip_without_the_password(self):
+        self.resource.Table('usersTest').put_item(Item={'name': 'alice', 'password': 'hashed alice'})
+        self.resource.Table('usersTest').put_item(Item={'name': 'bob', 'password': 'hashed bob'})
+        for name, balance in (('alice', 40), ('bob', 10)):
+            self.ledger.put_item(Item={'name': name, 'balance': Decimal(balance)})
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'alice', 'portfolio': {
+            'bitcoin': {'name': 'bitcoin', 'amount': Decimal(1), 'id': 'bitcoin'}}})
+        current_user = {'name': 'alice', 'password': 'hashed alice'}
+
+        with mock.patch.object(self.resource, 'batch_get_item', wraps=self.resource.batch_get_item) as batch_get, \
+                mock.patch.object(Dynamo, 'get_item', wraps=Dynamo.get_item) as get_item:
+            own = asyncio.run(UserHandler.handle_get_dashboard('alice', True, current_user))
+            own_requests = [call.kwargs['RequestItems'] for call in batch_get.call_args_list]
+            other = asyncio.run(UserHandler.handle_get_dashboard('bob', True, current_user))
+
+        # one BatchGetItem per dashboard: the signed in user is reused from authentication, another
+        # user is read in the same batch as the account and portfolio
+        self.assertEqual((batch_get.call_count, get_item.call_count), (2, 0))
+        self.assertEqual([sorted(request) for request in own_requests], [['ledgerTest', 'portfolioTest']])
+        self.assertEqual(sorted(batch_get.call_args.kwargs['RequestItems']),
+                         ['ledgerTest', 'portfolioTest', 'usersTest'])
+        self.assertEqual(own, {'user': {'name': 'alice'},
+                               'account': {'name': 'alice', 'balance': Decimal(40)},
+                               'portfolio': {'name': 'alice', 'portfolio': [
+                                   {'name': 'bitcoin', 'amount': Decimal(1), 'id': 'bitcoin'}]}})
+        self.assertEqual(other['user'], {'name': 'bob'})
+        self.assertEqual(other['portfolio'], {'message': 'item not found'})
+        self.assertIn('password', current_user)
+
+
+if __name__ == '__main__':
+    unittest.main()
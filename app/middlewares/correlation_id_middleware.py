@@ -1,23 +1,29 @@
 import uuid
 
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 
-class CorrelationIdMiddleware (BaseHTTPMiddleware):
+# Plain ASGI middleware : no task or stream wrapping around the app, and streaming responses pass through untouched
+class CorrelationIdMiddleware:
 
     def __init__(self, app):
-        super().__init__(app)
+        self.app = app
 
     # Add or use the provided correlation ID (request header : x-correlation-id)
-    async def dispatch (self, request, call_next):
+    async def __call__(self, scope, receive, send):
 
-        # Add or reuse correlation id
-        request.state.correlation_id = request.headers.get("x-correlation-id", str(uuid.uuid4()))
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        # Next middleware
-        response = await call_next(request)
+        # Add or reuse correlation id
+        correlation_id = Headers(scope=scope).get("x-correlation-id") or str(uuid.uuid4())
+        scope.setdefault("state", {})["correlation_id"] = correlation_id
 
         # Add correlation id header to response
-        response.headers["x-correlation-id"] = request.state.correlation_id
+        async def send_with_correlation_id(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["x-correlation-id"] = correlation_id
+            await send(message)
 
-        # Return response
-        return response
\ No newline at end of file
+        # Next middleware
+        await self.app(scope, receive, send_with_correlation_id)
@@ -0,0 +1,19 @@
+from app.storage.Resilience import request_deadline, start_deadline
+
+# Plain ASGI middleware : starts the deadline the storage retries of the request have to fit in
+class DeadlineMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = start_deadline()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
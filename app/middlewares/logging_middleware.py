@@ -1,25 +1,36 @@
 import logging
-import uuid
+import time
 
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import URL
 
-class LoggingMiddleware (BaseHTTPMiddleware):
+# Plain ASGI middleware : the request and response are logged without buffering the body
+class LoggingMiddleware:
 
     def __init__(self, app):
-        super().__init__(app)
+        self.app = app
         self.logger = logging.getLogger()
 
-    async def dispatch (self, request, call_next):
+    async def __call__(self, scope, receive, send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
         # Log the request
-        req_uuid = request.state.correlation_id
-        self.logger.info("Request", extra={'uuid':req_uuid, 'type':'api-request', 'method':str(request.method).upper(), 'url':str(request.url)})
+        req_uuid = scope.get("state", {}).get("correlation_id")
+        self.logger.info("Request", extra={'uuid':req_uuid, 'type':'api-request', 'method':scope["method"].upper(), 'url':str(URL(scope=scope))})
+        started = time.perf_counter()
+        status_code = None
 
-        # Next middleware
-        response = await call_next(request)
+        # Log the response once its last body chunk is sent
+        async def send_and_log(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                duration_ms = round((time.perf_counter() - started) * 1000, 2)
+                self.logger.info("Response sent", extra={'uuid':req_uuid, 'type':'api-response', 'code':status_code, 'duration_ms':duration_ms})
 
-        # Log the response
-        self.logger.info("Response sent", extra={'uuid':req_uuid, 'type':'api-response', 'code':response.status_code})
-            
-        # Return response
-        return response
\ No newline at end of file
+        # Next middleware
+        await self.app(scope, receive, send_and_log)
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+from app.models.Transaction import Transaction
+
+MAX_BATCH_SIZE = 500
+
+
+class UsernameBatch(BaseModel):
+    usernames: list[str]
+
+
+class TransferBatch(BaseModel):
+    transfers: list[Transaction]
@@ -0,0 +1,78 @@
+import sys
+import time
+from importlib.abc import MetaPathFinder
+
+
+# Times every module imported while installed, to see what a cold start spends its init on.
+# Enabled with IMPORT_PROFILE=1, it adds overhead to each import so it is off by default.
+class ImportProfiler(MetaPathFinder):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stack: list[list[float]] = []
+        self.timings: dict[str, tuple[float, float]] = {}
+        self.finding = False
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        if self.finding:
+            return None
+        self.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                        spec.loader = TimingLoader(self, fullname, spec.loader)
+                    return spec
+            return None
+        finally:
+            self.finding = False
+
+    def record(self, fullname: str, func, *args):
+        # self time excludes the imports triggered while this module was executing
+        self.stack.append([0.0])
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self.stack.pop()[0]
+            if self.stack:
+                self.stack[-1][0] += elapsed
+            self_time, total = self.timings.get(fullname, (0.0, 0.0))
+            self.timings[fullname] = (self_time + elapsed - children, total + elapsed)
+
+    def report(self, top: int = 25) -> dict:
+        ranked = sorted(self.timings.items(), key=lambda timing: timing[1][0], reverse=True)
+        return {
+            'elapsed_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'imported_modules': len(self.timings),
+            'modules': [{'module': name, 'self_ms': round(self_time * 1000, 2), 'total_ms': round(total * 1000, 2)}
+                        for name, (self_time, total) in ranked[:top]],
+        }
+
+
+class TimingLoader:
+    def __init__(self, profiler: ImportProfiler, fullname: str, loader):
+        self.profiler = profiler
+        self.fullname = fullname
+        self.loader = loader
+
+    def create_module(self, spec):
+        # extension modules do their work here rather than in exec_module
+        return self.profiler.record(self.fullname, self.loader.create_module, spec)
+
+    def exec_module(self, module):
+        module.__loader__ = self.loader
+        return self.profiler.record(self.fullname, self.loader.exec_module, module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
@@ -1,12 +1,20 @@
-import os
-import uuid
+import atexit
 import logging
-import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
 
 from json import JSONEncoder
-from pythonjsonlogger import jsonlogger
+from uuid import UUID
 from datetime import datetime
-from logging.config import dictConfig
+from logging.handlers import QueueHandler
+
+# LogRecord attributes, anything else on a record was passed through extra and ends up in the JSON
+RESERVED_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'taskName'}
 
 # Custom JSON encoder which enforce standard ISO 8601 format, UUID format
 class ModelJsonEncoder(JSONEncoder):
@@ -15,62 +23,208 @@ class ModelJsonEncoder(JSONEncoder):
             return str(o)
         if isinstance(o, datetime):
             return o.isoformat()
-        return json.JSONEncoder.default(self, o)
+        return str(o)
+
+# one encoder instance, json.dumps would build a new one per record
+encoder = ModelJsonEncoder(separators=(',', ':'), ensure_ascii=False)
+plain_formatter = logging.Formatter()
 
-class LogFilter(logging.Filter):
+class JsonLogFormatter(logging.Formatter):
 
     def __init__(self, service=None, instance=None):
-        self.service = service
-        self.instance = instance
+        super().__init__()
+        # service and instance never change, they are serialized once as the head of every line
+        self.static_fields = encoder.encode({'service': service, 'instance': instance})[:-1]
+        self.second = None
+        self.second_text = ''
+
+    def timestamp(self, created):
+        # same ISO 8601 text as datetime.utcnow().isoformat(), the date part is only rebuilt once a second
+        second = int(created)
+        if second != self.second:
+            self.second = second
+            self.second_text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        return f'{self.second_text}.{int((created - second) * 1e6):06d}'
+
+    def format(self, record):
+        log_record = {'timestamp': self.timestamp(record.created), 'level': record.levelname,
+                      'type': 'internal', 'message': record.getMessage()}
+
+        # Add the extra fields, type included
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS:
+                log_record[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_record['exc_info'] = record.exc_text
+
+        return self.static_fields + ',' + encoder.encode(log_record)[1:]
+
+class SamplingFilter(logging.Filter):
+
+    # keeps a record of a level with the given probability, levels without a rate are all kept
+    def __init__(self, rates: dict[int, float]):
+        super().__init__()
+        self.rates = rates
 
     def filter(self, record):
-            record.service = self.service
-            record.instance = self.instance
-            return True
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+def parse_sample_rates(value: str) -> dict[int, float]:
+    # "DEBUG=0.01,INFO=0.5" -> {10: 0.01, 20: 0.5}
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        level, rate = item.split('=')
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+class LogQueueHandler(QueueHandler):
 
-class JsonLogFormatter(jsonlogger.JsonFormatter):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
 
-    def add_fields(self, log_record, record, message_dict):
+    def prepare(self, record):
+        # the message is rendered on the calling thread since its args may change once the call returns,
+        # the JSON encoding and the write are left to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = plain_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
-        super().add_fields(log_record, record, message_dict)
-        
-        # Add timestamp field with default : now
-        if not log_record.get('timestamp'):
-            now = datetime.utcnow().isoformat()
-            log_record['timestamp'] = now
+    def enqueue(self, record):
+        # a full queue drops the record rather than blocking the request
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-        # Add level field
-        if log_record.get('level'):
-            log_record['level'] = log_record['level'].upper()
-        else:
-            log_record['level'] = record.levelname
+class BatchingQueueListener:
 
-        # Add type field for internal logs
-        if not log_record.get('type'):
-            log_record['type'] = 'internal'
+    # writes the records queued by LogQueueHandler from a background thread. Up to batch_size waiting
+    # records are written and flushed together, one write per batch instead of one per record. After a
+    # partial batch the thread waits flush_interval seconds so that it does not wake up, and take the
+    # GIL from the request path, for every single record.
+    def __init__(self, log_queue, stream, formatter, batch_size=1024, flush_interval=0.005):
+        self.queue = log_queue
+        self.stream = stream
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.wake = threading.Event()
+        self.thread = None
+        self.written = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+
+    def flush(self):
+        # blocks until every record queued so far is written
+        if self.thread is not None:
+            self.wake.set()
+            self.queue.join()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+            try:
+                if lines:
+                    self.stream.write('\n'.join(lines) + '\n')
+                    self.stream.flush()
+                    self.written += len(lines)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if None in batch:
+                return
+            if len(batch) < self.batch_size:
+                self.wake.wait(self.flush_interval)
+                self.wake.clear()
+
+listener = None
+queue_handler = None
+
+def flush_logs():
+    if listener is not None:
+        listener.flush()
+
+def log_stats() -> dict:
+    return {
+        'pipeline': 'queue' if listener is not None else 'sync',
+        'queued': queue_handler.queue.qsize() if queue_handler is not None else 0,
+        'written': listener.written if listener is not None else 0,
+        'dropped': queue_handler.dropped if queue_handler is not None else 0,
+    }
+
+def stop_logging():
+    global listener, queue_handler
+    if listener is not None:
+        listener.stop()
+    listener = None
+    queue_handler = None
 
 # Configure Logging
-def configure_logging(level='DEBUG', service=None, instance=None):
-    dictConfig({
-        'version': 1,
-        'formatters': {'default': {
-            '()': JsonLogFormatter,
-            'format': '%(timestamp)s %(level)s %(service)s %(instance)s %(type)s %(message)s',
-            'json_encoder': ModelJsonEncoder
-        }},
-        'filters': {'default': {
-            '()': LogFilter,
-            'service': service,
-            'instance': instance
-        }},
-        'handlers': {'default_handler': {
-            'class': 'logging.StreamHandler',
-            'stream': 'ext://sys.stdout',
-            'filters': ['default'],
-            'formatter': 'default'
-        }},
-        'root': {
-            'level': level,
-            'handlers': ['default_handler']
-        }
-    })
\ No newline at end of file
+def configure_logging(level=None, service=None, instance=None, stream=None):
+    global listener, queue_handler
+    stop_logging()
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+
+    # the JSON lines have no caller, thread or process fields, so the records skip collecting them
+    # (see "Optimization" in the logging HOWTO)
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    stream = stream or sys.stdout
+    formatter = JsonLogFormatter(service=service, instance=instance)
+    sampling = SamplingFilter(parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', '')))
+
+    # LOG_PIPELINE=sync writes each record on the calling thread, queue hands it to the writer thread
+    if os.environ.get('LOG_PIPELINE', 'queue') == 'sync':
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(formatter)
+    else:
+        queue_handler = handler = LogQueueHandler(queue.Queue(int(os.environ.get('LOG_QUEUE_SIZE', '10000'))))
+        listener = BatchingQueueListener(handler.queue, stream, formatter,
+                                         batch_size=int(os.environ.get('LOG_BATCH_SIZE', '1024')),
+                                         flush_interval=float(os.environ.get('LOG_FLUSH_INTERVAL_MS', '5')) / 1000)
+        listener.start()
+    # sampled out records are dropped before they are queued or formatted
+    handler.addFilter(sampling)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+atexit.register(stop_logging)
@@ -0,0 +1,71 @@
+import io
+import json
+import logging
+import unittest
+from unittest import mock
+import uuid
+
+from app.monitoring import logging_config
+
+
+class TestLoggingConfig(unittest.TestCase):
+    def tearDown(self):
+        logging_config.stop_logging()
+
+    def configure(self, level='DEBUG'):
+        stream = io.StringIO()
+        logging_config.configure_logging(level=level, service='gojenga', instance='test-instance', stream=stream)
+        return stream
+
+    def lines(self, stream):
+        logging_config.flush_logs()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_json_line_has_static_and_extra_fields(self):
+        stream = self.configure()
+        request_id = uuid.uuid4()
+        logging.getLogger('test').info('Request %s', 'GET', extra={'uuid': request_id, 'type': 'api-request'})
+        [line] = self.lines(stream)
+        self.assertEqual(line['service'], 'gojenga')
+        self.assertEqual(line['instance'], 'test-instance')
+        self.assertEqual(line['level'], 'INFO')
+        self.assertEqual(line['type'], 'api-request')
+        self.assertEqual(line['message'], 'Request GET')
+        self.assertEqual(line['uuid'], str(request_id))
+        self.assertRegex(line['timestamp'], r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}$')
+
+    def test_message_is_rendered_when_logged(self):
+        stream = self.configure()
+        item = {'balance': 1}
+        logging.getLogger('test').debug('item %s', item)
+        item['balance'] = 2
+        [line] = self.lines(stream)
+        self.assertEqual(line['message'], "item {'balance': 1}")
+        self.assertEqual(line['type'], 'internal')
+
+    def test_disabled_level_is_not_written(self):
+        stream = self.configure(level='INFO')
+        logging.getLogger('test').debug('not written')
+        self.assertEqual(self.lines(stream), [])
+
+    def test_sampling(self):
+        with mock.patch.dict('os.environ', {'LOG_SAMPLE_RATES': 'DEBUG=0,INFO=1'}):
+            stream = self.configure()
+        logger = logging.getLogger('test')
+        for _ in range(50):
+            logger.debug('sampled out')
+        logger.info('kept')
+        self.assertEqual([line['message'] for line in self.lines(stream)], ['kept'])
+
+    def test_exception_is_formatted(self):
+        stream = self.configure()
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logging.getLogger('test').exception('failed')
+        [line] = self.lines(stream)
+        self.assertIn('ValueError: boom', line['exc_info'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,13 @@ from app.common.Auth import get_current_active_user
 from app.common.Lib import Lib
 from app.handlers.account_handler import AccountHandler
 from app.models.Account import Account
+from app.models.Batch import MAX_BATCH_SIZE, TransferBatch, UsernameBatch
 from app.models.Transaction import Transaction
 from app.models.User import User
+from app.storage import Leaderboard
+from app.storage.Journal import JOURNAL_HISTORY_MAX_LIMIT, is_entry_id
+from app.storage.Leaderboard import LEADERBOARD_SIZE
+from app.storage.Resilience import StorageUnavailableError
 
 router = APIRouter()
 
@@ -23,15 +28,76 @@ logger = logging.getLogger(__name__)
 # # get root logger
 # logger = logging.getLogger(__name__)
 
+@router.post("/batch", tags=["Account"])
+async def post_batch_accounts(request: Request, data: UsernameBatch,
+                              is_test: Optional[bool] | None = Header(default=False),
+                              current_user: User = Depends(get_current_active_user)):
+    usernames = [username.lower() for username in data.usernames]
+    if len(usernames) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'at most {MAX_BATCH_SIZE} usernames per batch')
+    if any(Lib.detect_special_characters(username) for username in usernames):
+        raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal usernames')
+    try:
+        accounts = await AccountHandler.handle_batch_get_accounts(usernames, is_test)
+        return {"response": accounts}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.post("/transactions/batch", tags=["Transaction"])
+async def post_batch_transactions(request: Request, data: TransferBatch,
+                                  is_test: Optional[bool] | None = Header(default=False),
+                                  current_user: User = Depends(get_current_active_user)):
+    if len(data.transfers) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'at most {MAX_BATCH_SIZE} transfers per batch')
+    try:
+        # transfers are applied in order, the ones that fail validation or funds are reported as rejected
+        transfers = [{'sender': transfer.sender, 'receiver': transfer.receiver, 'amount': transfer.amount}
+                     for transfer in data.transfers]
+        resp = await AccountHandler.handle_batch_transactions(transfers, is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/leaderboard", tags=["Account"])
+async def get_leaderboard(request: Request, n: int = 10, is_test: Optional[bool] | None = Header(default=False),
+                          current_user: User = Depends(get_current_active_user)):
+    # the n largest balances, richest first. Without LEADERBOARD the balance writes do not keep the board
+    if not Leaderboard.LEADERBOARD_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='the leaderboard is turned off')
+    if not 1 <= n <= LEADERBOARD_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'n must be between 1 and {LEADERBOARD_SIZE}')
+    try:
+        resp = await AccountHandler.handle_get_leaderboard(n, is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
 @router.get("/{username}", tags=["Account"])
 async def get_user(request: Request, username: str, is_test: Optional[bool] | None = Header(default=False),
                    current_user: User = Depends(get_current_active_user)):
     if Lib.detect_special_characters(username):
         raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
     try:
-        print(f'--> trying to get account {username}')
-        account = AccountHandler.handle_get_account(username.lower(), is_test)
+        logger.debug('trying to get account %s', username)
+        account = await AccountHandler.handle_get_account(username.lower(), is_test)
         return {"response": account}
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -44,8 +110,10 @@ async def post_account(request: Request, data: Account, is_test: Optional[bool]
         if Lib.detect_special_characters(data.name):
             raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
 
-        resp = AccountHandler.handle_create_account(data.name, data.balance, is_test)
+        resp = await AccountHandler.handle_create_account(data.name, data.balance, is_test)
         return {"response": resp}
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -58,8 +126,10 @@ async def put_user(request: Request, username: str, data: Account,
     if Lib.detect_special_characters(username):
         raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
     try:
-        resp = AccountHandler.handle_update_account(username.lower(), data.balance, is_test)
+        resp = await AccountHandler.handle_update_account(username.lower(), data.balance, is_test)
         return {"response": resp}
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -71,8 +141,10 @@ async def delete_user(request: Request, username: str, is_test: Optional[bool] |
     if Lib.detect_special_characters(username):
         raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
     try:
-        resp = AccountHandler.handle_delete_account(username.lower(), is_test)
+        resp = await AccountHandler.handle_delete_account(username.lower(), is_test)
         return {"response": resp}
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -85,9 +157,11 @@ async def post_deposit(request: Request, username: str, data: Account,
         try:
             if Lib.detect_special_characters(username):
                 raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
-            print(username)
-            resp = AccountHandler.handle_modify_account(username.lower(), data.balance, is_test)
+            logger.debug('deposit to account %s', username)
+            resp = await AccountHandler.handle_modify_account(username.lower(), data.balance, is_test)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -102,8 +176,32 @@ async def post_transaction(request: Request, username: str, data: Transaction,
                 raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT,
                                     detail='please send legal sender and receiver')
 
-            resp = AccountHandler.handle_transaction(data.sender, data.receiver, data.amount, is_test)
+            resp = await AccountHandler.handle_transaction(data.sender, data.receiver, data.amount, is_test)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/{username}/history", tags=["Transaction"])
+async def get_history(request: Request, username: str, limit: int = 50, cursor: str | None = None,
+                      is_test: Optional[bool] | None = Header(default=False),
+                      current_user: User = Depends(get_current_active_user)):
+    # newest entries first, the cursor of a page is passed back to get the next one
+    if not 1 <= limit <= JOURNAL_HISTORY_MAX_LIMIT:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'limit must be between 1 and {JOURNAL_HISTORY_MAX_LIMIT}')
+    if cursor is not None and not is_entry_id(cursor):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='invalid cursor')
+    try:
+        if Lib.detect_special_characters(username):
+            raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+        resp = await AccountHandler.handle_get_history(username.lower(), limit, cursor, is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
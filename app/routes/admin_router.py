@@ -0,0 +1,111 @@
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Depends, Header
+from fastapi.responses import StreamingResponse
+from starlette import status
+
+from app.common.Auth import get_current_active_user, hash_pool, User
+from app.common.Cache import cache_stats
+from app.common.Lib import Lib
+from app.handlers.account_handler import AccountHandler
+from app.handlers.aggregates_handler import AggregatesHandler
+from app.monitoring.logging_config import log_stats
+from app.storage.AsyncDynamo import pool_stats
+from app.storage.Export import EXPORT_MAX_SEGMENTS, EXPORT_SEGMENTS, EXPORT_TABLES, export_ndjson
+from app.storage.Resilience import StorageUnavailableError, resilience_stats
+from app.storage.SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/cache", tags=["Admin"])
+async def get_cache_stats(request: Request, current_user: User = Depends(get_current_active_user)):
+    return {"response": {**cache_stats(), 'shared': shared_cache.stats()}}
+
+
+@router.get("/pools", tags=["Admin"])
+async def get_pool_stats(request: Request, current_user: User = Depends(get_current_active_user)):
+    return {"response": {hash_pool.name: hash_pool.stats(), 'dynamo': {**pool_stats.stats(), **resilience_stats()}}}
+
+
+@router.get("/logging", tags=["Admin"])
+async def get_logging_stats(request: Request, current_user: User = Depends(get_current_active_user)):
+    return {"response": log_stats()}
+
+
+@router.put("/ledger/{username}/shards", tags=["Admin"])
+async def put_ledger_shards(request: Request, username: str, count: int,
+                            is_test: Optional[bool] | None = Header(default=False),
+                            current_user: User = Depends(get_current_active_user)):
+    # count 1 folds a sharded account back into its single ledger item
+    if Lib.detect_special_characters(username):
+        raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+    try:
+        resp = await AccountHandler.handle_shard_account(username.lower(), count, is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/journal/{username}", tags=["Admin"])
+async def get_journal_balance(request: Request, username: str,
+                              is_test: Optional[bool] | None = Header(default=False),
+                              current_user: User = Depends(get_current_active_user)):
+    if Lib.detect_special_characters(username):
+        raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+    try:
+        resp = await AccountHandler.handle_get_journal_balance(username.lower(), is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.post("/journal/{username}/compact", tags=["Admin"])
+async def post_journal_compact(request: Request, username: str,
+                               is_test: Optional[bool] | None = Header(default=False),
+                               current_user: User = Depends(get_current_active_user)):
+    if Lib.detect_special_characters(username):
+        raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+    try:
+        resp = await AccountHandler.handle_compact_journal(username.lower(), is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/aggregates", tags=["Admin"])
+async def get_aggregates(request: Request, is_test: Optional[bool] | None = Header(default=False),
+                         current_user: User = Depends(get_current_active_user)):
+    # totals kept up to date by the stream consumer, no scan
+    try:
+        resp = await AggregatesHandler.handle_get_aggregates(is_test)
+        return {"response": resp}
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/export/{table}", tags=["Admin"])
+async def get_export(request: Request, table: str, segments: int = EXPORT_SEGMENTS,
+                     current_user: User = Depends(get_current_active_user)):
+    # one {"Item": ...} line per item, streamed as the scan pages arrive
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'{table} can not be exported')
+    if not 1 <= segments <= EXPORT_MAX_SEGMENTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'segments must be between 1 and {EXPORT_MAX_SEGMENTS}')
+    return StreamingResponse(export_ndjson(table, segments), media_type='application/x-ndjson')
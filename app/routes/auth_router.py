@@ -7,9 +7,11 @@ from fastapi.security import OAuth2PasswordRequestForm
 from starlette import status
 
 from app.common import Auth
+from app.common.WorkerPool import PoolSaturatedError
 from app.common.Auth import Token, authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, \
     REFRESH_ACCESS_TOKEN_EXPIRE_DAYS
 from app.models.JWT import JWT
+from app.storage.Resilience import StorageUnavailableError
 
 logger = logging.getLogger(__name__)
 
@@ -19,12 +21,12 @@ router = APIRouter()
 @router.post("/login", response_model=Token, tags=["Auth"])
 async def login_for_access_token(request: Request, is_test: Optional[bool] | None = Header(default=False),
                                  form_data: OAuth2PasswordRequestForm = Depends()):
-    print(f'--> trying to login user {form_data.username}')
+    logger.debug('trying to login user %s', form_data.username)
     try:
         table_name: str = 'users'
         if is_test:
             table_name = 'usersTest'
-        user = authenticate_user(table_name, form_data.username.lower(), form_data.password)
+        user = await authenticate_user(table_name, form_data.username.lower(), form_data.password)
         if not user:
             raise Exception("Invalid username or password")
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -35,6 +37,12 @@ async def login_for_access_token(request: Request, is_test: Optional[bool] | Non
         # refresh_token_expires = timedelta(minutes=2)
         refresh_token = create_access_token(data={"sub": user["name"]}, expires_delta=refresh_token_expires)
         return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    except PoolSaturatedError as e:
+        logger.error(e)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         if str(e) == "Invalid username or password":
@@ -44,11 +52,13 @@ async def login_for_access_token(request: Request, is_test: Optional[bool] | Non
 
 @router.put("/refresh", tags=["Auth"])
 async def renew_jwt(request: Request, jwt_token: JWT):
-    print(f'--> trying to renew jwt token')
+    logger.debug('trying to renew jwt token')
     try:
         token_data = Auth.get_token_payload(jwt_token.token)
         renewed_token = Auth.renew_access_token({"sub": token_data.get("sub")}, ACCESS_TOKEN_EXPIRE_MINUTES)
         return {"token": renewed_token}
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
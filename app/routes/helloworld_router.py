@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException
 import logging.config
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 # logging.config.fileConfig('../logging.conf', disable_existing_loggers=False)
@@ -11,23 +13,23 @@ router = APIRouter()
 
 @router.get("/")
 async def hello():
-    print("---> Hello World")
+    logger.debug('Hello World')
     return {"message": "Hello World"}
 
 
 @router.get("/hiya")
 async def hiya():
-    print("---> Well Hi!")
+    logger.debug('Well Hi!')
     return {"message": "Well Hi!"}
 
 
 @router.get("/bye")
 async def bye():
-    print("---> Bye!")
+    logger.debug('Bye!')
     return {"message": "Bye!"}
 
 
 @router.get("/{user}")
 async def hello_user(user: str):
-    print(f"---> Hello {user}")
+    logger.debug('Hello %s', user)
     return {"message": f"Hello {user}"}
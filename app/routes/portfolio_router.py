@@ -1,15 +1,18 @@
 import logging
 from typing import Optional
 
-from fastapi import APIRouter, Request, Header, Depends, HTTPException
+from fastapi import APIRouter, Request, Header, Depends, HTTPException, Query
 from opentelemetry import trace
 from opentelemetry.propagate import extract
 from starlette import status
 
+from app.models.Batch import MAX_BATCH_SIZE, UsernameBatch
 from app.models.Portfolio import Portfolio
 from app.common.Auth import get_current_active_user, User
 from app.common.Lib import Lib
 from app.handlers.portfolio_handler import PortfolioHandler
+from app.storage import ValueHistory
+from app.storage.Resilience import StorageUnavailableError
 
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
@@ -17,6 +20,107 @@ tracer = trace.get_tracer(__name__)
 router = APIRouter()
 
 
+@router.post("/batch", tags=["Portfolio"])
+async def post_batch_portfolios(request: Request, data: UsernameBatch,
+                                is_test: Optional[bool] | None = Header(default=False),
+                                current_user: User = Depends(get_current_active_user)):
+    with tracer.start_as_current_span(
+            "post_batch_portfolios",
+            context=extract(request.headers),
+            attributes={'attr.count': len(data.usernames), 'attr.is_test': is_test},
+            kind=trace.SpanKind.SERVER
+    ):
+        usernames = [username.lower() for username in data.usernames]
+        if len(usernames) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f'at most {MAX_BATCH_SIZE} usernames per batch')
+        if any(Lib.detect_special_characters(username) for username in usernames):
+            raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal usernames')
+        try:
+            portfolios = await PortfolioHandler.handle_batch_get_portfolios(usernames, is_test)
+            return {"response": portfolios}
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.post("/value/batch", tags=["Portfolio"])
+async def post_batch_portfolio_values(request: Request, data: UsernameBatch,
+                                      is_test: Optional[bool] | None = Header(default=False),
+                                      current_user: User = Depends(get_current_active_user)):
+    with tracer.start_as_current_span(
+            "post_batch_portfolio_values",
+            context=extract(request.headers),
+            attributes={'attr.count': len(data.usernames), 'attr.is_test': is_test},
+            kind=trace.SpanKind.SERVER
+    ):
+        usernames = [username.lower() for username in data.usernames]
+        if len(usernames) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f'at most {MAX_BATCH_SIZE} usernames per batch')
+        if any(Lib.detect_special_characters(username) for username in usernames):
+            raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal usernames')
+        try:
+            values = await PortfolioHandler.handle_batch_value_portfolios(usernames, is_test)
+            return {"response": values}
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/{username}/value", tags=["Portfolio"])
+async def get_portfolio_value(request: Request, username: str, is_test: Optional[bool] | None = Header(default=False),
+                              current_user: User = Depends(get_current_active_user)):
+    with tracer.start_as_current_span(
+            "get_portfolio_value",
+            context=extract(request.headers),
+            attributes={'attr.username': username.lower(), 'attr.is_test': is_test},
+            kind=trace.SpanKind.SERVER
+    ):
+        if Lib.detect_special_characters(username):
+            raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+        try:
+            value = await PortfolioHandler.handle_get_portfolio_value(username.lower(), is_test)
+            return {"response": value}
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/{username}/history", tags=["Portfolio"])
+async def get_portfolio_history(request: Request, username: str, range_name: str = Query('1d', alias='range'),
+                                resolution: Optional[str] = None,
+                                is_test: Optional[bool] | None = Header(default=False),
+                                current_user: User = Depends(get_current_active_user)):
+    with tracer.start_as_current_span(
+            "get_portfolio_history",
+            context=extract(request.headers),
+            attributes={'attr.username': username.lower(), 'attr.range': range_name, 'attr.is_test': is_test},
+            kind=trace.SpanKind.SERVER
+    ):
+        if Lib.detect_special_characters(username):
+            raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+        try:
+            ValueHistory.resolve(range_name, resolution)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        try:
+            history = await PortfolioHandler.handle_get_portfolio_history(username.lower(), range_name, resolution,
+                                                                          is_test)
+            return {"response": history}
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
 @router.get("/{username}", tags=["Portfolio"])
 async def get_portfolio(request: Request, username: str, is_test: Optional[bool] | None = Header(default=False),
                         current_user: User = Depends(get_current_active_user)):
@@ -29,8 +133,10 @@ async def get_portfolio(request: Request, username: str, is_test: Optional[bool]
         if Lib.detect_special_characters(username):
             raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
         try:
-            account = PortfolioHandler.handle_get_portfolio(username.lower(), is_test)
+            account = await PortfolioHandler.handle_get_portfolio(username.lower(), is_test)
             return {"response": account}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -49,8 +155,10 @@ async def post_account(request: Request, data: Portfolio, is_test: Optional[bool
             if Lib.detect_special_characters(data.username):
                 raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
 
-            resp = PortfolioHandler.handle_create_portfolio(data.username, data, is_test)
+            resp = await PortfolioHandler.handle_create_portfolio(data.username, data, is_test)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -71,8 +179,10 @@ async def put_user(request: Request, username: str, data: Portfolio,
             if Lib.detect_special_characters(data.username):
                 raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
 
-            resp = PortfolioHandler.handle_update_portfolio(data.username, data, is_test, update_type)
+            resp = await PortfolioHandler.handle_update_portfolio(data.username, data, is_test, update_type)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -90,8 +200,10 @@ async def delete_user(request: Request, username: str, is_test: Optional[bool] |
         if Lib.detect_special_characters(username):
             raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
         try:
-            resp = PortfolioHandler.handle_delete_portfolio(username.lower(), is_test)
+            resp = await PortfolioHandler.handle_delete_portfolio(username.lower(), is_test)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -9,8 +9,10 @@ from starlette import status
 
 from app.common.Auth import get_current_active_user, User
 from app.common.Lib import Lib
+from app.common.WorkerPool import PoolSaturatedError
 from app.handlers.user_handler import UserHandler
 from app.storage.Dynamo import Dynamo
+from app.storage.Resilience import StorageUnavailableError
 
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
@@ -20,7 +22,7 @@ router = APIRouter()
 
 @router.get("/health")
 async def health():
-    print("--->User Health Check")
+    logger.debug('User Health Check')
     return {"message": "User Health Check"}
 
 
@@ -30,14 +32,37 @@ async def get_user(request: Request, username: str, is_test: Optional[bool] | No
     if Lib.detect_special_characters(username):
         raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
     try:
-        print(f'--> the oauth user {current_user}')
-        user = UserHandler.handle_get_user(username.lower(), is_test)
+        logger.debug('the oauth user %s', current_user['name'])
+        user = await UserHandler.handle_get_user(username.lower(), is_test)
         return {"response": user}
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
+@router.get("/{username}/dashboard", tags=["User"])
+async def get_dashboard(request: Request, username: str, is_test: Optional[bool] | None = Header(default=False),
+                        current_user: User = Depends(get_current_active_user)):
+    with tracer.start_as_current_span(
+            "get_dashboard",
+            context=extract(request.headers),
+            attributes={'attr.username': username.lower(), 'attr.is_test': is_test},
+            kind=trace.SpanKind.SERVER
+    ):
+        if Lib.detect_special_characters(username):
+            raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
+        try:
+            dashboard = await UserHandler.handle_get_dashboard(username.lower(), is_test, current_user)
+            return {"response": dashboard}
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
 @router.post("/", tags=["User"])
 async def post_user(request: Request, data: User, is_test: Optional[bool] | None = Header(default=False)):
     with tracer.start_as_current_span(
@@ -46,13 +71,19 @@ async def post_user(request: Request, data: User, is_test: Optional[bool] | None
             attributes={'attr.username': data.name, 'attr.is_test': is_test},
             kind=trace.SpanKind.SERVER
     ):
-        print(f'--> trying to create user {data.name}')
+        logger.debug('trying to create user %s', data.name)
         try:
             if Lib.detect_special_characters(data.name):
                 raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
 
-            resp = UserHandler.handle_create_user(data.name, data.password, is_test)
+            resp = await UserHandler.handle_create_user(data.name, data.password, is_test)
             return {"response": resp}
+        except PoolSaturatedError as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+                                headers={"Retry-After": str(e.retry_after)})
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             # todo how to return original error message
@@ -71,8 +102,10 @@ async def put_user(request: Request, username: str, data: User, is_test: Optiona
         if Lib.detect_special_characters(username):
             raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
         try:
-            resp = UserHandler.handle_update_user(username.lower(), data.password, is_test)
+            resp = await UserHandler.handle_update_user(username.lower(), data.password, is_test)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -90,8 +123,10 @@ async def delete_user(request: Request, username: str, is_test: Optional[bool] |
         if Lib.detect_special_characters(username):
             raise HTTPException(status_code=status.HTTP_206_PARTIAL_CONTENT, detail='please send legal username')
         try:
-            resp = UserHandler.handle_delete_user(username.lower(), is_test)
+            resp = await UserHandler.handle_delete_user(username.lower(), is_test)
             return {"response": resp}
+        except StorageUnavailableError:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
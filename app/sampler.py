@@ -0,0 +1,34 @@
+import asyncio
+import logging
+import time
+import uuid
+
+from app.monitoring import logging_config
+from app.storage import ValueHistory
+from app.storage.Resilience import start_deadline
+
+###############################################################################
+#   Handler for the scheduled sampling of the portfolio values                #
+###############################################################################
+
+# Deployed from the same image as app.app.handler with the command app.sampler.handler, invoked by an
+# EventBridge schedule every HISTORY_SAMPLE_SECONDS. The event may list the portfolio tables to sample,
+# {"tables": ["portfolio", "portfolioTest"]}, it defaults to the portfolio table.
+logging_config.configure_logging(service='gojenga-sampler', instance=str(uuid.uuid4()))
+logger = logging.getLogger(__name__)
+
+
+async def sample(tables: list[str]) -> list[dict]:
+    start_deadline()
+    at = int(time.time())
+    return [await ValueHistory.sample_portfolios(table_name, at) for table_name in tables]
+
+
+def handler(event, context):
+    try:
+        results = asyncio.run(sample((event or {}).get('tables', ['portfolio'])))
+        for result in results:
+            logger.info('portfolio values sampled', extra={'type': 'sampler', **result})
+        return results
+    finally:
+        logging_config.flush_logs()
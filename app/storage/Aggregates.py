@@ -0,0 +1,171 @@
+import logging
+import os
+import time
+from decimal import *
+
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import TRANSACT_MAX_ITEMS, TransactionCancelledError
+
+logger = logging.getLogger(__name__)
+
+# Live totals of the ledger and portfolio tables: ledger balance, accounts, portfolios and the
+# holdings of every coin. They are kept by the consumer of the DynamoDB Streams of the tables
+# (app.stream.handler), which turns every change into a delta, so reading them is one get_item
+# instead of a scan. The streams need the NEW_AND_OLD_IMAGES view type.
+#
+# Every record is applied in the same transaction as a marker item named after its eventID, put on
+# the condition that it does not exist yet. Records sent again, whichever batch they come back in
+# after a failed invocation (Lambda may split a batch or change its size), find their marker and are
+# left out. A transaction holds up to TRANSACT_MAX_ITEMS - 1 records and their totals update. Markers
+# expire (TTL on expires_at) after the 24 hours a stream keeps its records.
+AGGREGATES_TABLES = {
+    'ledger': 'aggregates',
+    'portfolio': 'aggregates',
+    'ledgerTest': 'aggregatesTest',
+    'portfolioTest': 'aggregatesTest',
+}
+AGGREGATES_MARKER_TTL_SECONDS = int(os.environ.get('AGGREGATES_MARKER_TTL_SECONDS', str(2 * 24 * 3600)))
+
+TOTALS = 'totals'
+MARKER_PREFIX = 'event#'
+COUNTERS = ('ledger_balance', 'accounts', 'portfolios')
+
+# aggregates tables whose totals item is known to have its holdings map
+initialized: set[str] = set()
+
+
+def image(attributes: dict | None) -> dict:
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {name: deserializer.deserialize(value) for name, value in (attributes or {}).items()}
+
+
+def table_of(record: dict) -> str:
+    # arn:aws:dynamodb:<region>:<account>:table/<table>/stream/<label>
+    return record['eventSourceARN'].split(':', 5)[5].split('/')[1]
+
+
+def coins(item: dict) -> list:
+    # portfolios are maps keyed by coin id, older ones lists of coins
+    portfolio = item.get('portfolio', [])
+    return list(portfolio.values()) if isinstance(portfolio, dict) else portfolio
+
+
+def add_deltas(deltas: dict, table_name: str, old: dict, new: dict):
+    if table_name.startswith('ledger'):
+        deltas['ledger_balance'] += Decimal(new.get('balance', 0)) - Decimal(old.get('balance', 0))
+        # the shard items of a sharded account hold part of its balance but are not accounts
+        if '#' not in (new or old)['name']:
+            deltas['accounts'] += bool(new) - bool(old)
+    else:
+        deltas['portfolios'] += bool(new) - bool(old)
+        holdings = deltas['holdings']
+        for coin in coins(old):
+            holdings[coin['id']] = holdings.get(coin['id'], Decimal(0)) - Decimal(str(coin['amount']))
+        for coin in coins(new):
+            holdings[coin['id']] = holdings.get(coin['id'], Decimal(0)) + Decimal(str(coin['amount']))
+
+
+def batch_deltas(table_name: str, records: list[dict]) -> dict:
+    deltas: dict = {counter: Decimal(0) for counter in COUNTERS}
+    deltas['holdings'] = {}
+    for record in records:
+        change = record['dynamodb']
+        add_deltas(deltas, table_name, image(change.get('OldImage')), image(change.get('NewImage')))
+    return deltas
+
+
+def totals_action(aggregates_table: str, deltas: dict) -> dict | None:
+    names: dict = {}
+    values: dict = {':one': 1}
+    additions: list[str] = []
+    for counter in COUNTERS:
+        if deltas[counter]:
+            values[f':{counter}'] = deltas[counter]
+            additions.append(f'{counter} :{counter}')
+    for index, (coin_id, amount) in enumerate(sorted(deltas['holdings'].items())):
+        if amount:
+            names[f'#c{index}'] = coin_id
+            values[f':c{index}'] = amount
+            additions.append(f'holdings.#c{index} :c{index}')
+    if not additions:
+        return None
+    request = {
+        'TableName': aggregates_table,
+        'Key': {'name': TOTALS},
+        'UpdateExpression': 'ADD ' + ', '.join(additions + ['version :one']),
+        'ExpressionAttributeValues': values}
+    if names:
+        request['ExpressionAttributeNames'] = names
+    return {'Update': request}
+
+
+async def ensure_totals(aggregates_table: str):
+    # ADD to a coin of the holdings needs the holdings map to exist
+    if aggregates_table in initialized:
+        return
+    await AsyncDynamo.update_item(aggregates_table, {'name': TOTALS}, 'SET holdings = if_not_exists(holdings, :empty)',
+                                  expression_values={':empty': {}})
+    initialized.add(aggregates_table)
+
+
+def marker_action(aggregates_table: str, record: dict) -> dict:
+    return {'Put': {
+        'TableName': aggregates_table,
+        'Item': {'name': MARKER_PREFIX + record['eventID'],
+                 'expires_at': int(time.time()) + AGGREGATES_MARKER_TTL_SECONDS},
+        'ConditionExpression': 'attribute_not_exists(#n)',
+        'ExpressionAttributeNames': {'#n': 'name'}}}
+
+
+async def applied_events(aggregates_table: str, records: list[dict]) -> set[str]:
+    # the eventIDs of the records whose marker exists
+    keys = [{'name': MARKER_PREFIX + record['eventID']} for record in records]
+    found = (await AsyncDynamo.batch_get({aggregates_table: keys}, True))[aggregates_table]
+    return {item['name'][len(MARKER_PREFIX):] for item in found}
+
+
+async def apply_batch(table_name: str, records: list[dict]) -> int:
+    # records of one table, returns how many were applied
+    aggregates_table = AGGREGATES_TABLES[table_name]
+    await ensure_totals(aggregates_table)
+    applied = 0
+    for start in range(0, len(records), TRANSACT_MAX_ITEMS - 1):
+        chunk = records[start:start + TRANSACT_MAX_ITEMS - 1]
+        while chunk:
+            actions = [marker_action(aggregates_table, record) for record in chunk]
+            totals = totals_action(aggregates_table, batch_deltas(table_name, chunk))
+            if totals is not None:
+                actions.append(totals)
+            try:
+                await AsyncDynamo.transact_write_items(actions)
+                applied += len(chunk)
+                break
+            except TransactionCancelledError as e:
+                if 'ConditionalCheckFailed' not in e.reasons[:len(chunk)]:
+                    raise
+            done = await applied_events(aggregates_table, chunk)
+            logger.info('%s stream records already applied', len(done))
+            chunk = [record for record in chunk if record['eventID'] not in done]
+    return applied
+
+
+async def apply_records(records: list[dict]) -> dict:
+    # a Lambda event holds the records of one stream, they are grouped by table all the same
+    by_table: dict[str, list[dict]] = {}
+    for record in records:
+        table_name = table_of(record)
+        if table_name in AGGREGATES_TABLES:
+            by_table.setdefault(table_name, []).append(record)
+    applied = 0
+    for table_name, table_records in by_table.items():
+        applied += await apply_batch(table_name, table_records)
+    return {'records': len(records), 'applied': applied}
+
+
+async def read_totals(aggregates_table: str) -> dict:
+    item = await AsyncDynamo.get_item(aggregates_table, {'name': TOTALS})
+    return {
+        **{counter: item.get(counter, Decimal(0)) for counter in COUNTERS},
+        'holdings': {coin_id: amount for coin_id, amount in sorted(item.get('holdings', {}).items()) if amount},
+    }
@@ -0,0 +1,252 @@
+import asyncio
+import contextvars
+import copy
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.common.Cache import TTLCache
+from app.storage.ClientFactory import DYNAMO_MAX_WORKERS, client_settings
+from app.storage.Dynamo import BATCH_GET_MAX_KEYS, Dynamo, DynamoError
+from app.storage.Resilience import call_with_retry
+from app.storage.SharedCache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# boto3 is blocking, so every call is pushed onto a bounded pool of worker threads
+# instead of running on the event loop. The pool size caps the number of in-flight
+# DynamoDB calls per process.
+executor = ThreadPoolExecutor(max_workers=DYNAMO_MAX_WORKERS, thread_name_prefix='dynamo')
+
+
+class PoolStats:
+    # time calls spend queued for a worker thread, the connection pool is sized so that this is
+    # the only wait before a call goes on the wire
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def submitted(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def started(self, wait: float):
+        with self.lock:
+            self.calls += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                **client_settings(),
+                'calls': self.calls,
+                'in_flight': self.in_flight,
+                'avg_pool_wait_ms': round(self.wait_seconds / self.calls * 1000, 3) if self.calls else 0.0,
+                'max_pool_wait_ms': round(self.max_wait_seconds * 1000, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+async def run_in_executor(func, *args, **kwargs):
+    # copy the context so the opentelemetry span of the caller is the parent of the storage span
+    ctx = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def call():
+        pool_stats.started(time.perf_counter() - submitted)
+        return ctx.run(func, *args, **kwargs)
+
+    pool_stats.submitted()
+    future = executor.submit(call)
+    # also counts out the calls cancelled before a worker picked them up
+    future.add_done_callback(lambda _: pool_stats.finished())
+    return await asyncio.wrap_future(future)
+
+
+# Concurrent get_item calls for the same key share one DynamoDB read. With a window, the item is
+# also kept that long for the calls arriving right after. get_item reads are eventually consistent,
+# a joined read is at most as stale as its own would have been, and writes of this process drop it.
+DYNAMO_COALESCE_READS = os.environ.get('DYNAMO_COALESCE_READS', '1') == '1'
+DYNAMO_COALESCE_WINDOW_SECONDS = float(os.environ.get('DYNAMO_COALESCE_WINDOW_MS', '0')) / 1000
+read_coalescer = TTLCache('dynamo-reads', max_size=4096, ttl_seconds=DYNAMO_COALESCE_WINDOW_SECONDS)
+
+
+def read_key(table_name: str, key: dict) -> tuple:
+    return table_name, tuple(sorted(key.items()))
+
+
+def forget_reads(table_name: str, key: dict):
+    read_coalescer.invalidate(read_key(table_name, key))
+
+
+def item_key(item: dict) -> dict:
+    # the tables read with get_item are all keyed by name
+    return {'name': item['name']}
+
+
+async def forget(table_name: str, key: dict, item: dict | None = None):
+    # after a write: item is the complete new item when the write returned it, it is then written
+    # through to the shared cache, otherwise the shared entry is invalidated
+    forget_reads(table_name, key)
+    if shared_cache.covers(table_name, key):
+        if item and 'version' in item and 'name' in item:
+            await shared_cache.put(table_name, item, write=True)
+        else:
+            await shared_cache.invalidate(table_name, key)
+
+
+async def read_through(table_name: str, query: dict):
+    if not shared_cache.covers(table_name, query):
+        return await retried([table_name], True, Dynamo.get_item, table_name, query)
+    item = await shared_cache.get(table_name, query)
+    if item is None:
+        item = await retried([table_name], True, Dynamo.get_item, table_name, query)
+        if 'message' not in item:
+            await shared_cache.put(table_name, item)
+    return item
+
+
+def retried(table_names: list[str], idempotent: bool, func, *args):
+    # each attempt runs on the worker pool, retries back off on the event loop without holding a worker
+    return call_with_retry(table_names, idempotent, lambda: run_in_executor(func, *args))
+
+
+async def batch_get_chunk(keys_by_table: dict[str, list[dict]], consistent_read: bool, results: dict[str, list[dict]]):
+    # keys left unprocessed are sent again like a throttled call: after a backoff on the event loop,
+    # within the request deadline, the circuit breakers and the retry budget
+    pending = keys_by_table
+
+    async def attempt():
+        nonlocal pending
+        items, pending = await run_in_executor(Dynamo.batch_get, pending, consistent_read)
+        for table_name, table_items in items.items():
+            results[table_name].extend(table_items)
+        if pending:
+            raise DynamoError('ProvisionedThroughputExceededException',
+                              f'{sum(len(keys) for keys in pending.values())} keys left unprocessed')
+
+    await call_with_retry(list(keys_by_table), True, attempt)
+
+
+class AsyncDynamo:
+    @staticmethod
+    async def get_item(table_name: str, query: dict):
+        if not DYNAMO_COALESCE_READS:
+            return await read_through(table_name, query)
+        item = await read_coalescer.get_or_load(read_key(table_name, query), lambda: read_through(table_name, query))
+        # handlers modify the items they get, every caller gets its own copy of a shared item, the
+        # caller whose load filled it too: the others may not have copied it yet
+        return copy.deepcopy(item)
+
+    @staticmethod
+    async def create_item(table_name: str, item: dict, condition_expression: str | None = None,
+                          expression_values: dict | None = None, expression_names: dict | None = None) -> str:
+        # a conditional put retried after it was applied fails its own condition and reports a false conflict
+        try:
+            return await retried([table_name], condition_expression is None, Dynamo.create_item, table_name, item,
+                                 condition_expression, expression_values, expression_names)
+        finally:
+            await forget(table_name, item_key(item))
+
+    @staticmethod
+    async def delete_item(table_name: str, item: dict) -> str:
+        try:
+            return await retried([table_name], True, Dynamo.delete_item, table_name, item)
+        finally:
+            await forget(table_name, item)
+
+    @staticmethod
+    async def update_item(table_name: str, key: dict, update_expression: str, expression_values: dict | None = None,
+                          expression_names: dict | None = None, condition_expression: str | None = None,
+                          return_values: str = 'UPDATED_NEW') -> dict:
+        # ADD and relative SET are not idempotent, a server error is only retried when nothing was applied
+        attributes = None
+        try:
+            attributes = await retried([table_name], False, Dynamo.update_item, table_name, key, update_expression,
+                                       expression_values, expression_names, condition_expression, return_values)
+            return attributes
+        finally:
+            await forget(table_name, key, attributes if return_values == 'ALL_NEW' else None)
+
+    @staticmethod
+    async def update_user_password(table_name: str, item: dict) -> str:
+        try:
+            return await retried([table_name], True, Dynamo.update_user_password, table_name, item)
+        finally:
+            await forget(table_name, item_key(item))
+
+    @staticmethod
+    async def update_account_balance(table_name: str, item: dict) -> str:
+        # the balance is set but the version is added to, a retry after an unknown outcome would bump it twice
+        try:
+            return await retried([table_name], False, Dynamo.update_account_balance, table_name, item)
+        finally:
+            await forget(table_name, item_key(item))
+
+    @staticmethod
+    async def transact_write_items(actions: list[dict]) -> str:
+        table_names = [list(action.values())[0]['TableName'] for action in actions]
+        try:
+            return await retried(table_names, False, Dynamo.transact_write_items, actions)
+        finally:
+            for action in actions:
+                (kind, request), = action.items()
+                if kind == 'ConditionCheck':
+                    continue
+                if 'Key' in request:
+                    await forget(request['TableName'], request['Key'])
+                elif 'Item' in request:
+                    await forget(request['TableName'], item_key(request['Item']))
+
+    @staticmethod
+    async def batch_get(keys_by_table: dict[str, list[dict]], consistent_read: bool = False) -> dict[str, list[dict]]:
+        # BatchGetItem takes at most 100 keys and rejects duplicates, the chunks are read one after the other
+        results: dict[str, list[dict]] = {table_name: [] for table_name in keys_by_table}
+        pending: list[tuple[str, dict]] = []
+        for table_name, keys in keys_by_table.items():
+            seen = set()
+            for key in keys:
+                identity = tuple(sorted(key.items()))
+                if identity not in seen:
+                    seen.add(identity)
+                    pending.append((table_name, key))
+        for start in range(0, len(pending), BATCH_GET_MAX_KEYS):
+            chunk: dict[str, list[dict]] = {}
+            for table_name, key in pending[start:start + BATCH_GET_MAX_KEYS]:
+                chunk.setdefault(table_name, []).append(key)
+            await batch_get_chunk(chunk, consistent_read, results)
+        return results
+
+    @staticmethod
+    async def refresh_item(table_name: str, key: dict) -> dict | None:
+        # strongly consistent read of an item a transaction just wrote, written through to the shared cache
+        item = next(iter((await AsyncDynamo.batch_get({table_name: [key]}, True))[table_name]), None)
+        if item is not None:
+            await forget(table_name, key, item)
+        return item
+
+    @staticmethod
+    async def query(table_name: str, key_condition: str, expression_values: dict,
+                    expression_names: dict | None = None, limit: int | None = None,
+                    exclusive_start_key: dict | None = None,
+                    scan_forward: bool = True) -> tuple[list[dict], dict | None]:
+        return await retried([table_name], True, Dynamo.query, table_name, key_condition, expression_values,
+                             expression_names, limit, exclusive_start_key, scan_forward)
+
+    @staticmethod
+    async def scan_page(table_name: str, segment: int, total_segments: int, exclusive_start_key: dict | None = None,
+                        limit: int | None = None, typed: bool = False) -> tuple[list[dict], dict | None]:
+        return await retried([table_name], True, Dynamo.scan_page, table_name, segment, total_segments,
+                             exclusive_start_key, limit, typed)
@@ -0,0 +1,44 @@
+import os
+
+# Every DynamoDB call runs on one of DYNAMO_MAX_WORKERS threads and a thread holds at most one
+# connection, so with the connection pool at least as large as the worker pool a call never waits
+# for a connection, only for a worker (measured by AsyncDynamo.pool_stats). botocore defaults to
+# 10 connections, legacy retries and no TCP keepalive.
+DYNAMO_MAX_WORKERS = int(os.environ.get('DYNAMO_MAX_WORKERS', '10'))
+DYNAMO_MAX_POOL_CONNECTIONS = max(DYNAMO_MAX_WORKERS,
+                                  int(os.environ.get('DYNAMO_MAX_POOL_CONNECTIONS', str(DYNAMO_MAX_WORKERS))))
+DYNAMO_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('DYNAMO_CONNECT_TIMEOUT_SECONDS', '2'))
+DYNAMO_READ_TIMEOUT_SECONDS = float(os.environ.get('DYNAMO_READ_TIMEOUT_SECONDS', '5'))
+DYNAMO_TCP_KEEPALIVE = os.environ.get('DYNAMO_TCP_KEEPALIVE', '1') == '1'
+DYNAMO_RETRY_MODE = os.environ.get('DYNAMO_RETRY_MODE', 'standard')
+# retries are left to the Resilience module, which knows the request deadline and the table health
+DYNAMO_MAX_ATTEMPTS = int(os.environ.get('DYNAMO_MAX_ATTEMPTS', '1'))
+
+
+def client_settings() -> dict:
+    return {
+        'max_workers': DYNAMO_MAX_WORKERS,
+        'max_pool_connections': DYNAMO_MAX_POOL_CONNECTIONS,
+        'connect_timeout': DYNAMO_CONNECT_TIMEOUT_SECONDS,
+        'read_timeout': DYNAMO_READ_TIMEOUT_SECONDS,
+        'tcp_keepalive': DYNAMO_TCP_KEEPALIVE,
+        'retries': {'mode': DYNAMO_RETRY_MODE, 'max_attempts': DYNAMO_MAX_ATTEMPTS},
+    }
+
+
+def build_config():
+    from botocore.config import Config
+
+    settings = client_settings()
+    del settings['max_workers']
+    return Config(**settings)
+
+
+def create_resource():
+    # DYNAMO_BACKEND=local swaps DynamoDB for the in-memory stand-in, for offline tests and load tests
+    if os.environ.get('DYNAMO_BACKEND') == 'local':
+        from app.storage.LocalDynamo import LocalDynamoResource
+        return LocalDynamoResource()
+
+    import boto3
+    return boto3.resource('dynamodb', config=build_config())
@@ -1,54 +1,120 @@
 import logging
+import threading
 
-import boto3
 from botocore.exceptions import ClientError
 from opentelemetry import trace
 
 from app.models.Portfolio import Portfolio
+from app.storage import ClientFactory
 
-dyn_resource = boto3.resource('dynamodb')
+# boto3 and the resource are only built on first use, importing them costs a few hundred ms of cold start
+dyn_resource = None
+resource_lock = threading.Lock()
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
 
+def get_resource():
+    global dyn_resource
+    if dyn_resource is None:
+        with resource_lock:
+            if dyn_resource is None:
+                dyn_resource = ClientFactory.create_resource()
+    return dyn_resource
+
+
+# Table handles are built once per table name and shared by the worker threads, a Table is a thin
+# wrapper over the thread safe client. The registry is rebuilt when dyn_resource is swapped.
+table_handles: dict = {}
+table_handles_resource = None
+
+
+def get_table(table_name: str):
+    global table_handles, table_handles_resource
+    resource = get_resource()
+    if table_handles_resource is not resource:
+        with resource_lock:
+            if table_handles_resource is not resource:
+                table_handles = {}
+                table_handles_resource = resource
+    table = table_handles.get(table_name)
+    if table is None:
+        table = table_handles.setdefault(table_name, resource.Table(table_name))
+    return table
+
+
+def serialize(value) -> dict:
+    from boto3.dynamodb.types import TypeSerializer
+    return TypeSerializer().serialize(value)
+
+BATCH_GET_MAX_KEYS = 100
+# TransactWriteItems accepts at most 100 actions
+TRANSACT_MAX_ITEMS = 100
+
+
+class DynamoError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(f"dynamo error {code} and msg {message}")
+        # the DynamoDB error code, used by the resilience layer to decide on a retry
+        self.code = code
+
+
+class TransactionCancelledError(Exception):
+    def __init__(self, message: str, reasons: list[str]):
+        super().__init__(message)
+        # one cancellation code per action, in request order ('None' when that action was fine)
+        self.reasons = reasons
+
+
+class ConditionalCheckFailedError(Exception):
+    pass
+
+
 class Dynamo:
     @staticmethod
     def get_item(table_name: str, query: dict):
-        print(f'get_item: {query}')
+        logger.debug('get_item: %s', query)
         try:
-            table = dyn_resource.Table(table_name)
+            table = get_table(table_name)
             response = table.get_item(Key=query)
 
             if 'Item' in response:
-                print(f'item found: {response["Item"]}')
+                logger.debug('item found: %s', query)
                 return response['Item']
             else:
-                print(f'item not found: {query}')
+                logger.debug('item not found: %s', query)
                 logger.error('item not found')
                 return {'message': 'item not found'}
                 # raise ValueError(f'item not found {query}')
         except ClientError as e:
             logger.error(
                 f"{e.response['Error']['Code'], e.response['Error']['Message']}")
-            raise Exception(f"dynamo error {e.response['Error']['Code']} and msg {e.response['Error']['Message']}")
+            raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
 
     @staticmethod
-    def create_item(table_name: str, item: dict | Portfolio) -> str:
+    def create_item(table_name: str, item: dict | Portfolio, condition_expression: str | None = None,
+                    expression_values: dict | None = None, expression_names: dict | None = None) -> str:
         with tracer.start_as_current_span(
                 "create_item",
                 attributes={'table_name': table_name}):
+            request: dict = {'Item': item, 'ReturnValues': "ALL_OLD"}
+            if condition_expression:
+                request['ConditionExpression'] = condition_expression
+            if expression_values:
+                request['ExpressionAttributeValues'] = expression_values
+            if expression_names:
+                request['ExpressionAttributeNames'] = expression_names
             try:
-                table = dyn_resource.Table(table_name)
-                response = table.put_item(
-                    Item=item,
-                    ReturnValues="ALL_OLD"
-                )
+                table = get_table(table_name)
+                response = table.put_item(**request)
                 return 'insert item succeeded'
 
             except ClientError as e:
                 logger.error(
                     f"{e.response['Error']['Code'], e.response['Error']['Message']}")
-                raise Exception(f"dynamo error {e.response['Error']['Code']} and msg {e.response['Error']['Message']}")
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    raise ConditionalCheckFailedError(f"condition failed on {table_name}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
 
     @staticmethod
     def delete_item(table_name: str, item: dict) -> str:
@@ -56,7 +122,7 @@ class Dynamo:
                 "delete_item",
                 attributes={'table_name': table_name}):
             try:
-                table = dyn_resource.Table(table_name)
+                table = get_table(table_name)
                 response = table.delete_item(
                     Key=item,
                     ReturnValues="ALL_OLD"
@@ -65,9 +131,34 @@ class Dynamo:
             except ClientError as e:
                 logger.error(
                     f"{e.response['Error']['Code'], e.response['Error']['Message']}")
-                raise Exception(f"dynamo error {e.response['Error']['Code']} and msg {e.response['Error']['Message']}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
+
+    @staticmethod
+    def update_item(table_name: str, key: dict, update_expression: str, expression_values: dict | None = None,
+                    expression_names: dict | None = None, condition_expression: str | None = None,
+                    return_values: str = 'UPDATED_NEW') -> dict:
+        # general purpose single round trip update (SET/ADD/REMOVE), returns the requested attributes
+        with tracer.start_as_current_span(
+                "update_item",
+                attributes={'attr.table_name': table_name}):
+            request: dict = {'Key': key, 'UpdateExpression': update_expression, 'ReturnValues': return_values}
+            if expression_values:
+                request['ExpressionAttributeValues'] = expression_values
+            if expression_names:
+                request['ExpressionAttributeNames'] = expression_names
+            if condition_expression:
+                request['ConditionExpression'] = condition_expression
+            try:
+                table = get_table(table_name)
+                response = table.update_item(**request)
+                return response.get('Attributes', {})
+            except ClientError as e:
+                logger.error(
+                    f"{e.response['Error']['Code'], e.response['Error']['Message']}")
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    raise ConditionalCheckFailedError(f"condition failed on {table_name} {key}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
 
-    # todo create a general update handlers function
     @staticmethod
     def update_user_password(table_name: str, item: dict) -> str:
         with tracer.start_as_current_span(
@@ -76,19 +167,19 @@ class Dynamo:
             name = item["name"]
             password = item["password"]
             try:
-                table = dyn_resource.Table(table_name)
+                table = get_table(table_name)
                 response = table.update_item(
                     Key={'name': name},
                     UpdateExpression="set password=:p",
                     ExpressionAttributeValues={
                         ':p': password},
                     ReturnValues="UPDATED_NEW")
-                print(response)
+                logger.debug('update_user_password: %s', response.get('Attributes'))
                 return 'update item success'
             except ClientError as e:
                 logger.error(
                     f"{e.response['Error']['Code'], e.response['Error']['Message']}")
-                raise Exception(f"dynamo error {e.response['Error']['Code']} and msg {e.response['Error']['Message']}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
 
     @staticmethod
     def update_account_balance(table_name: str, item: dict | list) -> str:
@@ -98,15 +189,109 @@ class Dynamo:
             name = item["name"]
             balance = item["balance"]
             try:
-                table = dyn_resource.Table(table_name)
+                table = get_table(table_name)
                 response = table.update_item(
                     Key={'name': name},
-                    UpdateExpression="set balance=:p",
+                    UpdateExpression="set balance=:p add version :one",
                     ExpressionAttributeValues={
-                        ':p': balance},
+                        ':p': balance, ':one': 1},
                     ReturnValues="UPDATED_NEW")
                 return 'update item success'
             except ClientError as e:
                 logger.error(
                     f"{e.response['Error']['Code'], e.response['Error']['Message']}")
-                raise Exception(f"dynamo error {e.response['Error']['Code']} and msg {e.response['Error']['Message']}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
+
+    @staticmethod
+    def transact_write_items(actions: list[dict]) -> str:
+        # actions are TransactWriteItems entries with resource style values, applied all or nothing
+        with tracer.start_as_current_span(
+                "transact_write_items",
+                attributes={'attr.table_names': sorted({list(a.values())[0]['TableName'] for a in actions})}):
+            transact_items = []
+            for action in actions:
+                (kind, request), = action.items()
+                request = dict(request)
+                for field in ('Item', 'Key', 'ExpressionAttributeValues'):
+                    if field in request:
+                        request[field] = {k: serialize(v) for k, v in request[field].items()}
+                transact_items.append({kind: request})
+            try:
+                get_resource().meta.client.transact_write_items(TransactItems=transact_items)
+                return 'transaction succeeded'
+            except ClientError as e:
+                logger.error(
+                    f"{e.response['Error']['Code'], e.response['Error']['Message']}")
+                if e.response['Error']['Code'] == 'TransactionCanceledException':
+                    reasons = [reason.get('Code', 'None') for reason in e.response.get('CancellationReasons', [])]
+                    raise TransactionCancelledError(e.response['Error']['Message'], reasons)
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
+
+    @staticmethod
+    def batch_get(keys_by_table: dict[str, list[dict]],
+                  consistent_read: bool = False) -> tuple[dict[str, list[dict]], dict[str, list[dict]]]:
+        # one BatchGetItem of at most BATCH_GET_MAX_KEYS distinct keys. Returns the items and the keys
+        # DynamoDB left unprocessed, by table: sending those again is up to the caller
+        with tracer.start_as_current_span(
+                "batch_get",
+                attributes={'attr.table_names': sorted(keys_by_table)}):
+            request_items = {table_name: {'Keys': keys, 'ConsistentRead': consistent_read}
+                             for table_name, keys in keys_by_table.items() if keys}
+            try:
+                response = get_resource().batch_get_item(RequestItems=request_items)
+            except ClientError as e:
+                logger.error(
+                    f"{e.response['Error']['Code'], e.response['Error']['Message']}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
+            unprocessed = {table_name: request['Keys']
+                           for table_name, request in (response.get('UnprocessedKeys') or {}).items()}
+            return response.get('Responses', {}), unprocessed
+
+    @staticmethod
+    def query(table_name: str, key_condition: str, expression_values: dict, expression_names: dict | None = None,
+              limit: int | None = None, exclusive_start_key: dict | None = None,
+              scan_forward: bool = True) -> tuple[list[dict], dict | None]:
+        # one page of a Query, the key it returns is passed back as exclusive_start_key to get the next page
+        with tracer.start_as_current_span(
+                "query",
+                attributes={'attr.table_name': table_name}):
+            request: dict = {'KeyConditionExpression': key_condition, 'ExpressionAttributeValues': expression_values,
+                             'ScanIndexForward': scan_forward}
+            if expression_names:
+                request['ExpressionAttributeNames'] = expression_names
+            if limit:
+                request['Limit'] = limit
+            if exclusive_start_key:
+                request['ExclusiveStartKey'] = exclusive_start_key
+            try:
+                response = get_table(table_name).query(**request)
+                return response.get('Items', []), response.get('LastEvaluatedKey')
+            except ClientError as e:
+                logger.error(
+                    f"{e.response['Error']['Code'], e.response['Error']['Message']}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
+
+    @staticmethod
+    def scan_page(table_name: str, segment: int, total_segments: int, exclusive_start_key: dict | None = None,
+                  limit: int | None = None, typed: bool = False) -> tuple[list[dict], dict | None]:
+        # one page of one segment of a parallel Scan, the segments can be read concurrently. typed items
+        # (and keys) stay in DynamoDB JSON as the low level client returns them, which skips converting
+        # every attribute to a python value when it is only written out again
+        with tracer.start_as_current_span(
+                "scan_page",
+                attributes={'attr.table_name': table_name, 'attr.segment': segment}):
+            request: dict = {'Segment': segment, 'TotalSegments': total_segments}
+            if limit:
+                request['Limit'] = limit
+            if exclusive_start_key:
+                request['ExclusiveStartKey'] = exclusive_start_key
+            try:
+                if typed:
+                    response = get_resource().meta.client.scan(TableName=table_name, **request)
+                else:
+                    response = get_table(table_name).scan(**request)
+                return response.get('Items', []), response.get('LastEvaluatedKey')
+            except ClientError as e:
+                logger.error(
+                    f"{e.response['Error']['Code'], e.response['Error']['Message']}")
+                raise DynamoError(e.response['Error']['Code'], e.response['Error']['Message'])
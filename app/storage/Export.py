@@ -0,0 +1,112 @@
+"""NDJSON export of a table through a parallel segmented Scan.
+
+    python -m app.storage.Export --tables ledger portfolio --segments 8 --out-dir exports
+
+writes exports/<table>-<UTC timestamp>.ndjson.gz, one {"Item": <DynamoDB JSON>} line per item like the
+DynamoDB export to S3. The same stream is served by GET /admin/export/{table}.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import time
+from typing import AsyncIterator
+
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Resilience import start_deadline
+
+# Every segment is paged through by its own task and the pages are handed over through a queue of
+# EXPORT_QUEUE_PAGES pages, so the memory of an export is bounded whatever the table size and its
+# time is about the slowest segment's rather than the sum of the pages. The segments share the
+# DYNAMO_MAX_WORKERS threads of the storage calls.
+EXPORT_TABLES = frozenset(filter(None, os.environ.get(
+    'EXPORT_TABLES', 'ledger,ledgerTest,portfolio,portfolioTest').split(',')))
+EXPORT_SEGMENTS = int(os.environ.get('EXPORT_SEGMENTS', '4'))
+EXPORT_MAX_SEGMENTS = 64
+EXPORT_QUEUE_PAGES = int(os.environ.get('EXPORT_QUEUE_PAGES', '8'))
+# items per Scan page, 0 lets DynamoDB fill pages up to 1 MB
+EXPORT_PAGE_ITEMS = int(os.environ.get('EXPORT_PAGE_ITEMS', '0'))
+
+DONE = object()
+encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+async def scan_pages(table_name: str, segments: int = EXPORT_SEGMENTS, queue_pages: int = EXPORT_QUEUE_PAGES,
+                     typed: bool = True) -> AsyncIterator[list[dict]]:
+    # pages of items, in DynamoDB JSON when typed, in the order they arrive. Closing the iterator stops the scan
+    queue: asyncio.Queue = asyncio.Queue(queue_pages)
+
+    async def scan_segment(segment: int):
+        start_key = None
+        try:
+            while True:
+                # an export outlives the request deadline, each page gets the budget of a request
+                start_deadline()
+                items, start_key = await AsyncDynamo.scan_page(table_name, segment, segments, start_key,
+                                                               EXPORT_PAGE_ITEMS or None, typed)
+                if items:
+                    await queue.put(items)
+                if start_key is None:
+                    break
+            await queue.put(DONE)
+        except Exception as e:
+            await queue.put(e)
+
+    tasks = [asyncio.create_task(scan_segment(segment)) for segment in range(segments)]
+    try:
+        remaining = segments
+        while remaining:
+            page = await queue.get()
+            if page is DONE:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def ndjson(items: list[dict]) -> str:
+    return ''.join([encoder.encode({'Item': item}) + '\n' for item in items])
+
+
+async def export_ndjson(table_name: str, segments: int = EXPORT_SEGMENTS) -> AsyncIterator[str]:
+    async for page in scan_pages(table_name, segments):
+        yield ndjson(page)
+
+
+async def export_to_file(table_name: str, path: str, segments: int = EXPORT_SEGMENTS) -> int:
+    # the compression runs off the event loop so the segments keep scanning meanwhile
+    items = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as out:
+        async for page in scan_pages(table_name, segments):
+            await asyncio.to_thread(out.write, ndjson(page))
+            items += len(page)
+    return items
+
+
+async def export_tables(tables: list[str], segments: int, out_dir: str):
+    stamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    os.makedirs(out_dir, exist_ok=True)
+    for table_name in tables:
+        path = os.path.join(out_dir, f'{table_name}-{stamp}.ndjson.gz')
+        started = time.perf_counter()
+        items = await export_to_file(table_name, path, segments)
+        print(f'{table_name}: {items} items to {path} in {time.perf_counter() - started:.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tables', nargs='+', default=['ledger', 'portfolio'])
+    parser.add_argument('--segments', type=int, default=EXPORT_SEGMENTS)
+    parser.add_argument('--out-dir', default='.')
+    args = parser.parse_args()
+    asyncio.run(export_tables(args.tables, args.segments, args.out_dir))
+
+
+if __name__ == '__main__':
+    main()
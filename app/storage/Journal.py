@@ -0,0 +1,133 @@
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+from decimal import *
+from typing import AsyncIterator
+
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import ConditionalCheckFailedError
+
+# Append-only journal of the balance movements of the ledger, one item per movement of an account
+# keyed by (name, entry_id). Entries are written in the same transaction as the balance they move and
+# are never updated; a batch that has to be undone appends reversal entries.
+#
+# entry_id is "e#<nanoseconds>#<random>" so the entries of an account sort by time. Snapshots live
+# in the same partition as "s#<nanoseconds>#<random>" of the last entry they fold: balance is the sum
+# of the amounts of every entry up to it. The journal balance of an account is its latest snapshot
+# plus the entries after it, compaction writes a new snapshot once JOURNAL_SNAPSHOT_EVERY entries
+# piled up. Only entries older than JOURNAL_SETTLE_SECONDS are folded, a transaction that got its
+# entry id earlier may still be in flight.
+JOURNAL_ENABLED = os.environ.get('LEDGER_JOURNAL', '0') == '1'
+JOURNAL_SNAPSHOT_EVERY = int(os.environ.get('JOURNAL_SNAPSHOT_EVERY', '100'))
+JOURNAL_SETTLE_SECONDS = float(os.environ.get('JOURNAL_SETTLE_SECONDS', '60'))
+JOURNAL_PAGE_SIZE = 100
+JOURNAL_HISTORY_MAX_LIMIT = 100
+
+ENTRY_PREFIX = 'e#'
+SNAPSHOT_PREFIX = 's#'
+# above any entry id, below any snapshot id
+ENTRY_HIGH = 'e#~'
+
+
+def new_entry_id() -> str:
+    return f'{ENTRY_PREFIX}{time.time_ns():020d}#{secrets.token_hex(4)}'
+
+
+def entry_time(entry_id: str) -> float:
+    return int(entry_id.split('#')[1]) / 1e9
+
+
+def entry_action(journal_table: str, name: str, kind: str, amount: Decimal, entry_id: str, **fields) -> dict:
+    # kind is deposit, withdrawal, transfer_in, transfer_out, batch or reversal, amount is signed
+    created_at = datetime.fromtimestamp(entry_time(entry_id), timezone.utc).isoformat()
+    return {'Put': {
+        'TableName': journal_table,
+        'Item': {'name': name, 'entry_id': entry_id, 'kind': kind, 'amount': amount, 'created_at': created_at,
+                 **fields},
+        'ConditionExpression': 'attribute_not_exists(entry_id)'}}
+
+
+def reversal_action(action: dict) -> dict:
+    # appends the opposite of a committed entry
+    item = action['Put']['Item']
+    return entry_action(action['Put']['TableName'], item['name'], 'reversal', -item['amount'], new_entry_id(),
+                        reverses=item['entry_id'])
+
+
+async def latest_snapshot(journal_table: str, name: str) -> dict | None:
+    items, _ = await AsyncDynamo.query(journal_table, '#n = :n AND begins_with(entry_id, :prefix)',
+                                       {':n': name, ':prefix': SNAPSHOT_PREFIX}, {'#n': 'name'},
+                                       limit=1, scan_forward=False)
+    return next(iter(items), None)
+
+
+async def entries_after(journal_table: str, name: str, after: str | None) -> AsyncIterator[dict]:
+    # the entries after the given entry id, oldest first, one Query page at a time
+    start_key = None
+    while True:
+        items, start_key = await AsyncDynamo.query(journal_table, '#n = :n AND entry_id BETWEEN :low AND :high',
+                                                   {':n': name, ':low': after or ENTRY_PREFIX, ':high': ENTRY_HIGH},
+                                                   {'#n': 'name'}, limit=JOURNAL_PAGE_SIZE,
+                                                   exclusive_start_key=start_key)
+        for item in items:
+            if item['entry_id'] != after:
+                yield item
+        if start_key is None:
+            return
+
+
+def is_entry_id(entry_id: str) -> bool:
+    # snapshot ids and anything else sort outside the entries of an account
+    return entry_id.startswith(ENTRY_PREFIX) and entry_id < ENTRY_HIGH
+
+
+async def history(journal_table: str, name: str, limit: int, cursor: str | None = None) -> dict:
+    # a page of entries, newest first. cursor is the entry id the previous page ended on
+    if cursor is not None and not is_entry_id(cursor):
+        raise ValueError(f'invalid cursor {cursor}')
+    start_key = {'name': name, 'entry_id': cursor} if cursor else None
+    items, last_key = await AsyncDynamo.query(journal_table, '#n = :n AND entry_id BETWEEN :low AND :high',
+                                              {':n': name, ':low': ENTRY_PREFIX, ':high': ENTRY_HIGH},
+                                              {'#n': 'name'}, limit=limit, exclusive_start_key=start_key,
+                                              scan_forward=False)
+    return {'entries': items, 'cursor': last_key['entry_id'] if last_key else None}
+
+
+async def balance(journal_table: str, name: str) -> dict:
+    # latest snapshot plus the entries after it
+    snapshot = await latest_snapshot(journal_table, name)
+    total: Decimal = snapshot['balance'] if snapshot else Decimal(0)
+    tail = 0
+    async for entry in entries_after(journal_table, name, snapshot['through'] if snapshot else None):
+        total += entry['amount']
+        tail += 1
+    return {'name': name, 'balance': total, 'snapshot': snapshot['entry_id'] if snapshot else None, 'tail': tail}
+
+
+async def compact(journal_table: str, name: str, min_entries: int = JOURNAL_SNAPSHOT_EVERY) -> dict | None:
+    # folds the settled entries after the latest snapshot into a new one when there are at least
+    # min_entries of them. The snapshot id is derived from the last entry it folds, so concurrent
+    # compactions of an account write the same snapshot once.
+    snapshot = await latest_snapshot(journal_table, name)
+    total: Decimal = snapshot['balance'] if snapshot else Decimal(0)
+    entries: int = int(snapshot['entries']) if snapshot else 0
+    settled_before = time.time() - JOURNAL_SETTLE_SECONDS
+    folded = 0
+    through = None
+    async for entry in entries_after(journal_table, name, snapshot['through'] if snapshot else None):
+        if entry_time(entry['entry_id']) >= settled_before:
+            break
+        total += entry['amount']
+        folded += 1
+        through = entry['entry_id']
+    if through is None or folded < min_entries:
+        return None
+    item = {'name': name, 'entry_id': SNAPSHOT_PREFIX + through[len(ENTRY_PREFIX):], 'balance': total,
+            'through': through, 'entries': entries + folded,
+            'created_at': datetime.now(timezone.utc).isoformat()}
+    try:
+        await AsyncDynamo.create_item(journal_table, item, 'attribute_not_exists(entry_id)')
+    except ConditionalCheckFailedError:
+        pass
+    return item
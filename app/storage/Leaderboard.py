@@ -0,0 +1,237 @@
+import heapq
+import logging
+import os
+import secrets
+import time
+from decimal import *
+
+from app.common.Cache import TTLCache
+from app.storage import Export, LedgerShards
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import ConditionalCheckFailedError
+from app.storage.Resilience import StorageUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Top balances of the ledger, kept in the single "leaderboard" item of the aggregates table so a
+# read is one get_item instead of a scan and a sort. The board holds the exact balance of up to
+# LEADERBOARD_CAPACITY accounts and a floor: every account missing from the board has a balance of
+# at most floor (no floor, every account is on the board). The top n are known while n entries
+# of the board are at or above the floor.
+#
+# After every balance write the board is read with the balances of the accounts written, strongly
+# consistent, and written back (conditioned on its version) only when one of them is on the board
+# or above the floor, so most writes cost the read alone. A board entry that falls below the floor
+# stays exact, an account pushed off a full board raises the floor to its balance. Once too few
+# entries are above the floor the next read rebuilds the board from a scan of the ledger.
+#
+# A write that keeps losing the race for the board to other writers adds its accounts to the
+# pending set of the board instead, with an unconditional ADD: the next update or read records their
+# balances. Only a failed read or write drops the board, the next read then rebuilds it.
+#
+# A rebuild first writes an empty board marked "rebuild": until it is done every balance write
+# records its account on the board. The scan then misses no write, a write either saw the marker
+# or finished before the scan started, and the balances recorded during the scan win over the ones
+# it read. Reads that find a rebuild in progress answer 503 rather than scanning the ledger again,
+# unless it started more than LEADERBOARD_REBUILD_SECONDS ago and is taken to have died.
+LEADERBOARD_ENABLED = os.environ.get('LEADERBOARD', '0') == '1'
+# largest n served, the board keeps twice as many accounts so the floor rises slowly
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '100'))
+LEADERBOARD_CAPACITY = 2 * LEADERBOARD_SIZE
+LEADERBOARD_WRITE_ATTEMPTS = 5
+LEADERBOARD_REBUILD_SECONDS = int(os.environ.get('LEADERBOARD_REBUILD_SECONDS', '60'))
+
+LEADERBOARD = 'leaderboard'
+# balance recorded for an account deleted during a rebuild
+DELETED = Decimal(-1)
+
+BOARD_TABLES = {'ledger': 'aggregates', 'ledgerTest': 'aggregatesTest'}
+
+# concurrent reads of a process that need a rebuild share one
+rebuilds = TTLCache('leaderboard-rebuilds', max_size=8, ttl_seconds=0)
+
+
+def record(board: dict, name: str, balance: Decimal | None, capacity: int | None = None) -> bool:
+    # balance is None for a deleted account. Returns True when the board changed
+    capacity = capacity or LEADERBOARD_CAPACITY
+    entries: dict[str, Decimal] = board['entries']
+    if 'rebuild' in board:
+        balance = DELETED if balance is None else balance
+    elif balance is None:
+        return entries.pop(name, None) is not None
+    elif name not in entries and 'floor' in board and balance <= board['floor']:
+        return False
+    if entries.get(name) == balance:
+        return False
+    entries[name] = balance
+    if len(entries) > capacity and 'rebuild' not in board:
+        for evicted, evicted_balance in heapq.nsmallest(len(entries) - capacity, entries.items(),
+                                                        key=lambda entry: entry[1]):
+            del entries[evicted]
+            board['floor'] = max(board.get('floor', evicted_balance), evicted_balance)
+    return True
+
+
+def ranked(board: dict, n: int) -> list[dict] | None:
+    # the top n accounts, richest first, None when the board can not tell
+    if 'rebuild' in board or 'pending' in board:
+        return None
+    top = sorted(board['entries'].items(), key=lambda entry: (-entry[1], entry[0]))[:n]
+    if 'floor' in board and (len(top) < n or top[-1][1] < board['floor']):
+        return None
+    return [{'rank': rank, 'name': name, 'balance': balance} for rank, (name, balance) in enumerate(top, 1)]
+
+
+def build(balances: dict[str, Decimal], capacity: int | None = None) -> dict:
+    # a board from the balance of every account
+    capacity = capacity or LEADERBOARD_CAPACITY
+    top = heapq.nlargest(capacity + 1, balances.items(), key=lambda entry: (entry[1], entry[0]))
+    board: dict = {'entries': dict(top[:capacity])}
+    if len(balances) > capacity:
+        board['floor'] = max(balance for name, balance in balances.items() if name not in board['entries'])
+    return board
+
+
+async def read_board(board_table: str, consistent_read: bool = False) -> dict | None:
+    if consistent_read:
+        return next(iter((await AsyncDynamo.batch_get({board_table: [{'name': LEADERBOARD}]}, True))[board_table]),
+                    None)
+    item = await AsyncDynamo.get_item(board_table, {'name': LEADERBOARD})
+    return item if 'name' in item else None
+
+
+async def save(board_table: str, board: dict, version: int | None) -> bool:
+    # version is the one of the board that was read, None when there was none
+    item = {**board, 'name': LEADERBOARD, 'version': (version or 0) + 1}
+    try:
+        if version is None:
+            await AsyncDynamo.create_item(board_table, item, 'attribute_not_exists(#n)', None, {'#n': 'name'})
+        else:
+            await AsyncDynamo.create_item(board_table, item, 'version = :version', {':version': version})
+        return True
+    except ConditionalCheckFailedError:
+        return False
+
+
+async def balances_of(table_name: str, items: list[dict], names: list[str]) -> dict[str, Decimal | None]:
+    # the balances of the accounts from their base items read strongly consistent, None when deleted
+    balances: dict[str, Decimal | None] = {name: None for name in names}
+    for name, shards in (await LedgerShards.load_shards(table_name, items, True)).items():
+        balances[name] = sum(shards.values())
+    return balances
+
+
+async def record_balances(table_name: str, names: list[str]) -> bool:
+    # records the accounts and the pending ones on the board. False when other writers kept changing it
+    board_table = BOARD_TABLES[table_name]
+    for _ in range(LEADERBOARD_WRITE_ATTEMPTS):
+        found = await AsyncDynamo.batch_get({table_name: [{'name': name} for name in names],
+                                             board_table: [{'name': LEADERBOARD}]}, True)
+        board = next(iter(found[board_table]), None)
+        if board is None:
+            return True
+        had_pending = 'pending' in board
+        pending = sorted(set(board.pop('pending', set())) - set(names))
+        items = found[table_name]
+        if pending:
+            items += (await AsyncDynamo.batch_get({table_name: [{'name': name} for name in pending]}, True))[table_name]
+        balances = await balances_of(table_name, items, names + pending)
+        changed = [record(board, name, balance) for name, balance in balances.items()]
+        if not any(changed) and not had_pending:
+            return True
+        if await save(board_table, board, int(board['version'])):
+            return True
+    return False
+
+
+async def mark_pending(board_table: str, names: list[str]):
+    # an unconditional ADD can not lose a race, it bumps the version so no concurrent save drops it
+    try:
+        await AsyncDynamo.update_item(board_table, {'name': LEADERBOARD}, 'ADD pending :names, version :one',
+                                      expression_values={':names': set(names), ':one': 1},
+                                      expression_names={'#n': 'name'},
+                                      condition_expression='attribute_exists(#n)')
+    except ConditionalCheckFailedError:
+        # the board is gone, the next read rebuilds it
+        pass
+
+
+async def refresh(table_name: str, names: list[str]):
+    # a board that can not be read or written is dropped, it is rebuilt by the next read
+    board_table = BOARD_TABLES[table_name]
+    try:
+        if await record_balances(table_name, names) or not names:
+            return
+        logger.info('leaderboard of %s kept changing, %s left pending', table_name, names)
+        await mark_pending(board_table, names)
+    except Exception as e:
+        logger.warning('leaderboard of %s dropped after a failed update: %s', table_name, e)
+        try:
+            await AsyncDynamo.delete_item(board_table, {'name': LEADERBOARD})
+        except Exception as e:
+            logger.error('leaderboard of %s could not be dropped, it may miss %s: %s', table_name, names, e)
+
+
+async def update(table_name: str, names: list[str]):
+    # after a balance write of the accounts
+    if not LEADERBOARD_ENABLED or not names:
+        return
+    await refresh(table_name, names)
+
+
+async def scan_balances(table_name: str) -> dict[str, Decimal]:
+    # the balance of every account, its shards summed
+    balances: dict[str, Decimal] = {}
+    async for page in Export.scan_pages(table_name, typed=False):
+        for item in page:
+            name = LedgerShards.account_of(item['name'])
+            balances[name] = balances.get(name, Decimal(0)) + item['balance']
+    return balances
+
+
+async def rebuild(table_name: str) -> dict:
+    board_table = BOARD_TABLES[table_name]
+    token = secrets.token_hex(4)
+    for _ in range(LEADERBOARD_WRITE_ATTEMPTS):
+        current = await read_board(board_table, consistent_read=True)
+        if current and 'rebuild' in current and \
+                time.time() - int(current['started_at']) < LEADERBOARD_REBUILD_SECONDS:
+            raise StorageUnavailableError(board_table, retry_after=5)
+        if await save(board_table, {'entries': {}, 'rebuild': token, 'started_at': int(time.time())},
+                      int(current['version']) if current else None):
+            break
+    else:
+        raise ValueError(f'leaderboard kept changing, not rebuilt after {LEADERBOARD_WRITE_ATTEMPTS} attempts')
+    balances = await scan_balances(table_name)
+    board = build(balances)
+    for _ in range(LEADERBOARD_WRITE_ATTEMPTS):
+        current = await read_board(board_table, consistent_read=True)
+        if current is None or current.get('rebuild') != token:
+            # a later rebuild took over and writes the board, this one answers from its own scan
+            return board
+        merged = {**balances, **current['entries']}
+        pending = sorted(current.get('pending', set()))
+        if pending:
+            # accounts written during the scan that could not be recorded on the board
+            items = (await AsyncDynamo.batch_get({table_name: [{'name': name} for name in pending]}, True))[table_name]
+            for name, balance in (await balances_of(table_name, items, pending)).items():
+                merged[name] = DELETED if balance is None else balance
+        board = build({name: balance for name, balance in merged.items() if balance != DELETED})
+        if await save(board_table, board, int(current['version'])):
+            return board
+    return board
+
+
+async def top(table_name: str, n: int) -> list[dict]:
+    board_table = BOARD_TABLES[table_name]
+    board = await read_board(board_table)
+    if board and 'pending' in board and 'rebuild' not in board:
+        # accounts whose update lost to contention are recorded before the board is ranked
+        await refresh(table_name, [])
+        board = await read_board(board_table, consistent_read=True)
+    leaders = ranked(board, n) if board else None
+    if leaders is None:
+        logger.info('rebuilding the leaderboard of %s', table_name)
+        board = await rebuilds.get_or_load(table_name, lambda: rebuild(table_name), cache_if=lambda _: False)
+        leaders = ranked(board, n)
+    return leaders
@@ -0,0 +1,227 @@
+import os
+import random
+from decimal import *
+
+from app.common.Cache import TTLCache
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import TransactionCancelledError
+
+# DynamoDB caps the writes per second of a single item, so the balance of a hot account can be split
+# over shard items. The base ledger item, keyed by the account name, is shard 0 and carries
+# shards = N, shards 1 to N-1 are items named "name#i" in the same table (account names never
+# contain #). The balance of the account is the sum of its shards.
+#
+# Credits go to a random shard, debits take from as many shards as needed in one transaction, each
+# shard conditioned on its own balance. A credit to the base item is right whether the account is
+# sharded or not, so the shard count of an account is only remembered for
+# LEDGER_SHARD_COUNT_TTL_SECONDS: a stale count costs a retry, never a wrong balance.
+LEDGER_SHARDS_MAX = int(os.environ.get('LEDGER_SHARDS_MAX', '32'))
+LEDGER_SHARD_COUNT_TTL_SECONDS = float(os.environ.get('LEDGER_SHARD_COUNT_TTL_SECONDS', '30'))
+# how long the summed balance of a sharded account may be served to reads, off by default
+LEDGER_SHARD_TOTAL_TTL_SECONDS = float(os.environ.get('LEDGER_SHARD_TOTAL_TTL_MS', '0')) / 1000
+# a migration is tried again when a concurrent write changed one of the shards it read
+LEDGER_SHARD_MIGRATION_ATTEMPTS = 5
+
+shard_counts = TTLCache('ledger-shard-counts', max_size=4096, ttl_seconds=LEDGER_SHARD_COUNT_TTL_SECONDS)
+shard_totals = TTLCache('ledger-shard-totals', max_size=1024, ttl_seconds=LEDGER_SHARD_TOTAL_TTL_SECONDS)
+
+
+def shard_name(name: str, index: int) -> str:
+    return name if index == 0 else f'{name}#{index}'
+
+
+def account_of(item_name: str) -> str:
+    return item_name.split('#', 1)[0]
+
+
+def remember(table_name: str, item: dict):
+    # item is a base ledger item as read or returned by a write
+    shard_counts.set((table_name, item['name']), int(item.get('shards', 1)))
+
+
+def known_shards(table_name: str, name: str) -> int:
+    return shard_counts.get((table_name, name), 1)
+
+
+def forget(table_name: str, name: str):
+    shard_counts.invalidate((table_name, name))
+    shard_totals.invalidate((table_name, name))
+
+
+def balance_action(table_name: str, item_name: str, delta: Decimal, unsharded: bool = False) -> dict:
+    # every balance write is an ADD, a debit may not take the item below zero. unsharded debits
+    # fail on a sharded base item, whose own balance is only part of the account's
+    condition: str = 'attribute_exists(#n)'
+    values: dict = {':delta': delta, ':one': 1}
+    if delta < 0:
+        if unsharded:
+            condition += ' AND attribute_not_exists(shards)'
+        condition += ' AND balance >= :withdrawal'
+        values[':withdrawal'] = -delta
+    return {'Update': {
+        'TableName': table_name,
+        'Key': {'name': item_name},
+        'UpdateExpression': 'ADD balance :delta, version :one',
+        'ConditionExpression': condition,
+        'ExpressionAttributeNames': {'#n': 'name'},
+        'ExpressionAttributeValues': values}}
+
+
+def inverse_action(action: dict) -> dict:
+    # gives back what a committed balance_action took or added. Unconditional, a revert can not be
+    # cancelled by a write made since
+    request = action['Update']
+    return {'Update': {'TableName': request['TableName'],
+                       'Key': request['Key'],
+                       'UpdateExpression': request['UpdateExpression'],
+                       'ExpressionAttributeValues': {':delta': -request['ExpressionAttributeValues'][':delta'],
+                                                     ':one': 1}}}
+
+
+def credit_action(table_name: str, name: str, amount: Decimal) -> dict:
+    return balance_action(table_name, shard_name(name, random.randrange(known_shards(table_name, name))), amount)
+
+
+def debit_actions(table_name: str, name: str, amount: Decimal, shards: dict[int, Decimal] | None = None) -> list[dict]:
+    # shards are the balances read for the account, None when the account is taken to be unsharded.
+    # The largest shards are drawn first so the debit touches as few items as it can. No actions
+    # when the shards can not cover the amount.
+    if not shards or len(shards) == 1:
+        return [balance_action(table_name, name, -amount, unsharded=True)]
+    if sum(shards.values()) < amount:
+        return []
+    actions: list[dict] = []
+    remaining: Decimal = amount
+    for index, balance in sorted(shards.items(), key=lambda shard: shard[1], reverse=True):
+        take = min(balance, remaining)
+        if take <= 0:
+            break
+        actions.append(balance_action(table_name, shard_name(name, index), -take))
+        remaining -= take
+    return actions
+
+
+async def load_shards(table_name: str, items: list[dict],
+                      consistent_read: bool = False) -> dict[str, dict[int, Decimal]]:
+    # balance of every shard of the base items, an unsharded account has the single shard 0
+    balances: dict[str, dict[int, Decimal]] = {}
+    extra: list[dict] = []
+    for item in items:
+        remember(table_name, item)
+        balances[item['name']] = {0: item['balance']}
+        extra += [{'name': shard_name(item['name'], index)} for index in range(1, int(item.get('shards', 1)))]
+    if extra:
+        for shard in (await AsyncDynamo.batch_get({table_name: extra}, consistent_read))[table_name]:
+            name, index = shard['name'].split('#', 1)
+            balances[name][int(index)] = shard['balance']
+    return balances
+
+
+async def read_balances(table_name: str, names: list[str],
+                        consistent_read: bool = False) -> dict[str, dict[int, Decimal]]:
+    items = (await AsyncDynamo.batch_get({table_name: [{'name': name} for name in names]},
+                                         consistent_read))[table_name]
+    return await load_shards(table_name, items, consistent_read)
+
+
+async def recheck(table_name: str, name: str) -> bool:
+    # after a write of the account failed its condition: True when the account is sharded or its shard
+    # count changed, the write is then planned again from fresh balances
+    before = known_shards(table_name, name)
+    forget(table_name, name)
+    shards = (await read_balances(table_name, [name])).get(name)
+    return shards is not None and (len(shards) > 1 or len(shards) != before)
+
+
+async def with_totals(table_name: str, items: list[dict]) -> list[dict]:
+    # the same items with the balance of sharded accounts summed over their shards
+    sharded = [item for item in items if int(item.get('shards', 1)) > 1]
+    totals: dict[str, Decimal] = {}
+    missing: list[dict] = []
+    for item in sharded:
+        total = shard_totals.get((table_name, item['name']))
+        if total is None:
+            missing.append(item)
+        else:
+            totals[item['name']] = total
+    for name, shards in (await load_shards(table_name, missing)).items():
+        totals[name] = sum(shards.values())
+        shard_totals.set((table_name, name), totals[name])
+    return [{**{k: v for k, v in item.items() if k != 'shards'}, 'balance': totals[item['name']]}
+            if item['name'] in totals else item for item in items]
+
+
+async def shard_account(table_name: str, name: str, count: int) -> dict:
+    # shards an account in place: the base item keeps the balance as shard 0, the new shards start empty
+    if not 2 <= count <= LEDGER_SHARDS_MAX:
+        raise ValueError(f'shard count must be between 2 and {LEDGER_SHARDS_MAX}')
+    actions: list[dict] = [{'Update': {
+        'TableName': table_name,
+        'Key': {'name': name},
+        'UpdateExpression': 'SET shards = :count ADD version :one',
+        'ConditionExpression': 'attribute_exists(#n) AND attribute_not_exists(shards)',
+        'ExpressionAttributeNames': {'#n': 'name'},
+        'ExpressionAttributeValues': {':count': count, ':one': 1}}}]
+    actions += [{'Put': {
+        'TableName': table_name,
+        'Item': {'name': shard_name(name, index), 'balance': Decimal(0), 'version': 0},
+        'ConditionExpression': 'attribute_not_exists(#n)',
+        'ExpressionAttributeNames': {'#n': 'name'}}} for index in range(1, count)]
+    try:
+        await AsyncDynamo.transact_write_items(actions)
+    except TransactionCancelledError as e:
+        if e.reasons and e.reasons[0] == 'ConditionalCheckFailed':
+            raise ValueError('account not found or already sharded')
+        raise
+    finally:
+        forget(table_name, name)
+    return {'name': name, 'shards': count}
+
+
+async def unshard_account(table_name: str, name: str) -> dict:
+    # folds the shards back into the base item. Each shard is deleted on the condition that it still
+    # holds the balance that was read, a concurrent write makes the migration start over.
+    for _ in range(LEDGER_SHARD_MIGRATION_ATTEMPTS):
+        shards = (await read_balances(table_name, [name])).get(name)
+        if shards is None:
+            raise ValueError('account not found')
+        if len(shards) == 1:
+            return {'name': name, 'shards': 1}
+        others = {index: balance for index, balance in shards.items() if index != 0}
+        actions: list[dict] = [{'Update': {
+            'TableName': table_name,
+            'Key': {'name': name},
+            'UpdateExpression': 'ADD balance :delta, version :one REMOVE shards',
+            'ConditionExpression': 'shards = :count',
+            'ExpressionAttributeValues': {':delta': sum(others.values()), ':one': 1, ':count': len(shards)}}}]
+        actions += [{'Delete': {
+            'TableName': table_name,
+            'Key': {'name': shard_name(name, index)},
+            'ConditionExpression': 'balance = :balance',
+            'ExpressionAttributeValues': {':balance': balance}}} for index, balance in others.items()]
+        try:
+            await AsyncDynamo.transact_write_items(actions)
+            return {'name': name, 'shards': 1}
+        except TransactionCancelledError:
+            continue
+        finally:
+            forget(table_name, name)
+    raise ValueError(f'shards kept changing, account not unsharded after {LEDGER_SHARD_MIGRATION_ATTEMPTS} attempts')
+
+
+def set_balance_actions(table_name: str, name: str, balance: Decimal, shards: dict[int, Decimal]) -> list[dict]:
+    # an absolute balance goes to the base item and empties the other shards, each shard on the
+    # condition that it was not written since it was read
+    actions: list[dict] = [{'Update': {
+        'TableName': table_name,
+        'Key': {'name': name},
+        'UpdateExpression': 'SET balance = :balance ADD version :one',
+        'ExpressionAttributeValues': {':balance': balance, ':one': 1}}}]
+    actions += [{'Update': {
+        'TableName': table_name,
+        'Key': {'name': shard_name(name, index)},
+        'UpdateExpression': 'SET balance = :zero ADD version :one',
+        'ConditionExpression': 'balance = :balance',
+        'ExpressionAttributeValues': {':zero': Decimal(0), ':one': 1, ':balance': shard_balance}}}
+        for index, shard_balance in shards.items() if index != 0]
+    return actions
@@ -0,0 +1,648 @@
+import copy
+import os
+import re
+import threading
+import time
+import zlib
+from decimal import *
+from types import SimpleNamespace
+
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# In-memory stand-in for the subset of the boto3 DynamoDB resource used by app.storage.Dynamo.
+# It evaluates the same update/condition expressions as DynamoDB so handlers can be exercised
+# and load-tested offline (DYNAMO_BACKEND=local).
+
+# table name -> (hash key, range key). Tables not listed are keyed by 'name' only.
+KEY_SCHEMAS: dict[str, tuple[str, str | None]] = {
+    'journal': ('name', 'entry_id'),
+    'journalTest': ('name', 'entry_id'),
+    'portfolioHistory': ('name', 'block'),
+    'portfolioHistoryTest': ('name', 'block'),
+}
+
+MISSING = object()
+
+# a Scan without Limit returns pages of up to 1 MB, about this many small items
+SCAN_PAGE_ITEMS = 1000
+
+TOKEN_RE = re.compile(r'\s*(?:(?P<name>#\w+)|(?P<value>:\w+)|(?P<number>\d+)|(?P<op><>|<=|>=|[=<>+\-(),.\[\]])|'
+                      r'(?P<ident>[A-Za-z_]\w*))')
+KEYWORDS = {'SET', 'ADD', 'REMOVE', 'DELETE', 'AND', 'OR', 'NOT', 'BETWEEN', 'IN'}
+
+deserializer = TypeDeserializer()
+serializer = TypeSerializer()
+
+
+def client_error(code: str, message: str, operation: str, **extra) -> ClientError:
+    response = {'Error': {'Code': code, 'Message': message}}
+    response.update(extra)
+    return ClientError(response, operation)
+
+
+def validation_error(message: str) -> ClientError:
+    return client_error('ValidationException', message, 'Expression')
+
+
+def attribute_type(value) -> str:
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, str):
+        return 'S'
+    if isinstance(value, (Decimal, int, float)):
+        return 'N'
+    if isinstance(value, (bytes, bytearray, Binary)):
+        return 'B'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, dict):
+        return 'M'
+    if isinstance(value, list):
+        return 'L'
+    if isinstance(value, set):
+        sample = next(iter(value), '')
+        return {'S': 'SS', 'N': 'NS', 'B': 'BS'}[attribute_type(sample)]
+    raise validation_error(f'unsupported attribute value {value!r}')
+
+
+def to_number(value):
+    if isinstance(value, bool) or not isinstance(value, (Decimal, int, float)):
+        raise validation_error('An operand in the update expression has an incorrect data type')
+    return Decimal(str(value)) if isinstance(value, float) else Decimal(value)
+
+
+# Tokenizer and recursive descent parser for DynamoDB update/condition expressions
+class Expression:
+    def __init__(self, text: str, names: dict | None, values: dict | None):
+        self.tokens = self.tokenize(text)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    @staticmethod
+    def tokenize(text: str) -> list[tuple[str, str]]:
+        tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
+                raise validation_error(f'Invalid expression: syntax error near "{text[pos:]}"')
+            kind = match.lastgroup
+            token = match.group(kind)
+            if kind == 'ident' and token.upper() in KEYWORDS:
+                kind, token = 'keyword', token.upper()
+            tokens.append((kind, token))
+            pos = match.end()
+        return tokens
+
+    def peek(self, offset: int = 0) -> tuple[str, str] | tuple[None, None]:
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return None, None
+
+    def take(self, expected: str | None = None) -> str:
+        kind, token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise validation_error(f'Invalid expression: expected {expected or "token"}, got {token}')
+        self.pos += 1
+        return token
+
+    def accept(self, token: str) -> bool:
+        if self.peek()[1] == token:
+            self.pos += 1
+            return True
+        return False
+
+    def done(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    # ---- operands -----------------------------------------------------------------------
+
+    def path(self) -> list:
+        segments = [self.path_segment()]
+        while True:
+            if self.accept('.'):
+                segments.append(self.path_segment())
+            elif self.accept('['):
+                segments.append(int(self.take()))
+                self.take(']')
+            else:
+                return segments
+
+    def path_segment(self) -> str:
+        kind, token = self.peek()
+        if kind == 'name':
+            self.pos += 1
+            if token not in self.names:
+                raise validation_error(f'An expression attribute name used in the document path is not defined; '
+                                       f'attribute name: {token}')
+            return self.names[token]
+        if kind == 'ident':
+            self.pos += 1
+            return token
+        raise validation_error(f'Invalid expression: expected attribute path, got {token}')
+
+    def operand(self):
+        kind, token = self.peek()
+        if kind == 'value':
+            self.pos += 1
+            if token not in self.values:
+                raise validation_error(f'An expression attribute value used in expression is not defined; '
+                                       f'attribute value: {token}')
+            value = self.values[token]
+            return lambda item: value
+        if kind == 'ident' and self.peek(1)[1] == '(':
+            return self.function()
+        path = self.path()
+        return lambda item: get_path(item, path)
+
+    def function(self):
+        name = self.take()
+        self.take('(')
+        if name == 'if_not_exists':
+            path = self.path()
+            self.take(',')
+            default = self.value()
+            self.take(')')
+            return lambda item: (lambda current: default(item) if current is MISSING else current)(get_path(item, path))
+        if name == 'list_append':
+            first = self.value()
+            self.take(',')
+            second = self.value()
+            self.take(')')
+            return lambda item: list(first(item)) + list(second(item))
+        if name == 'size':
+            path = self.path()
+            self.take(')')
+            return lambda item: (lambda current: MISSING if current is MISSING else Decimal(len(current)))(
+                get_path(item, path))
+        if name in ('attribute_exists', 'attribute_not_exists'):
+            path = self.path()
+            self.take(')')
+            exists = name == 'attribute_exists'
+            return lambda item: (get_path(item, path) is not MISSING) == exists
+        if name == 'attribute_type':
+            path = self.path()
+            self.take(',')
+            expected = self.operand()
+            self.take(')')
+            return lambda item: (lambda current: current is not MISSING and attribute_type(current) == expected(item))(
+                get_path(item, path))
+        if name in ('begins_with', 'contains'):
+            path = self.path()
+            self.take(',')
+            operand = self.operand()
+            self.take(')')
+            if name == 'begins_with':
+                return lambda item: (lambda current: isinstance(current, str) and current.startswith(operand(item)))(
+                    get_path(item, path))
+            return lambda item: (lambda current: current is not MISSING and operand(item) in current)(
+                get_path(item, path))
+        raise validation_error(f'Invalid function name; function: {name}')
+
+    def value(self):
+        left = self.operand()
+        if self.peek()[1] in ('+', '-'):
+            sign = self.take()
+            right = self.operand()
+
+            def arithmetic(item):
+                a, b = left(item), right(item)
+                if a is MISSING or b is MISSING:
+                    raise validation_error('The provided expression refers to an attribute that does not exist '
+                                           'in the item')
+                return to_number(a) + to_number(b) if sign == '+' else to_number(a) - to_number(b)
+
+            return arithmetic
+        return left
+
+    # ---- conditions ---------------------------------------------------------------------
+
+    def condition(self):
+        left = self.and_condition()
+        while self.accept('OR'):
+            right = self.and_condition()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def and_condition(self):
+        left = self.not_condition()
+        while self.accept('AND'):
+            right = self.not_condition()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def not_condition(self):
+        if self.accept('NOT'):
+            inner = self.not_condition()
+            return lambda item: not inner(item)
+        return self.primary_condition()
+
+    def primary_condition(self):
+        if self.accept('('):
+            inner = self.condition()
+            self.take(')')
+            return inner
+        kind, token = self.peek()
+        if kind == 'ident' and token != 'size' and self.peek(1)[1] == '(':
+            return self.function()
+        left = self.operand()
+        if self.accept('BETWEEN'):
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: compare(low(item), '<=', left(item)) and compare(left(item), '<=', high(item))
+        if self.accept('IN'):
+            self.take('(')
+            options = [self.operand()]
+            while self.accept(','):
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(compare(left(item), '=', option(item)) for option in options)
+        comparator = self.take()
+        if comparator not in ('=', '<>', '<', '<=', '>', '>='):
+            raise validation_error(f'Invalid expression: unexpected comparator {comparator}')
+        right = self.operand()
+        return lambda item: compare(left(item), comparator, right(item))
+
+    # ---- update actions -----------------------------------------------------------------
+
+    def update_actions(self) -> list[tuple[str, list, object]]:
+        actions = []
+        while not self.done():
+            clause = self.take()
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append(('SET', path, self.value()))
+                elif clause == 'ADD':
+                    actions.append(('ADD', path, self.operand()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', path, None))
+                else:
+                    raise validation_error(f'Invalid UpdateExpression: unsupported clause {clause}')
+                if not self.accept(','):
+                    break
+        return actions
+
+
+def compare(left, comparator: str, right) -> bool:
+    if left is MISSING or right is MISSING:
+        return comparator == '<>' and left is not right
+    if comparator == '=':
+        return left == right
+    if comparator == '<>':
+        return left != right
+    if isinstance(left, bool) or isinstance(right, bool) or attribute_type(left) != attribute_type(right):
+        return False
+    if comparator == '<':
+        return left < right
+    if comparator == '<=':
+        return left <= right
+    if comparator == '>':
+        return left > right
+    return left >= right
+
+
+def get_path(item, path: list):
+    current = item
+    for segment in path:
+        if isinstance(segment, int):
+            if not isinstance(current, list) or segment >= len(current):
+                return MISSING
+        elif not isinstance(current, dict) or segment not in current:
+            return MISSING
+        current = current[segment]
+    return current
+
+
+def parent_of(item: dict, path: list):
+    parent = get_path(item, path[:-1])
+    if parent is MISSING or not isinstance(parent, (dict, list)):
+        raise validation_error('The document path provided in the update expression is invalid for update')
+    return parent
+
+
+def apply_update(item: dict, expression: str, names: dict | None, values: dict | None) -> set[str]:
+    # Evaluate every right hand side against the original item, then apply, like DynamoDB does
+    parser = Expression(expression, names, values)
+    actions = parser.update_actions()
+    original = copy.deepcopy(item)
+    resolved = [(action, path, operand(original) if operand else None) for action, path, operand in actions]
+    for action, path, operand in resolved:
+        if action == 'SET':
+            if operand is MISSING:
+                raise validation_error('The provided expression refers to an attribute that does not exist in the item')
+            parent_of(item, path)[path[-1]] = copy.deepcopy(operand)
+        elif action == 'ADD':
+            current = get_path(item, path)
+            if isinstance(operand, set):
+                parent_of(item, path)[path[-1]] = set(operand) | (set() if current is MISSING else current)
+            else:
+                parent_of(item, path)[path[-1]] = to_number(operand) + (
+                    Decimal(0) if current is MISSING else to_number(current))
+        else:
+            parent = get_path(item, path[:-1])
+            if isinstance(parent, dict):
+                parent.pop(path[-1], None)
+            elif isinstance(parent, list) and path[-1] < len(parent):
+                parent.pop(path[-1])
+    return {path[0] for _, path, _ in actions}
+
+
+def evaluate_condition(item: dict | None, expression: str | None, names: dict | None, values: dict | None) -> bool:
+    if not expression:
+        return True
+    parser = Expression(expression, names, values)
+    condition = parser.condition()
+    if not parser.done():
+        raise validation_error(f'Invalid ConditionExpression: unexpected token {parser.peek()[1]}')
+    return bool(condition(item or {}))
+
+
+def normalize(value):
+    # boto3 accepts python numbers and returns Decimal, mimic that on the way in
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return Binary(bytes(value))
+    return copy.deepcopy(value)
+
+
+class LocalTable:
+    def __init__(self, resource: 'LocalDynamoResource', name: str):
+        self.resource = resource
+        self.name = name
+        self.hash_key, self.range_key = KEY_SCHEMAS.get(name, ('name', None))
+
+    @property
+    def items(self) -> dict:
+        return self.resource.tables.setdefault(self.name, {})
+
+    def key_of(self, key: dict, operation: str) -> tuple:
+        expected = {self.hash_key} | ({self.range_key} if self.range_key else set())
+        if set(key) != expected or any(v is None for v in key.values()):
+            raise client_error('ValidationException', 'The provided key element does not match the schema', operation)
+        return tuple(key[k] for k in (self.hash_key, self.range_key) if k)
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        self.resource.simulate_latency()
+        with self.resource.lock:
+            item = self.items.get(self.key_of(Key, 'GetItem'))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item: dict, ReturnValues: str = 'NONE', ConditionExpression: str | None = None,
+                 ExpressionAttributeNames: dict | None = None, ExpressionAttributeValues: dict | None = None) -> dict:
+        self.resource.simulate_latency()
+        item = normalize(Item)
+        key = self.key_of({k: item.get(k) for k in (self.hash_key, self.range_key) if k}, 'PutItem')
+        with self.resource.lock:
+            old = self.items.get(key)
+            if not evaluate_condition(old, ConditionExpression, ExpressionAttributeNames,
+                                      normalize(ExpressionAttributeValues)):
+                raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+            self.items[key] = item
+            self.resource.record_change(self.name, old, item)
+            return {'Attributes': copy.deepcopy(old)} if ReturnValues == 'ALL_OLD' and old is not None else {}
+
+    def delete_item(self, Key: dict, ReturnValues: str = 'NONE', ConditionExpression: str | None = None,
+                    ExpressionAttributeNames: dict | None = None,
+                    ExpressionAttributeValues: dict | None = None) -> dict:
+        self.resource.simulate_latency()
+        key = self.key_of(Key, 'DeleteItem')
+        with self.resource.lock:
+            old = self.items.get(key)
+            if not evaluate_condition(old, ConditionExpression, ExpressionAttributeNames,
+                                      normalize(ExpressionAttributeValues)):
+                raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'DeleteItem')
+            self.items.pop(key, None)
+            self.resource.record_change(self.name, old, None)
+            return {'Attributes': copy.deepcopy(old)} if ReturnValues == 'ALL_OLD' and old is not None else {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, ReturnValues: str = 'NONE',
+                    ConditionExpression: str | None = None, ExpressionAttributeNames: dict | None = None,
+                    ExpressionAttributeValues: dict | None = None) -> dict:
+        self.resource.simulate_latency()
+        key = self.key_of(Key, 'UpdateItem')
+        values = normalize(ExpressionAttributeValues)
+        with self.resource.lock:
+            old = self.items.get(key)
+            if not evaluate_condition(old, ConditionExpression, ExpressionAttributeNames, values):
+                raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'UpdateItem')
+            new = copy.deepcopy(old) if old is not None else normalize(Key)
+            updated = apply_update(new, UpdateExpression, ExpressionAttributeNames, values)
+            self.items[key] = new
+            self.resource.record_change(self.name, old, new)
+            return {'Attributes': self.returned(old, new, updated, ReturnValues)} if ReturnValues != 'NONE' else {}
+
+    def query(self, KeyConditionExpression: str, ExpressionAttributeValues: dict | None = None,
+              ExpressionAttributeNames: dict | None = None, Limit: int | None = None,
+              ExclusiveStartKey: dict | None = None, ScanIndexForward: bool = True, **kwargs) -> dict:
+        # the key condition is evaluated like a condition expression against every item, items come
+        # back in range key order
+        self.resource.simulate_latency()
+        values = normalize(ExpressionAttributeValues)
+        start = self.key_of(ExclusiveStartKey, 'Query') if ExclusiveStartKey else None
+        with self.resource.lock:
+            keys = sorted((key for key, item in self.items.items()
+                           if evaluate_condition(item, KeyConditionExpression, ExpressionAttributeNames, values)),
+                          reverse=not ScanIndexForward)
+            if start is not None:
+                keys = [key for key in keys if (key > start if ScanIndexForward else key < start)]
+            page = keys[:Limit] if Limit else keys
+            response = {'Items': [copy.deepcopy(self.items[key]) for key in page], 'Count': len(page)}
+        if Limit and len(page) == Limit:
+            response['LastEvaluatedKey'] = {k: response['Items'][-1][k] for k in (self.hash_key, self.range_key) if k}
+        return response
+
+    def scan(self, Segment: int = 0, TotalSegments: int = 1, Limit: int | None = None,
+             ExclusiveStartKey: dict | None = None, **kwargs) -> dict:
+        # an item belongs to the segment its hash key hashes to, every segment is read in key order
+        self.resource.simulate_latency()
+        if not 0 <= Segment < TotalSegments:
+            raise validation_error('The Segment parameter is out of range for the TotalSegments')
+        limit = Limit or SCAN_PAGE_ITEMS
+        start = self.key_of(ExclusiveStartKey, 'Scan') if ExclusiveStartKey else None
+        with self.resource.lock:
+            keys = sorted(key for key in self.items
+                          if zlib.crc32(repr(key[0]).encode()) % TotalSegments == Segment
+                          and (start is None or key > start))
+            page = keys[:limit]
+            response = {'Items': [copy.deepcopy(self.items[key]) for key in page], 'Count': len(page)}
+        if len(keys) > limit or (Limit and len(page) == Limit):
+            response['LastEvaluatedKey'] = {k: response['Items'][-1][k] for k in (self.hash_key, self.range_key) if k}
+        return response
+
+    @staticmethod
+    def returned(old: dict | None, new: dict, updated: set[str], return_values: str) -> dict:
+        old = old or {}
+        if return_values == 'ALL_OLD':
+            return copy.deepcopy(old)
+        if return_values == 'ALL_NEW':
+            return copy.deepcopy(new)
+        source = new if return_values == 'UPDATED_NEW' else old
+        return {k: copy.deepcopy(source[k]) for k in updated if k in source}
+
+
+class LocalDynamoClient:
+    def __init__(self, resource: 'LocalDynamoResource'):
+        self.resource = resource
+
+    def scan(self, TableName: str, ExclusiveStartKey: dict | None = None, **kwargs) -> dict:
+        if ExclusiveStartKey:
+            ExclusiveStartKey = {k: deserializer.deserialize(v) for k, v in ExclusiveStartKey.items()}
+        response = self.resource.Table(TableName).scan(ExclusiveStartKey=ExclusiveStartKey, **kwargs)
+        response['Items'] = [{k: serializer.serialize(v) for k, v in item.items()} for item in response['Items']]
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = {k: serializer.serialize(v)
+                                            for k, v in response['LastEvaluatedKey'].items()}
+        return response
+
+    def transact_write_items(self, TransactItems: list[dict], **kwargs) -> dict:
+        self.resource.simulate_latency()
+        if len(TransactItems) > 100:
+            raise client_error('ValidationException', 'Member must have length less than or equal to 100',
+                               'TransactWriteItems')
+        operations = []
+        seen = set()
+        for entry in TransactItems:
+            (action, request), = entry.items()
+            request = deserialize(request)
+            table = self.resource.Table(request['TableName'])
+            if action == 'Put':
+                key_attributes = {k: request['Item'].get(k) for k in (table.hash_key, table.range_key) if k}
+            else:
+                key_attributes = request['Key']
+            key = (table.name, table.key_of(key_attributes, 'TransactWriteItems'))
+            if key in seen:
+                raise client_error('ValidationException', 'Transaction request cannot include multiple operations '
+                                                          'on one item', 'TransactWriteItems')
+            seen.add(key)
+            operations.append((action, request, table, key[1]))
+
+        with self.resource.lock:
+            reasons = []
+            staged = []
+            for action, request, table, key in operations:
+                old = table.items.get(key)
+                names = request.get('ExpressionAttributeNames')
+                values = request.get('ExpressionAttributeValues')
+                if not evaluate_condition(old, request.get('ConditionExpression'), names, values):
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+                    continue
+                try:
+                    if action == 'Put':
+                        staged.append((table, key, request['Item']))
+                    elif action == 'Delete':
+                        staged.append((table, key, None))
+                    elif action == 'Update':
+                        new = copy.deepcopy(old) if old is not None else copy.deepcopy(request['Key'])
+                        apply_update(new, request['UpdateExpression'], names, values)
+                        staged.append((table, key, new))
+                    reasons.append({'Code': 'None'})
+                except ClientError as e:
+                    reasons.append({'Code': 'ValidationError', 'Message': e.response['Error']['Message']})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                codes = ', '.join(reason['Code'] for reason in reasons)
+                raise client_error('TransactionCanceledException',
+                                   f'Transaction cancelled, please refer cancellation reasons for specific reasons '
+                                   f'[{codes}]', 'TransactWriteItems', CancellationReasons=reasons)
+            for table, key, item in staged:
+                self.resource.record_change(table.name, table.items.get(key), item)
+                if item is None:
+                    table.items.pop(key, None)
+                else:
+                    table.items[key] = item
+        return {}
+
+
+def deserialize(request: dict) -> dict:
+    request = dict(request)
+    for field in ('Item', 'Key', 'ExpressionAttributeValues'):
+        if field in request:
+            request[field] = {k: deserializer.deserialize(v) for k, v in request[field].items()}
+    return request
+
+
+class LocalDynamoResource:
+    def __init__(self, latency_ms: float | None = None):
+        if latency_ms is None:
+            latency_ms = float(os.environ.get('LOCAL_DYNAMO_LATENCY_MS', '0'))
+        self.latency = latency_ms / 1000
+        self.lock = threading.RLock()
+        self.tables: dict[str, dict] = {}
+        self.meta = SimpleNamespace(client=LocalDynamoClient(self))
+        # stream records of the tables with a stream, not yet replayed
+        self.streams: dict[str, list[dict]] = {}
+        self.sequence = 0
+
+    def simulate_latency(self):
+        # stands in for the network round trip, outside the lock so concurrent calls overlap
+        if self.latency:
+            time.sleep(self.latency)
+
+    def Table(self, name: str) -> LocalTable:
+        return LocalTable(self, name)
+
+    def enable_stream(self, table_name: str):
+        # the writes of the table are kept as DynamoDB Streams records with NEW_AND_OLD_IMAGES
+        with self.lock:
+            self.streams.setdefault(table_name, [])
+
+    def record_change(self, table_name: str, old: dict | None, new: dict | None):
+        # called under the lock by every write, a write that changes nothing has no record
+        if table_name not in self.streams or old == new:
+            return
+        table = self.Table(table_name)
+        self.sequence += 1
+        change = {
+            'Keys': {k: serializer.serialize((new or old)[k]) for k in (table.hash_key, table.range_key) if k},
+            'SequenceNumber': f'{self.sequence:021d}',
+            'StreamViewType': 'NEW_AND_OLD_IMAGES',
+        }
+        if new is not None:
+            change['NewImage'] = {k: serializer.serialize(v) for k, v in new.items()}
+        if old is not None:
+            change['OldImage'] = {k: serializer.serialize(v) for k, v in old.items()}
+        self.streams[table_name].append({
+            'eventID': f'{self.sequence:032x}',
+            'eventName': 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'local',
+            'dynamodb': change,
+            'eventSourceARN': f'arn:aws:dynamodb:local:000000000000:table/{table_name}/stream/local',
+        })
+
+    def stream_events(self, table_name: str, batch_size: int = 100) -> list[dict]:
+        # the pending records of a table as the Lambda events a stream event source mapping would send
+        with self.lock:
+            records = self.streams.get(table_name, [])
+            if records:
+                self.streams[table_name] = []
+        return [{'Records': records[start:start + batch_size]} for start in range(0, len(records), batch_size)]
+
+    def batch_get_item(self, RequestItems: dict) -> dict:
+        self.simulate_latency()
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise client_error('ValidationException', 'Too many items requested for the BatchGetItem call',
+                               'BatchGetItem')
+        responses = {}
+        with self.lock:
+            for table_name, request in RequestItems.items():
+                table = self.Table(table_name)
+                keys = [table.key_of(key, 'BatchGetItem') for key in request['Keys']]
+                if len(set(keys)) != len(keys):
+                    raise client_error('ValidationException', 'Provided list of item keys contains duplicates',
+                                       'BatchGetItem')
+                responses[table_name] = [copy.deepcopy(table.items[key]) for key in keys if key in table.items]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
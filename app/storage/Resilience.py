@@ -0,0 +1,229 @@
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+from app.storage.Dynamo import DynamoError, TransactionCancelledError
+
+logger = logging.getLogger(__name__)
+
+# Failed DynamoDB calls are retried here rather than inside botocore, with full jitter backoff and
+# within the deadline of the request. A per table circuit breaker fails calls fast while a table
+# keeps throttling or erroring, and a process wide retry budget stops retries from multiplying the
+# load on a struggling table.
+DYNAMO_REQUEST_DEADLINE_SECONDS = float(os.environ.get('DYNAMO_REQUEST_DEADLINE_MS', '5000')) / 1000
+DYNAMO_RETRY_MAX_ATTEMPTS = int(os.environ.get('DYNAMO_RETRY_MAX_ATTEMPTS', '5'))
+DYNAMO_RETRY_BASE_SECONDS = float(os.environ.get('DYNAMO_RETRY_BASE_MS', '25')) / 1000
+DYNAMO_RETRY_CAP_SECONDS = float(os.environ.get('DYNAMO_RETRY_CAP_MS', '1000')) / 1000
+DYNAMO_RETRY_BUDGET = int(os.environ.get('DYNAMO_RETRY_BUDGET', '500'))
+DYNAMO_BREAKER_FAILURES = int(os.environ.get('DYNAMO_BREAKER_FAILURES', '5'))
+DYNAMO_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('DYNAMO_BREAKER_COOLDOWN_SECONDS', '5'))
+
+# error classes
+THROTTLED = 'throttled'  # rejected by the table, nothing was applied
+CONFLICT = 'conflict'  # a transaction lost to a concurrent one, nothing was applied
+UNREACHABLE = 'unreachable'  # the request never reached DynamoDB
+UNKNOWN_OUTCOME = 'unknown_outcome'  # server error or read timeout, the write may have been applied
+FATAL = 'fatal'  # validation, condition or any other error a retry will not fix
+
+THROTTLING_CODES = frozenset({'ProvisionedThroughputExceededException', 'ThrottlingException',
+                              'RequestLimitExceeded'})
+SERVER_ERROR_CODES = frozenset({'InternalServerError', 'ServiceUnavailable'})
+# cancellation reason codes of TransactWriteItems
+THROTTLING_REASONS = frozenset({'ThrottlingError', 'ProvisionedThroughputExceeded', 'RequestLimitExceeded'})
+
+ALWAYS_RETRIED = frozenset({THROTTLED, CONFLICT, UNREACHABLE})
+# contention is not a sign of an unhealthy table, it does not count towards opening the breaker
+BREAKER_FAILURES = frozenset({THROTTLED, UNREACHABLE, UNKNOWN_OUTCOME})
+
+request_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar('request_deadline', default=None)
+
+
+class StorageUnavailableError(Exception):
+    def __init__(self, table_name: str, retry_after: int = 1):
+        super().__init__(f'storage unavailable for {table_name}, retry later')
+        self.table_name = table_name
+        self.retry_after = retry_after
+
+
+def classify(error: BaseException) -> str:
+    if isinstance(error, TransactionCancelledError):
+        codes = set(error.reasons) - {'None'}
+        if codes and codes <= THROTTLING_REASONS | {'TransactionConflict'}:
+            return THROTTLED if codes & THROTTLING_REASONS else CONFLICT
+        return FATAL
+    if isinstance(error, DynamoError):
+        if error.code in THROTTLING_CODES:
+            return THROTTLED
+        if error.code == 'TransactionConflictException':
+            return CONFLICT
+        if error.code in SERVER_ERROR_CODES:
+            return UNKNOWN_OUTCOME
+        return FATAL
+    if isinstance(error, (ConnectTimeoutError, EndpointConnectionError)):
+        return UNREACHABLE
+    if isinstance(error, ReadTimeoutError):
+        return UNKNOWN_OUTCOME
+    return FATAL
+
+
+def start_deadline(seconds: float = DYNAMO_REQUEST_DEADLINE_SECONDS) -> contextvars.Token:
+    return request_deadline.set(time.monotonic() + seconds)
+
+
+class RetryBudget:
+    # a retry spends retry_cost tokens and a successful call gives one back. Under sustained
+    # failures the budget runs dry and calls fail after their first attempt (botocore's retry quota)
+    def __init__(self, capacity: int, retry_cost: int = 5):
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.tokens = capacity
+        self.lock = threading.Lock()
+        self.denied = 0
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < self.retry_cost:
+                self.denied += 1
+                return False
+            self.tokens -= self.retry_cost
+            return True
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class CircuitBreaker:
+    # closed: calls go through. open: calls fail fast until the cooldown is over. half_open: a single
+    # probe call goes through, its outcome closes or reopens the breaker.
+    def __init__(self, name: str, failure_threshold: int, cooldown_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        # returns True when the call is the probe of a half open breaker
+        with self.lock:
+            if self.state == 'open':
+                remaining = self.opened_at + self.cooldown_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise StorageUnavailableError(self.name, retry_after=math.ceil(remaining))
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self.probing:
+                    self.rejected += 1
+                    raise StorageUnavailableError(self.name, retry_after=math.ceil(self.cooldown_seconds))
+                self.probing = True
+                return True
+            return False
+
+    def release(self, failed: bool | None, probe: bool):
+        # failed is None when the call was abandoned, cancelled before it had an outcome
+        with self.lock:
+            if probe:
+                self.probing = False
+            if failed is None:
+                return
+            if not failed:
+                self.failures = 0
+                self.state = 'closed'
+                return
+            self.failures += 1
+            if probe or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                logger.warning('opening the circuit breaker of %s after %s failures', self.name, self.failures)
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+    def stats(self) -> dict:
+        return {'state': self.state, 'failures': self.failures, 'opened': self.opened, 'rejected': self.rejected}
+
+
+breakers: dict[str, CircuitBreaker] = {}
+breakers_lock = threading.Lock()
+retry_budget = RetryBudget(DYNAMO_RETRY_BUDGET)
+retries = 0
+gave_up = 0
+
+
+def get_breaker(table_name: str) -> CircuitBreaker:
+    breaker = breakers.get(table_name)
+    if breaker is None:
+        with breakers_lock:
+            breaker = breakers.setdefault(
+                table_name, CircuitBreaker(table_name, DYNAMO_BREAKER_FAILURES, DYNAMO_BREAKER_COOLDOWN_SECONDS))
+    return breaker
+
+
+def acquire_breakers(table_names: list[str]) -> list[tuple[CircuitBreaker, bool]]:
+    acquired = []
+    try:
+        for table_name in sorted(set(table_names)):
+            breaker = get_breaker(table_name)
+            acquired.append((breaker, breaker.acquire()))
+    except StorageUnavailableError:
+        for breaker, probe in acquired:
+            breaker.release(None, probe)
+        raise
+    return acquired
+
+
+async def call_with_retry(table_names: list[str], idempotent: bool, call):
+    # call is a coroutine function doing one attempt. Throttled, conflicting and unsent calls are
+    # retried, calls with an unknown outcome only when they are idempotent.
+    global retries, gave_up
+    deadline = request_deadline.get() or time.monotonic() + DYNAMO_REQUEST_DEADLINE_SECONDS
+    attempt = 0
+    while True:
+        acquired = acquire_breakers(table_names)
+        outcome = None
+        succeeded = False
+        try:
+            result = await call()
+            outcome = False
+            succeeded = True
+        except Exception as e:
+            kind = classify(e)
+            outcome = kind in BREAKER_FAILURES
+            if kind not in ALWAYS_RETRIED and not (kind == UNKNOWN_OUTCOME and idempotent):
+                raise
+            attempt += 1
+            delay = random.uniform(0, min(DYNAMO_RETRY_CAP_SECONDS, DYNAMO_RETRY_BASE_SECONDS * 2 ** attempt))
+            if (attempt >= DYNAMO_RETRY_MAX_ATTEMPTS or time.monotonic() + delay >= deadline
+                    or not retry_budget.withdraw()):
+                gave_up += 1
+                logger.warning('giving up on %s after %s attempts: %s', table_names, attempt, e)
+                raise StorageUnavailableError(', '.join(sorted(set(table_names)))) from e
+        finally:
+            for breaker, probe in acquired:
+                breaker.release(outcome, probe)
+        if succeeded:
+            retry_budget.deposit()
+            return result
+        retries += 1
+        await asyncio.sleep(delay)
+
+
+def resilience_stats() -> dict:
+    return {
+        'retries': retries,
+        'gave_up': gave_up,
+        'retry_budget': {'tokens': retry_budget.tokens, 'capacity': retry_budget.capacity,
+                         'denied': retry_budget.denied},
+        'breakers': {name: breaker.stats() for name, breaker in sorted(breakers.items())},
+    }
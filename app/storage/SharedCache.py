@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Optional cache tier shared by every container, in front of get_item for the ledger and portfolio
+# tables. SHARED_CACHE_URL=redis://host:6379 uses any Redis protocol server (needs the redis
+# package), local uses the in-process LocalRedis stand-in and unset turns the tier off.
+#
+# Entries are "version|item" where version is the version attribute of the item, bumped by every
+# update. An entry is only replaced by a higher version, so a slow reader can not put back an item
+# older than one already written through. Writes that do not return the new item leave a tombstone
+# "floor|" for SHARED_CACHE_TOMBSTONE_SECONDS: only versions above floor may be cached, floor being
+# the version of the entry it replaces (or one more than the tombstone it replaces), and when there
+# was nothing cached, TOMBSTONE_VERSION which blocks refills until the tombstone expires.
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL', '')
+SHARED_CACHE_TABLES = frozenset(filter(None, os.environ.get(
+    'SHARED_CACHE_TABLES', 'ledger,ledgerTest,portfolio,portfolioTest').split(',')))
+SHARED_CACHE_TTL_SECONDS = int(os.environ.get('SHARED_CACHE_TTL_SECONDS', '300'))
+SHARED_CACHE_TOMBSTONE_SECONDS = int(os.environ.get('SHARED_CACHE_TOMBSTONE_SECONDS', '10'))
+SHARED_CACHE_TIMEOUT_SECONDS = float(os.environ.get('SHARED_CACHE_TIMEOUT_MS', '50')) / 1000
+SHARED_CACHE_PREFIX = os.environ.get('SHARED_CACHE_PREFIX', 'gojenga:')
+
+# above any version an item reaches, and exact in the doubles Lua uses for numbers
+TOMBSTONE_VERSION = 2 ** 53
+
+SET_IF_NEWER = """
+local current = redis.call('GET', KEYS[1])
+if current then
+  local version = tonumber(string.match(current, '^(%d+)|'))
+  if version and version >= tonumber(ARGV[1]) then
+    return 0
+  end
+end
+redis.call('SET', KEYS[1], ARGV[1] .. '|' .. ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+INVALIDATE = """
+local floor = ARGV[1]
+local current = redis.call('GET', KEYS[1])
+if current then
+  local version, payload = string.match(current, '^(%d+)|(.*)$')
+  version = tonumber(version)
+  if version and payload ~= '' then
+    floor = tostring(version)
+  elseif version and version < tonumber(ARGV[1]) then
+    floor = tostring(version + 1)
+  end
+end
+redis.call('SET', KEYS[1], floor .. '|', 'EX', ARGV[2])
+return 1
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str, timeout: float):
+        import redis.asyncio as redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout,
+                                           decode_responses=True)
+        self.set_if_newer_script = self.client.register_script(SET_IF_NEWER)
+        self.invalidate_script = self.client.register_script(INVALIDATE)
+
+    async def get(self, key: str) -> str | None:
+        return await self.client.get(key)
+
+    async def invalidate(self, key: str, ttl: int):
+        await self.invalidate_script(keys=[key], args=[TOMBSTONE_VERSION, ttl])
+
+    async def set_if_newer(self, key: str, version: int, payload: str, ttl: int) -> bool:
+        return bool(await self.set_if_newer_script(keys=[key], args=[version, payload, ttl]))
+
+
+class LocalRedis:
+    # in-process stand-in with the semantics of the Redis commands and script above, for tests
+    def __init__(self):
+        self.entries: dict[str, tuple[float, str]] = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, key: str) -> str | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> str | None:
+        with self.lock:
+            return self.lookup(key)
+
+    async def invalidate(self, key: str, ttl: int):
+        with self.lock:
+            floor = TOMBSTONE_VERSION
+            current = self.lookup(key)
+            if current is not None:
+                version, payload = current.split('|', 1)
+                if payload:
+                    floor = int(version)
+                elif int(version) < TOMBSTONE_VERSION:
+                    floor = int(version) + 1
+            self.entries[key] = (time.monotonic() + ttl, f'{floor}|')
+
+    async def set_if_newer(self, key: str, version: int, payload: str, ttl: int) -> bool:
+        with self.lock:
+            current = self.lookup(key)
+            if current is not None and int(current.split('|', 1)[0]) >= version:
+                return False
+            self.entries[key] = (time.monotonic() + ttl, f'{version}|{payload}')
+            return True
+
+
+def encode(item: dict) -> str:
+    from app.storage.Dynamo import serialize
+    return json.dumps({name: serialize(value) for name, value in item.items()}, separators=(',', ':'))
+
+
+def decode(payload: str) -> dict:
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {name: deserializer.deserialize(value) for name, value in json.loads(payload).items()}
+
+
+class SharedCache:
+    def __init__(self, backend, tables: frozenset[str]):
+        self.backend = backend
+        self.tables = tables
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.stale_rejected = 0
+        self.writes = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def covers(self, table_name: str, key: dict) -> bool:
+        return self.backend is not None and table_name in self.tables and set(key) == {'name'}
+
+    @staticmethod
+    def cache_key(table_name: str, key: dict) -> str:
+        return f'{SHARED_CACHE_PREFIX}{table_name}:{key["name"]}'
+
+    async def get(self, table_name: str, key: dict) -> dict | None:
+        # a cache error is a miss, the request falls back to DynamoDB
+        try:
+            value = await self.backend.get(self.cache_key(table_name, key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning('shared cache get failed: %s', e)
+            return None
+        payload = value.split('|', 1)[1] if value else ''
+        if not payload:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode(payload)
+
+    async def put(self, table_name: str, item: dict, write: bool = False):
+        # write is True for the item returned by an update (write through), False for a read miss fill
+        try:
+            stored = await self.backend.set_if_newer(self.cache_key(table_name, item), int(item.get('version', 0)),
+                                                     encode(item), SHARED_CACHE_TTL_SECONDS)
+        except Exception as e:
+            self.errors += 1
+            logger.warning('shared cache put failed: %s', e)
+            return
+        if not stored:
+            self.stale_rejected += 1
+        elif write:
+            self.writes += 1
+        else:
+            self.fills += 1
+
+    async def invalidate(self, table_name: str, key: dict):
+        try:
+            await self.backend.invalidate(self.cache_key(table_name, key), SHARED_CACHE_TOMBSTONE_SECONDS)
+            self.invalidations += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning('shared cache invalidation failed, %s may be stale for %ss: %s',
+                           key, SHARED_CACHE_TTL_SECONDS, e)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.backend is not None,
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+            'tables': sorted(self.tables),
+            'ttl_seconds': SHARED_CACHE_TTL_SECONDS,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'fills': self.fills,
+            'writes': self.writes,
+            'stale_rejected': self.stale_rejected,
+            'invalidations': self.invalidations,
+            'errors': self.errors,
+        }
+
+
+def create_backend():
+    if not SHARED_CACHE_URL:
+        return None
+    if SHARED_CACHE_URL == 'local':
+        return LocalRedis()
+    return RedisBackend(SHARED_CACHE_URL, SHARED_CACHE_TIMEOUT_SECONDS)
+
+
+shared_cache = SharedCache(create_backend(), SHARED_CACHE_TABLES)
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from app.storage import Aggregates, Export
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import ConditionalCheckFailedError
+
+logger = logging.getLogger(__name__)
+
+# Portfolio value history, packed into one block item per user per UTC day of the history table keyed
+# by (name, block), block being the epoch second the day starts. A block holds the timestamps and
+# values of up to HISTORY_BLOCK_SAMPLES samples as two arrays of 64 bit integers, each delta encoded
+# (every element is the difference to the one before) and compressed together: samples taken at a
+# steady interval of slowly moving values turn into runs of small repeated numbers. Values are stored
+# in millionths.
+#
+# A sample is appended by reading the block of its day strongly consistent and writing it back
+# conditioned on the number of samples it had, samples of a user closer than HISTORY_SAMPLE_SECONDS
+# are skipped. A range is read with one Query of the blocks of its days, the samples are decoded and
+# downsampled to the last value of every bucket of the resolution.
+HISTORY_BLOCK_SECONDS = 24 * 3600
+HISTORY_BLOCK_SAMPLES = int(os.environ.get('HISTORY_BLOCK_SAMPLES', '1440'))
+HISTORY_SAMPLE_SECONDS = int(os.environ.get('HISTORY_SAMPLE_SECONDS', '300'))
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', '1000'))
+HISTORY_WRITE_ATTEMPTS = 5
+HISTORY_WRITE_CONCURRENCY = 16
+HISTORY_PAGE_SIZE = 100
+
+HISTORY_TABLES = {'portfolio': 'portfolioHistory', 'portfolioTest': 'portfolioHistoryTest'}
+
+VALUE_UNITS = 10 ** 6
+RANGES = {'1d': 24 * 3600, '1w': 7 * 24 * 3600, '1m': 30 * 24 * 3600, '1y': 365 * 24 * 3600}
+DEFAULT_RESOLUTIONS = {'1d': 300, '1w': 3600, '1m': 4 * 3600, '1y': 24 * 3600}
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 24 * 3600}
+
+
+def block_of(at: int) -> int:
+    return at - at % HISTORY_BLOCK_SECONDS
+
+
+def deltas(values: array) -> array:
+    return array('q', [values[0], *(b - a for a, b in zip(values, values[1:]))]) if values else array('q')
+
+
+def encode(timestamps: array, values: array) -> bytes:
+    data = deltas(timestamps) + deltas(values)
+    # blocks are little endian whatever the machine that wrote them
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return zlib.compress(data.tobytes())
+
+
+def decode(data: bytes, samples: int) -> tuple[array, array]:
+    encoded = array('q')
+    encoded.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        encoded.byteswap()
+    return array('q', accumulate(encoded[:samples])), array('q', accumulate(encoded[samples:]))
+
+
+def decode_block(block: dict) -> tuple[array, array]:
+    return decode(bytes(block['data']), int(block['samples']))
+
+
+def parse_duration(duration: str) -> int:
+    # 300, 30s, 5m, 1h, 1d
+    try:
+        if duration[-1:] in UNITS:
+            seconds = int(duration[:-1]) * UNITS[duration[-1]]
+        else:
+            seconds = int(duration)
+    except ValueError:
+        raise ValueError(f'invalid duration {duration}')
+    if seconds <= 0:
+        raise ValueError(f'invalid duration {duration}')
+    return seconds
+
+
+def resolve(range_name: str, resolution: str | None) -> tuple[int, int]:
+    # the range and resolution of a history request in seconds, ValueError when they can not be served
+    if range_name not in RANGES:
+        raise ValueError(f'range must be one of {", ".join(RANGES)}')
+    span = RANGES[range_name]
+    step = parse_duration(resolution) if resolution else DEFAULT_RESOLUTIONS[range_name]
+    if span // step > HISTORY_MAX_POINTS:
+        raise ValueError(f'a {range_name} range has at most {HISTORY_MAX_POINTS} points, '
+                         f'the resolution must be at least {-(-span // HISTORY_MAX_POINTS)}s')
+    return span, step
+
+
+def downsample(timestamps: array, values: array, start: int, end: int, step: int) -> list[list]:
+    # the last sample of every bucket of step seconds between start and end, buckets without samples
+    # are left out. Buckets are aligned on multiples of step so points do not move between requests
+    points = []
+    bucket = start - start % step
+    low = bisect_left(timestamps, start)
+    while bucket < end and low < len(timestamps):
+        high = bisect_left(timestamps, min(bucket + step, end), low)
+        if high > low:
+            points.append([bucket, values[high - 1] / VALUE_UNITS])
+            low = high
+        bucket += step
+    return points
+
+
+async def read_blocks(history_table: str, name: str, start: int, end: int) -> list[dict]:
+    blocks: list[dict] = []
+    start_key = None
+    while True:
+        items, start_key = await AsyncDynamo.query(history_table, '#n = :n AND #b BETWEEN :low AND :high',
+                                                   {':n': name, ':low': block_of(start), ':high': block_of(end)},
+                                                   {'#n': 'name', '#b': 'block'}, limit=HISTORY_PAGE_SIZE,
+                                                   exclusive_start_key=start_key)
+        blocks.extend(items)
+        if start_key is None:
+            return blocks
+
+
+async def history(history_table: str, name: str, start: int, end: int, step: int) -> dict:
+    timestamps, values = array('q'), array('q')
+    blocks = await read_blocks(history_table, name, start, end)
+    for block in blocks:
+        block_timestamps, block_values = decode_block(block)
+        timestamps.extend(block_timestamps)
+        values.extend(block_values)
+    return {'from': start, 'to': end, 'resolution': step, 'blocks': len(blocks), 'samples': len(timestamps),
+            'points': downsample(timestamps, values, start, end, step)}
+
+
+def appended(block: dict | None, at: int, value: float) -> dict | None:
+    # the block with the sample appended, None when the sample is skipped
+    if block is None:
+        timestamps, values = array('q'), array('q')
+    else:
+        if at < int(block['last_at']) + HISTORY_SAMPLE_SECONDS:
+            return None
+        if int(block['samples']) >= HISTORY_BLOCK_SAMPLES:
+            logger.warning('history block %s of %s is full, sample dropped', block['block'], block['name'])
+            return None
+        timestamps, values = decode_block(block)
+    timestamps.append(at)
+    values.append(round(value * VALUE_UNITS))
+    return {'samples': len(timestamps), 'last_at': at, 'data': encode(timestamps, values)}
+
+
+async def save_block(history_table: str, name: str, at: int, block: dict | None, value: float) -> bool | None:
+    # True when the sample was written, False when it was skipped, None when the block changed meanwhile
+    new = appended(block, at, value)
+    if new is None:
+        return False
+    item = {'name': name, 'block': block_of(at), **new}
+    try:
+        if block is None:
+            await AsyncDynamo.create_item(history_table, item, 'attribute_not_exists(#n)', None, {'#n': 'name'})
+        else:
+            await AsyncDynamo.create_item(history_table, item, '#s = :samples', {':samples': block['samples']},
+                                          {'#s': 'samples'})
+        return True
+    except ConditionalCheckFailedError:
+        return None
+
+
+async def read_block(history_table: str, name: str, at: int) -> dict | None:
+    key = {'name': name, 'block': block_of(at)}
+    return next(iter((await AsyncDynamo.batch_get({history_table: [key]}, True))[history_table]), None)
+
+
+async def append(history_table: str, name: str, at: int, value: float) -> bool:
+    # appends a sample taken at the epoch second at, returns False when it was skipped
+    for _ in range(HISTORY_WRITE_ATTEMPTS):
+        saved = await save_block(history_table, name, at, await read_block(history_table, name, at), value)
+        if saved is not None:
+            return saved
+    raise ValueError(f'history of {name} kept changing, sample not written after {HISTORY_WRITE_ATTEMPTS} attempts')
+
+
+async def append_values(history_table: str, values: dict[str, float], at: int) -> int:
+    # one sample per user taken at the same time, the blocks are read with batch gets. Returns the
+    # number of samples written
+    keys = [{'name': name, 'block': block_of(at)} for name in values]
+    blocks = {block['name']: block
+              for block in (await AsyncDynamo.batch_get({history_table: keys}, True))[history_table]}
+    limit = asyncio.Semaphore(HISTORY_WRITE_CONCURRENCY)
+
+    async def write(name: str, value: float) -> bool:
+        async with limit:
+            saved = await save_block(history_table, name, at, blocks.get(name), value)
+            if saved is None:
+                saved = await append(history_table, name, at, value)
+            return saved
+
+    return sum(await asyncio.gather(*(write(name, value) for name, value in values.items())))
+
+
+async def sample_portfolios(table_name: str, at: int) -> dict:
+    # values every portfolio of the table at the current prices and appends a sample to its history
+    from app.common import Valuation
+
+    history_table = HISTORY_TABLES[table_name]
+    table = await Valuation.price_table()
+    portfolios = written = 0
+    async for page in Export.scan_pages(table_name, typed=False):
+        values = Valuation.Holdings([Aggregates.coins(item) for item in page]).value(table)[0].tolist()
+        written += await append_values(history_table, {item['name']: value for item, value in zip(page, values)}, at)
+        portfolios += len(page)
+    return {'table': table_name, 'portfolios': portfolios, 'samples': written}
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app import stream
+from app.handlers.account_handler import AccountHandler
+from app.handlers.aggregates_handler import AggregatesHandler
+from app.handlers.portfolio_handler import PortfolioHandler
+from app.models.Portfolio import Portfolio
+from app.storage import Aggregates
+from app.storage import Dynamo as dynamo_module
+from app.storage.AsyncDynamo import read_coalescer
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+class TestStreamAggregates(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        for table_name in ('ledgerTest', 'portfolioTest'):
+            self.resource.enable_stream(table_name)
+        for patch in (mock.patch.object(dynamo_module, 'dyn_resource', self.resource),
+                      mock.patch.object(Aggregates, 'initialized', set())):
+            patch.start()
+            self.addCleanup(patch.stop)
+        read_coalescer.clear()
+        self.addCleanup(read_coalescer.clear)
+
+    def replay(self, batch_size: int = 7) -> list[dict]:
+        events = [event for table_name in ('ledgerTest', 'portfolioTest')
+                  for event in self.resource.stream_events(table_name, batch_size)]
+        for event in events:
+            stream.handler(event, None)
+        return events
+
+    def scanned_totals(self) -> dict:
+        # what the aggregates stand for, from every item of the tables
+        ledger = self.resource.Table('ledgerTest').items.values()
+        holdings: dict = {}
+        for item in self.resource.Table('portfolioTest').items.values():
+            for coin in Aggregates.coins(item):
+                holdings[coin['id']] = holdings.get(coin['id'], Decimal(0)) + Decimal(str(coin['amount']))
+        return {
+            'ledger_balance': sum((item['balance'] for item in ledger), Decimal(0)),
+            'accounts': len([item for item in ledger if '#' not in item['name']]),
+            'portfolios': len(self.resource.Table('portfolioTest').items),
+            'holdings': {coin_id: amount for coin_id, amount in sorted(holdings.items()) if amount},
+        }
+
+    def aggregates(self) -> dict:
+        # without the valuation of the holdings, which depends on the prices
+        totals = asyncio.run(AggregatesHandler.handle_get_aggregates(True))
+        return {key: totals[key] for key in ('ledger_balance', 'accounts', 'portfolios', 'holdings')}
+
+    def test_changes_are_applied_as_deltas(self):
+        async def activity():
+            for name, balance in (('alice', 100), ('bob', 50), ('carol', 0)):
+                await AccountHandler.handle_create_account(name, Decimal(balance), True)
+            await AccountHandler.handle_shard_account('alice', 4, True)
+            await AccountHandler.handle_transaction('alice', 'bob', Decimal(30), True)
+            await AccountHandler.handle_modify_account('carol', Decimal(25), True)
+            await AccountHandler.handle_batch_transactions(
+                [{'sender': 'bob', 'receiver': 'carol', 'amount': Decimal(10)},
+                 {'sender': 'carol', 'receiver': 'alice', 'amount': Decimal(5)}], True)
+            await AccountHandler.handle_update_account('bob', Decimal(7), True)
+            await AccountHandler.handle_shard_account('alice', 1, True)
+            await AccountHandler.handle_delete_account('carol', True)
+            await PortfolioHandler.handle_create_portfolio('alice', Portfolio(
+                username='alice', portfolio=[{'id': 'btc', 'name': 'Bitcoin', 'amount': '1.5'},
+                                             {'id': 'eth', 'name': 'Ether', 'amount': '10'}]), True)
+            await PortfolioHandler.handle_create_portfolio('bob', Portfolio(
+                username='bob', portfolio=[{'id': 'btc', 'name': 'Bitcoin', 'amount': '0.5'}]), True)
+            await PortfolioHandler.handle_update_portfolio('alice', Portfolio(
+                username='alice', portfolio=[{'id': 'btc', 'name': 'Bitcoin', 'amount': '2'}]), True, 'buy')
+            await PortfolioHandler.handle_update_portfolio('alice', Portfolio(
+                username='alice', portfolio=[{'id': 'eth', 'name': 'Ether', 'amount': '10'}]), True, 'sell')
+
+        asyncio.run(activity())
+        self.replay()
+
+        self.assertEqual(self.aggregates(), self.scanned_totals())
+        self.assertEqual(self.aggregates()['holdings'], {'btc': Decimal('2.5')})
+
+    def test_redelivered_batches_are_applied_once(self):
+        for i in range(10):
+            self.resource.Table('ledgerTest').put_item(Item={'name': f'user{i}', 'balance': Decimal(i)})
+        events = self.replay(batch_size=4)
+        for i in range(10, 12):
+            self.resource.Table('ledgerTest').put_item(Item={'name': f'user{i}', 'balance': Decimal(i)})
+        late = self.resource.stream_events('ledgerTest')[0]['Records']
+
+        # the last batch sent again with the records that arrived since
+        result = stream.handler({'Records': events[-1]['Records'] + late}, None)
+        stream.handler(events[0], None)
+
+        self.assertEqual(result['applied'], 2)
+        self.assertEqual(self.aggregates(), self.scanned_totals())
+        self.assertEqual(self.aggregates()['ledger_balance'], sum(range(12)))
+
+    def test_records_sent_again_in_other_batches_are_applied_once(self):
+        for i in range(10):
+            self.resource.Table('ledgerTest').put_item(Item={'name': f'user{i}', 'balance': Decimal(i)})
+        records = [record for event in self.resource.stream_events('ledgerTest', 4) for record in event['Records']]
+        stream.handler({'Records': records[:4]}, None)
+        stream.handler({'Records': records[4:6]}, None)
+
+        # after a failure the batches are bisected and sent again, overlapping the ones applied
+        results = [stream.handler({'Records': records[start:end]}, None) for start, end in ((2, 5), (5, 8), (0, 10))]
+
+        self.assertEqual([result['applied'] for result in results], [0, 2, 2])
+        self.assertEqual(self.aggregates(), self.scanned_totals())
+
+        # a transaction holds at most 99 records
+        with mock.patch.object(Aggregates, 'TRANSACT_MAX_ITEMS', 3):
+            for i in range(10, 15):
+                self.resource.Table('ledgerTest').put_item(Item={'name': f'user{i}', 'balance': Decimal(i)})
+            late = self.resource.stream_events('ledgerTest')[0]['Records']
+            self.assertEqual(stream.handler({'Records': records[8:] + late}, None)['applied'], 5)
+        self.assertEqual(self.aggregates()['ledger_balance'], sum(range(15)))
+
+
+if __name__ == '__main__':
+    unittest.main()
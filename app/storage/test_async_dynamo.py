@@ -0,0 +1,144 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.storage import AsyncDynamo as async_dynamo_module
+from app.storage import Dynamo as dynamo_module
+from app.storage import Resilience
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import Dynamo
+from app.storage.LocalDynamo import LocalDynamoResource
+from app.storage.Resilience import StorageUnavailableError
+
+
+class TestReadCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=20)
+        self.resource.Table('ledgerTest').put_item(Item={'name': 'alice', 'balance': 10})
+        patch = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patch.start()
+        self.addCleanup(patch.stop)
+        async_dynamo_module.read_coalescer.clear()
+        self.addCleanup(async_dynamo_module.read_coalescer.clear)
+
+    def test_concurrent_reads_share_one_call(self):
+        async def read_all():
+            return await asyncio.gather(*(AsyncDynamo.get_item('ledgerTest', {'name': 'alice'}) for _ in range(50)))
+
+        with mock.patch.object(Dynamo, 'get_item', wraps=Dynamo.get_item) as get_item:
+            items = asyncio.run(read_all())
+        self.assertEqual(get_item.call_count, 1)
+        self.assertTrue(all(item == {'name': 'alice', 'balance': 10} for item in items))
+
+    def test_every_caller_owns_its_item(self):
+        # each caller modifies its item as soon as it gets it, the caller whose call loaded the item first
+        async def read_and_modify():
+            item = await AsyncDynamo.get_item('ledgerTest', {'name': 'alice'})
+            balance = item['balance']
+            item['balance'] = 0
+            return balance
+
+        async def read_all():
+            return await asyncio.gather(*(read_and_modify() for _ in range(50)))
+
+        self.assertEqual(asyncio.run(read_all()), [10] * 50)
+
+    def test_window_keeps_the_item_until_a_write(self):
+        async def scenario():
+            first = await AsyncDynamo.get_item('ledgerTest', {'name': 'alice'})
+            second = await AsyncDynamo.get_item('ledgerTest', {'name': 'alice'})
+            await AsyncDynamo.update_item('ledgerTest', {'name': 'alice'}, 'SET balance = :b', {':b': 20})
+            third = await AsyncDynamo.get_item('ledgerTest', {'name': 'alice'})
+            return first, second, third
+
+        with mock.patch.object(async_dynamo_module, 'DYNAMO_COALESCE_WINDOW_SECONDS', 60), \
+                mock.patch.object(async_dynamo_module.read_coalescer, 'ttl_seconds', 60), \
+                mock.patch.object(Dynamo, 'get_item', wraps=Dynamo.get_item) as get_item:
+            first, second, third = asyncio.run(scenario())
+        self.assertEqual(get_item.call_count, 2)
+        self.assertEqual((first['balance'], second['balance'], third['balance']), (10, 10, 20))
+        self.assertIsNot(first, second)
+
+
+class TestBatchGet(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        for i in range(230):
+            self.resource.Table('ledgerTest').put_item(Item={'name': f'user{i}', 'balance': i})
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'user0', 'portfolio': {}})
+        patch = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.requests: list[dict] = []
+        Resilience.breakers.clear()
+        self.addCleanup(Resilience.breakers.clear)
+        patches = [mock.patch.object(Resilience, 'DYNAMO_RETRY_BASE_SECONDS', 0.001),
+                   mock.patch.object(Resilience, 'DYNAMO_RETRY_CAP_SECONDS', 0.002),
+                   mock.patch.object(Resilience, 'retry_budget', Resilience.RetryBudget(500)),
+                   mock.patch.object(Resilience, 'retries', 0)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def throttling(self, processed: int | None):
+        # the stand-in processes the first processed keys of a request and returns the others as
+        # UnprocessedKeys, like DynamoDB past the throughput of a table, and every other request in
+        # full so each chunk takes two. None processes no key ever
+        batch_get_item = self.resource.batch_get_item
+
+        def partial(RequestItems: dict) -> dict:
+            self.requests.append(RequestItems)
+            keys = [(table_name, key) for table_name, request in RequestItems.items() for key in request['Keys']]
+            done, left = keys[:processed or 0], keys[processed or 0:]
+            if processed is not None and len(self.requests) % 2 == 0:
+                done, left = keys, []
+            response = batch_get_item({table_name: {**RequestItems[table_name], 'Keys': [key for t, key in done
+                                                                                          if t == table_name]}
+                                       for table_name in {t for t, _ in done}}) if done else {'Responses': {}}
+            unprocessed: dict = {}
+            for table_name, key in left:
+                unprocessed.setdefault(table_name, {**RequestItems[table_name], 'Keys': []})['Keys'].append(key)
+            return {**response, 'UnprocessedKeys': unprocessed}
+
+        return mock.patch.object(self.resource, 'batch_get_item', partial)
+
+    def test_keys_are_chunked_deduplicated_and_retried(self):
+        # 250 keys, 20 of them duplicates, over two tables
+        keys = [{'name': f'user{i % 230}'} for i in range(249)]
+        with self.throttling(processed=30):
+            items = asyncio.run(AsyncDynamo.batch_get(
+                {'ledgerTest': keys, 'portfolioTest': [{'name': 'user0'}, {'name': 'user0'}]}, True))
+
+        self.assertEqual(sorted(item['balance'] for item in items['ledgerTest']), list(range(230)))
+        self.assertEqual(items['portfolioTest'], [{'name': 'user0', 'portfolio': {}}])
+        for request in self.requests:
+            self.assertLessEqual(sum(len(table['Keys']) for table in request.values()), 100)
+            self.assertTrue(all(table['ConsistentRead'] for table in request.values()))
+        # 3 chunks of 100, 100 and 31 keys, each sent again once for the keys left unprocessed, after a
+        # backoff of the resilience layer
+        self.assertEqual([sum(len(table['Keys']) for table in request.values()) for request in self.requests],
+                         [100, 70, 100, 70, 31, 1])
+        self.assertEqual(Resilience.retries, 3)
+
+    def test_keys_left_unprocessed_give_up_within_the_attempts_and_the_deadline(self):
+        with self.throttling(processed=None), self.assertRaises(StorageUnavailableError):
+            asyncio.run(AsyncDynamo.batch_get({'ledgerTest': [{'name': 'user1'}]}))
+        self.assertEqual(len(self.requests), Resilience.DYNAMO_RETRY_MAX_ATTEMPTS)
+        # every round with keys left counts as throttling towards the breaker of the table
+        self.assertEqual(Resilience.breakers['ledgerTest'].state, 'open')
+
+        async def past_deadline():
+            Resilience.start_deadline(0)
+            return await AsyncDynamo.batch_get({'ledgerTest': [{'name': 'user1'}]})
+
+        Resilience.breakers.clear()
+        self.requests.clear()
+        with self.throttling(processed=None), self.assertRaises(StorageUnavailableError):
+            asyncio.run(past_deadline())
+        self.assertEqual(len(self.requests), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.storage import ClientFactory
+from app.storage import Dynamo as dynamo_module
+from app.storage.AsyncDynamo import AsyncDynamo, pool_stats
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+class TestClientFactory(unittest.TestCase):
+    def test_config_covers_the_worker_pool(self):
+        config = ClientFactory.build_config()
+        self.assertGreaterEqual(config.max_pool_connections, ClientFactory.DYNAMO_MAX_WORKERS)
+        self.assertEqual(config.connect_timeout, ClientFactory.DYNAMO_CONNECT_TIMEOUT_SECONDS)
+        self.assertEqual(config.read_timeout, ClientFactory.DYNAMO_READ_TIMEOUT_SECONDS)
+        self.assertEqual(config.retries, {'mode': ClientFactory.DYNAMO_RETRY_MODE,
+                                          'max_attempts': ClientFactory.DYNAMO_MAX_ATTEMPTS})
+
+    def test_table_handles_are_cached_per_resource(self):
+        first = LocalDynamoResource(latency_ms=0)
+        with mock.patch.object(dynamo_module, 'dyn_resource', first):
+            table = dynamo_module.get_table('ledgerTest')
+            self.assertIs(dynamo_module.get_table('ledgerTest'), table)
+            self.assertIsNot(dynamo_module.get_table('portfolioTest'), table)
+        second = LocalDynamoResource(latency_ms=0)
+        with mock.patch.object(dynamo_module, 'dyn_resource', second):
+            self.assertIsNot(dynamo_module.get_table('ledgerTest'), table)
+
+    def test_pool_wait_is_recorded(self):
+        resource = LocalDynamoResource(latency_ms=0)
+        resource.Table('ledgerTest').put_item(Item={'name': 'alice', 'balance': 1})
+        calls = pool_stats.stats()['calls']
+        with mock.patch.object(dynamo_module, 'dyn_resource', resource):
+            asyncio.run(AsyncDynamo.get_item('ledgerTest', {'name': 'alice'}))
+        stats = pool_stats.stats()
+        self.assertEqual(stats['calls'], calls + 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertGreaterEqual(stats['max_pool_wait_ms'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import asyncio
+import json
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.storage import Dynamo as dynamo_module
+from app.storage import Export
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        for i in range(250):
+            self.resource.Table('ledgerTest').put_item(Item={'name': f'user{i}', 'balance': Decimal(i)})
+        for patch in (mock.patch.object(dynamo_module, 'dyn_resource', self.resource),
+                      mock.patch.object(Export, 'EXPORT_PAGE_ITEMS', 20)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_segments_export_every_item_once(self):
+        async def export() -> str:
+            return ''.join([chunk async for chunk in Export.export_ndjson('ledgerTest', segments=4)])
+
+        lines = asyncio.run(export()).splitlines()
+        items = {json.loads(line)['Item']['name']['S']: json.loads(line)['Item']['balance']['N'] for line in lines}
+        self.assertEqual(len(lines), 250)
+        self.assertEqual(items, {f'user{i}': str(i) for i in range(250)})
+
+    def test_closing_the_stream_stops_the_scan(self):
+        async def first_page() -> tuple[list[dict], int]:
+            pages = Export.scan_pages('ledgerTest', segments=4, queue_pages=1)
+            page = await anext(pages)
+            await pages.aclose()
+            return page, len([task for task in asyncio.all_tasks() if task is not asyncio.current_task()])
+
+        page, pending = asyncio.run(first_page())
+        self.assertEqual(len(page), 20)
+        self.assertEqual(pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
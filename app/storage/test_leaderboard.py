@@ -0,0 +1,141 @@
+import asyncio
+import os
+import random
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.handlers.account_handler import AccountHandler
+from app.storage import Dynamo as dynamo_module
+from app.storage import Leaderboard
+from app.storage.AsyncDynamo import read_coalescer
+from app.storage.Dynamo import DynamoError
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+def oracle(balances: dict[str, Decimal], n: int) -> list[Decimal]:
+    return sorted(balances.values(), reverse=True)[:n]
+
+
+class TestLeaderboard(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Leaderboard, 'LEADERBOARD_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_top(self, leaders: list[dict], balances: dict[str, Decimal], n: int):
+        # accounts tied at the cut may come in any order, the balances may not
+        self.assertEqual([leader['balance'] for leader in leaders], oracle(balances, n))
+        for leader in leaders:
+            self.assertEqual(leader['balance'], balances[leader['name']])
+
+    def test_board_against_brute_force(self):
+        rng = random.Random(7)
+        balances = {f'user{i}': Decimal(rng.randrange(1000)) for i in range(300)}
+        board = Leaderboard.build(balances, capacity=10)
+        rebuilds = 0
+        for step in range(20000):
+            name = f'user{rng.randrange(320)}'
+            if rng.random() < 0.02:
+                balances.pop(name, None)
+                Leaderboard.record(board, name, None, capacity=10)
+            else:
+                balances[name] = max(Decimal(0), balances.get(name, Decimal(0)) + rng.randrange(-300, 250))
+                Leaderboard.record(board, name, balances[name], capacity=10)
+            n = rng.randrange(1, 6)
+            leaders = Leaderboard.ranked(board, n)
+            if leaders is None:
+                rebuilds += 1
+                board = Leaderboard.build(balances, capacity=10)
+                leaders = Leaderboard.ranked(board, n)
+            self.assert_top(leaders, balances, n)
+        self.assertTrue(0 < rebuilds < 200)
+
+    def test_handlers_keep_the_stored_board(self):
+        resource = LocalDynamoResource(latency_ms=0)
+        for patch in (mock.patch.object(dynamo_module, 'dyn_resource', resource),
+                      mock.patch.object(Leaderboard, 'LEADERBOARD_CAPACITY', 6)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        read_coalescer.clear()
+        self.addCleanup(read_coalescer.clear)
+        ledger = resource.Table('ledgerTest')
+        rng = random.Random(3)
+
+        def balances() -> dict[str, Decimal]:
+            totals: dict[str, Decimal] = {}
+            for item in ledger.items.values():
+                name = item['name'].split('#')[0]
+                totals[name] = totals.get(name, Decimal(0)) + item['balance']
+            return totals
+
+        async def activity() -> int:
+            for i in range(40):
+                await AccountHandler.handle_create_account(f'user{i}', Decimal(rng.randrange(100)), True)
+            self.assert_top(await AccountHandler.handle_get_leaderboard(3, True), balances(), 3)
+            await AccountHandler.handle_shard_account('user0', 3, True)
+            for step in range(300):
+                names = sorted(balances())
+                sender, receiver = rng.sample(names, 2)
+                operation = rng.randrange(5)
+                try:
+                    if operation == 0:
+                        await AccountHandler.handle_modify_account(sender, Decimal(rng.randrange(-50, 80)), True)
+                    elif operation == 1:
+                        await AccountHandler.handle_update_account(sender, Decimal(rng.randrange(200)), True)
+                    elif operation == 2 and step % 30 == 0:
+                        await AccountHandler.handle_delete_account(sender, True)
+                    elif operation == 3:
+                        await AccountHandler.handle_batch_transactions(
+                            [{'sender': sender, 'receiver': receiver, 'amount': Decimal(rng.randrange(1, 40))}], True)
+                    else:
+                        await AccountHandler.handle_transaction(sender, receiver, Decimal(rng.randrange(1, 40)), True)
+                except ValueError:
+                    pass
+                n = rng.randrange(1, 4)
+                self.assert_top(await AccountHandler.handle_get_leaderboard(n, True), balances(), n)
+            return len(balances())
+
+        with mock.patch.object(Leaderboard, 'scan_balances', wraps=Leaderboard.scan_balances) as scans:
+            accounts = asyncio.run(activity())
+        self.assertGreater(accounts, 25)
+        # the board is read without a scan most of the time
+        self.assertLess(scans.call_count, 100)
+
+    def test_contention_leaves_the_accounts_pending_and_errors_drop_the_board(self):
+        resource = LocalDynamoResource(latency_ms=0)
+        patch = mock.patch.object(dynamo_module, 'dyn_resource', resource)
+        patch.start()
+        self.addCleanup(patch.stop)
+        read_coalescer.clear()
+        self.addCleanup(read_coalescer.clear)
+        board_table = resource.Table('aggregatesTest')
+
+        async def scenario():
+            for i in range(5):
+                await AccountHandler.handle_create_account(f'user{i}', Decimal(i), True)
+            await AccountHandler.handle_get_leaderboard(3, True)
+            # every save of the board loses to another writer
+            with mock.patch.object(Leaderboard, 'save', mock.AsyncMock(return_value=False)):
+                await AccountHandler.handle_modify_account('user0', Decimal(100), True)
+            pending = board_table.get_item(Key={'name': Leaderboard.LEADERBOARD})['Item']['pending']
+            with mock.patch.object(Leaderboard, 'scan_balances', wraps=Leaderboard.scan_balances) as scans:
+                leaders = await AccountHandler.handle_get_leaderboard(2, True)
+            board = board_table.get_item(Key={'name': Leaderboard.LEADERBOARD})['Item']
+            with mock.patch.object(Leaderboard, 'save', mock.AsyncMock(side_effect=DynamoError('ValidationException',
+                                                                                             'bad board'))):
+                await AccountHandler.handle_modify_account('user1', Decimal(200), True)
+            return pending, scans.call_count, leaders, board
+
+        pending, scans, leaders, board = asyncio.run(scenario())
+        self.assertEqual(pending, {'user0'})
+        self.assertEqual(scans, 0)
+        self.assertEqual([(leader['name'], leader['balance']) for leader in leaders], [('user0', 100), ('user4', 4)])
+        self.assertNotIn('pending', board)
+        self.assertNotIn('Item', board_table.get_item(Key={'name': Leaderboard.LEADERBOARD}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.handlers.account_handler import AccountHandler
+from app.storage import Dynamo as dynamo_module
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+class TestLocalTransactions(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        patcher = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ledger = self.resource.Table('ledgerTest')
+        ledger.put_item(Item={'name': 'alice', 'balance': Decimal('100')})
+        ledger.put_item(Item={'name': 'bob', 'balance': Decimal('5')})
+
+    def balance(self, name: str) -> Decimal:
+        return self.resource.Table('ledgerTest').get_item(Key={'name': name})['Item']['balance']
+
+    def test_transfer(self):
+        resp = asyncio.run(AccountHandler.handle_transaction('alice', 'bob', Decimal('30'), True))
+        self.assertEqual(resp, 'update item success')
+        self.assertEqual(self.balance('alice'), Decimal('70'))
+        self.assertEqual(self.balance('bob'), Decimal('35'))
+
+    def test_insufficient_funds_changes_nothing(self):
+        with self.assertRaisesRegex(ValueError, 'insufficient funds'):
+            asyncio.run(AccountHandler.handle_transaction('bob', 'alice', Decimal('6'), True))
+        self.assertEqual(self.balance('alice'), Decimal('100'))
+        self.assertEqual(self.balance('bob'), Decimal('5'))
+
+    def test_missing_recipient_changes_nothing(self):
+        with self.assertRaisesRegex(ValueError, 'recipient not found'):
+            asyncio.run(AccountHandler.handle_transaction('alice', 'carol', Decimal('1'), True))
+        self.assertEqual(self.balance('alice'), Decimal('100'))
+        self.assertNotIn('Item', self.resource.Table('ledgerTest').get_item(Key={'name': 'carol'}))
+
+    def test_concurrent_transfers_conserve_money(self):
+        async def transfer_all():
+            transfers = [AccountHandler.handle_transaction('alice', 'bob', Decimal('1'), True) for _ in range(150)]
+            return await asyncio.gather(*transfers, return_exceptions=True)
+
+        results = asyncio.run(transfer_all())
+        succeeded = sum(1 for r in results if r == 'update item success')
+        self.assertEqual(succeeded, 100)
+        self.assertEqual(self.balance('alice'), Decimal('0'))
+        self.assertEqual(self.balance('bob'), Decimal('105'))
+
+
+    def test_concurrent_deposits_are_not_lost(self):
+        async def deposit_all():
+            deposits = [AccountHandler.handle_modify_account('bob', Decimal('2'), True) for _ in range(50)]
+            return await asyncio.gather(*deposits)
+
+        results = asyncio.run(deposit_all())
+        self.assertEqual(max(r['balance'] for r in results), Decimal('105'))
+        self.assertEqual(self.balance('bob'), Decimal('105'))
+
+    def test_withdrawal_cannot_overdraw(self):
+        with self.assertRaisesRegex(ValueError, 'insufficient funds'):
+            asyncio.run(AccountHandler.handle_modify_account('bob', Decimal('-6'), True))
+        resp = asyncio.run(AccountHandler.handle_modify_account('bob', Decimal('-5'), True))
+        self.assertEqual(resp, {'name': 'bob', 'balance': Decimal('0')})
+
+
+if __name__ == '__main__':
+    unittest.main()
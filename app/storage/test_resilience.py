@@ -0,0 +1,119 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.storage import Resilience
+from app.storage.AsyncDynamo import AsyncDynamo
+from app.storage.Dynamo import Dynamo, DynamoError, TransactionCancelledError
+from app.storage.Resilience import StorageUnavailableError, call_with_retry
+
+
+def failing(errors: list, result='ok'):
+    # coroutine function raising the given errors one attempt after the other, then returning result
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return call, calls
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        Resilience.breakers.clear()
+        patches = [mock.patch.object(Resilience, 'DYNAMO_RETRY_BASE_SECONDS', 0.001),
+                   mock.patch.object(Resilience, 'DYNAMO_RETRY_CAP_SECONDS', 0.002),
+                   mock.patch.object(Resilience, 'retry_budget', Resilience.RetryBudget(500))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_throttling_is_retried(self):
+        call, calls = failing([DynamoError('ProvisionedThroughputExceededException', 'slow down'),
+                               TransactionCancelledError('cancelled', ['None', 'TransactionConflict'])])
+        self.assertEqual(asyncio.run(call_with_retry(['ledgerTest'], False, call)), 'ok')
+        self.assertEqual(len(calls), 3)
+
+    def test_fatal_and_unknown_outcome_of_writes_are_not_retried(self):
+        call, calls = failing([DynamoError('ValidationException', 'bad request')])
+        with self.assertRaises(DynamoError):
+            asyncio.run(call_with_retry(['ledgerTest'], True, call))
+        call, calls = failing([DynamoError('InternalServerError', 'oops')])
+        with self.assertRaises(DynamoError):
+            asyncio.run(call_with_retry(['ledgerTest'], False, call))
+        self.assertEqual(len(calls), 1)
+        call, calls = failing([DynamoError('InternalServerError', 'oops')])
+        self.assertEqual(asyncio.run(call_with_retry(['ledgerTest'], True, call)), 'ok')
+
+    def test_balance_set_is_not_retried_after_an_unknown_outcome(self):
+        # it adds to the version, a second attempt would bump it twice
+        with mock.patch.object(Dynamo, 'update_account_balance',
+                               side_effect=DynamoError('InternalServerError', 'oops')) as update:
+            with self.assertRaises(DynamoError):
+                asyncio.run(AsyncDynamo.update_account_balance('ledgerTest', {'name': 'alice', 'balance': 1}))
+        self.assertEqual(update.call_count, 1)
+
+    def test_conditional_put_is_not_retried_after_an_unknown_outcome(self):
+        # the second attempt would fail attribute_not_exists on the item the first one created
+        with mock.patch.object(Dynamo, 'create_item',
+                               side_effect=DynamoError('InternalServerError', 'oops')) as create:
+            with self.assertRaises(DynamoError):
+                asyncio.run(AsyncDynamo.create_item('ledgerTest', {'name': 'alice', 'balance': 1},
+                                                    'attribute_not_exists(#n)', None, {'#n': 'name'}))
+        self.assertEqual(create.call_count, 1)
+        with mock.patch.object(Dynamo, 'create_item',
+                               side_effect=[DynamoError('InternalServerError', 'oops'), 'ok']) as create:
+            self.assertEqual(asyncio.run(AsyncDynamo.create_item('ledgerTest', {'name': 'alice', 'balance': 1})),
+                             'ok')
+        self.assertEqual(create.call_count, 2)
+
+    def test_gives_up_with_storage_unavailable(self):
+        errors = [DynamoError('ThrottlingException', 'slow down')] * 10
+        call, calls = failing(list(errors))
+        with self.assertRaises(StorageUnavailableError):
+            asyncio.run(call_with_retry(['ledgerTest'], True, call))
+        self.assertEqual(len(calls), Resilience.DYNAMO_RETRY_MAX_ATTEMPTS)
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = Resilience.CircuitBreaker('ledgerTest', failure_threshold=2, cooldown_seconds=0.05)
+        Resilience.breakers['ledgerTest'] = breaker
+        with mock.patch.object(Resilience, 'DYNAMO_RETRY_MAX_ATTEMPTS', 2):
+            call, calls = failing([DynamoError('ThrottlingException', 'slow down')] * 2)
+            with self.assertRaises(StorageUnavailableError):
+                asyncio.run(call_with_retry(['ledgerTest'], True, call))
+        self.assertEqual(breaker.state, 'open')
+
+        # fails fast while open
+        call, calls = failing([])
+        with self.assertRaises(StorageUnavailableError) as raised:
+            asyncio.run(call_with_retry(['ledgerTest', 'portfolioTest'], True, call))
+        self.assertEqual(calls, [])
+        self.assertEqual(raised.exception.retry_after, 1)
+
+        # a successful probe closes it once the cooldown is over
+        asyncio.run(asyncio.sleep(0.06))
+        self.assertEqual(asyncio.run(call_with_retry(['ledgerTest'], True, call)), 'ok')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_route_answers_503_with_retry_after(self):
+        from fastapi.testclient import TestClient
+        from app.app import app
+        from app.common.Auth import get_current_active_user
+        from app.storage.Dynamo import Dynamo
+
+        app.dependency_overrides[get_current_active_user] = lambda: {'name': 'alice'}
+        self.addCleanup(app.dependency_overrides.clear)
+        with mock.patch.object(Dynamo, 'get_item', side_effect=DynamoError('ThrottlingException', 'slow down')):
+            response = TestClient(app).get('/account/alice')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['retry-after'], '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
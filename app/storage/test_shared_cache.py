@@ -0,0 +1,69 @@
+import asyncio
+import os
+import unittest
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.handlers.account_handler import AccountHandler
+from app.storage import AsyncDynamo as async_dynamo_module
+from app.storage import Dynamo as dynamo_module
+from app.storage.Dynamo import Dynamo
+from app.storage.LocalDynamo import LocalDynamoResource
+from app.storage.SharedCache import LocalRedis, SharedCache
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        ledger = self.resource.Table('ledgerTest')
+        ledger.put_item(Item={'name': 'alice', 'balance': Decimal('10')})
+        ledger.put_item(Item={'name': 'bob', 'balance': Decimal('10')})
+        self.cache = SharedCache(LocalRedis(), frozenset({'ledgerTest'}))
+        async_dynamo_module.read_coalescer.clear()
+        for patch in (mock.patch.object(dynamo_module, 'dyn_resource', self.resource),
+                      mock.patch.object(async_dynamo_module, 'shared_cache', self.cache)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get(self, name: str, table_name: str = 'ledgerTest') -> dict:
+        return asyncio.run(async_dynamo_module.AsyncDynamo.get_item(table_name, {'name': name}))
+
+    def test_read_through(self):
+        with mock.patch.object(Dynamo, 'get_item', wraps=Dynamo.get_item) as get_item:
+            self.assertEqual(self.get('alice')['balance'], Decimal('10'))
+            self.assertEqual(self.get('alice')['balance'], Decimal('10'))
+            self.get('alice', 'portfolioTest')
+        # the second read is a hit, portfolioTest is not a shared table
+        self.assertEqual(get_item.call_count, 2)
+        self.assertEqual((self.cache.hits, self.cache.misses, self.cache.fills), (1, 1, 1))
+
+    def test_write_through_and_stale_fill(self):
+        stale = self.get('alice')
+        asyncio.run(AccountHandler.handle_modify_account('alice', Decimal('5'), True))
+        self.assertEqual(self.cache.writes, 1)
+        with mock.patch.object(Dynamo, 'get_item') as get_item:
+            item = self.get('alice')
+        get_item.assert_not_called()
+        self.assertEqual((item['balance'], item['version']), (Decimal('15'), Decimal('1')))
+
+        # a reader holding the item from before the write can not put it back
+        asyncio.run(self.cache.put('ledgerTest', stale))
+        self.assertEqual(self.cache.stale_rejected, 1)
+        self.assertEqual(self.get('alice')['balance'], Decimal('15'))
+
+    def test_transaction_invalidates(self):
+        self.get('alice')
+        asyncio.run(AccountHandler.handle_transaction('alice', 'bob', Decimal('4'), True))
+        self.assertEqual(self.cache.invalidations, 2)
+        # alice was cached at version 0, the tombstone lets the newer version 1 back in
+        self.assertEqual(self.get('alice')['balance'], Decimal('6'))
+        self.assertEqual(self.get('alice')['version'], Decimal('1'))
+        self.assertEqual(self.cache.fills, 2)
+        # bob was not cached, the version before the transaction is unknown so refills wait for the tombstone
+        self.assertEqual(self.get('bob')['balance'], Decimal('14'))
+        self.assertEqual(self.cache.stale_rejected, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import random
+import unittest
+from array import array
+from decimal import *
+from unittest import mock
+
+os.environ.setdefault('DYNAMO_BACKEND', 'local')
+
+from app.common import Valuation
+from app.handlers.portfolio_handler import PortfolioHandler
+from app.storage import Dynamo as dynamo_module
+from app.storage import ValueHistory
+from app.storage.LocalDynamo import LocalDynamoResource
+
+DAY = ValueHistory.HISTORY_BLOCK_SECONDS
+NOW = 1_700_000_000 - 1_700_000_000 % DAY + 12 * 3600
+
+
+class TestValueHistory(unittest.TestCase):
+    def setUp(self):
+        self.resource = LocalDynamoResource(latency_ms=0)
+        patcher = mock.patch.object(dynamo_module, 'dyn_resource', self.resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_blocks_decode_and_downsample_like_the_samples(self):
+        rng = random.Random(7)
+        timestamps = array('q', sorted(rng.sample(range(NOW, NOW + DAY), 500)))
+        values = array('q', (rng.randrange(-10 ** 12, 10 ** 12) for _ in timestamps))
+        self.assertEqual(ValueHistory.decode(ValueHistory.encode(timestamps, values), 500), (timestamps, values))
+
+        start, end, step = NOW + 1000, NOW + 50000, 3600
+        expected: dict[int, float] = {}
+        for at, value in zip(timestamps, values):
+            if start <= at < end:
+                expected[at - at % step] = value / ValueHistory.VALUE_UNITS
+        self.assertEqual(ValueHistory.downsample(timestamps, values, start, end, step),
+                         [[bucket, value] for bucket, value in sorted(expected.items())])
+
+        self.assertEqual(ValueHistory.resolve('1y', None), (365 * DAY, DAY))
+        for range_name, resolution in (('1h', None), ('1d', '1m'), ('1d', 'often'), ('1d', '0s')):
+            with self.assertRaises(ValueError):
+                ValueHistory.resolve(range_name, resolution)
+
+    def test_sampled_values_are_served_as_history(self):
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'alice', 'portfolio': {
+            'bitcoin': {'name': 'bitcoin', 'amount': Decimal('0.5'), 'id': 'bitcoin'}}})
+        self.resource.Table('portfolioTest').put_item(Item={'name': 'bob', 'portfolio': [
+            {'name': 'litecoin', 'amount': Decimal(4), 'id': 'litecoin'}]})
+        prices = mock.patch.object(Valuation.price_tables, 'get_or_load', mock.AsyncMock())
+        get_or_load = prices.start()
+        self.addCleanup(prices.stop)
+
+        # 3 days of samples every 10 minutes, with a retried run 1 minute after each that is skipped
+        samples = 0
+        for at in range(NOW - 3 * DAY, NOW, 600):
+            get_or_load.return_value = Valuation.PriceTable({'bitcoin': 60000.0 + at % 7, 'litecoin': 80.0}, at)
+            for retry in (0, 60):
+                samples += asyncio.run(ValueHistory.sample_portfolios('portfolioTest', at + retry))['samples']
+        self.assertEqual(samples, 2 * 3 * 144)
+        blocks = self.resource.Table('portfolioHistoryTest').items
+        self.assertEqual(len(blocks), 2 * 4)
+
+        with mock.patch('app.handlers.portfolio_handler.time.time', return_value=NOW):
+            day = asyncio.run(PortfolioHandler.handle_get_portfolio_history('alice', '1d', '1h', True))
+            week = asyncio.run(PortfolioHandler.handle_get_portfolio_history('bob', '1w', None, True))
+            missing = asyncio.run(PortfolioHandler.handle_get_portfolio_history('carol', '1m', None, True))
+
+        self.assertEqual((day['blocks'], len(day['points'])), (2, 24))
+        self.assertEqual(day['points'][-1], [NOW - 3600, 30000.0 + (NOW - 600) % 7 / 2])
+        self.assertEqual((week['blocks'], week['samples'], len(week['points'])), (4, 3 * 144, 72))
+        self.assertEqual({value for _, value in week['points']}, {320.0})
+        self.assertEqual((missing['blocks'], missing['points']), (0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
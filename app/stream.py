@@ -0,0 +1,30 @@
+import asyncio
+import logging
+import uuid
+
+from app.monitoring import logging_config
+from app.storage import Aggregates
+from app.storage.Resilience import start_deadline
+
+###############################################################################
+#   Handler for the DynamoDB Streams of the ledger and portfolio tables       #
+###############################################################################
+
+# Deployed from the same image as app.app.handler with the command app.stream.handler, behind stream
+# event source mappings of the ledger and portfolio tables. A failed batch raises and is sent again.
+logging_config.configure_logging(service='gojenga-stream', instance=str(uuid.uuid4()))
+logger = logging.getLogger(__name__)
+
+
+async def apply(records: list[dict]) -> dict:
+    start_deadline()
+    return await Aggregates.apply_records(records)
+
+
+def handler(event, context):
+    try:
+        result = asyncio.run(apply(event.get('Records', [])))
+        logger.info('stream batch applied', extra={'type': 'stream', **result})
+        return result
+    finally:
+        logging_config.flush_logs()
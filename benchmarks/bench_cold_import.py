@@ -0,0 +1,56 @@
+"""Cold import benchmark of app.app, runnable in CI.
+
+    python -m benchmarks.bench_cold_import --runs 7 --budget-ms 800
+
+Each run imports app.app in a fresh interpreter with -X importtime and reads the cumulative
+time of the app.app import. Exits with status 1 when the median exceeds the budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+def import_times(module: str, env: dict) -> dict[str, tuple[int, int]]:
+    # returns module -> (self us, cumulative us) as reported by -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=env, capture_output=True, text=True, check=True)
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='app.app')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=None)
+    parser.add_argument('--startup-mode', default='lazy', choices=['lazy', 'eager'])
+    args = parser.parse_args()
+
+    env = dict(os.environ, STARTUP_MODE=args.startup_mode)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    runs = [import_times(args.module, env) for _ in range(args.runs)]
+    totals_ms = [run[args.module][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+
+    print(f'{args.module} cold import ({args.startup_mode}): median {median_ms:.1f} ms, '
+          f'min {min(totals_ms):.1f} ms, max {max(totals_ms):.1f} ms over {args.runs} runs')
+    last = runs[-1]
+    print(f'top {args.top} modules by self time (last run):')
+    for name, (self_us, cumulative_us) in sorted(last.items(), key=lambda t: t[1][0], reverse=True)[:args.top]:
+        print(f'  {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms total  {name}')
+
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f'cold import exceeds the {args.budget_ms:.0f} ms budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Time to export a table with 1, 2, 4 ... segments of the parallel Scan.
+
+    python -m benchmarks.bench_export --items 20000 --page-items 200 --latency-ms 20 --max-segments 8
+
+Fills the local DynamoDB stand-in, whose simulated latency is paid once per Scan page, and writes the gzip NDJSON
+export of the table with each segment count. With one segment the time is pages x latency, more segments read their
+pages concurrently.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from decimal import *
+from unittest import mock
+
+os.environ['DYNAMO_BACKEND'] = 'local'
+
+from app.storage import Dynamo as dynamo_module
+from app.storage import Export
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--page-items', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--max-segments', type=int, default=8)
+    args = parser.parse_args()
+
+    resource = LocalDynamoResource(latency_ms=0)
+    ledger = resource.Table('ledgerTest')
+    for i in range(args.items):
+        ledger.put_item(Item={'name': f'user{i}', 'balance': Decimal(i)})
+    resource.latency = args.latency_ms / 1000
+
+    with mock.patch.object(dynamo_module, 'dyn_resource', resource), \
+            mock.patch.object(Export, 'EXPORT_PAGE_ITEMS', args.page_items), \
+            tempfile.TemporaryDirectory() as out_dir:
+        segments = 1
+        while segments <= args.max_segments:
+            path = os.path.join(out_dir, f'ledger-{segments}.ndjson.gz')
+            started = time.perf_counter()
+            items = asyncio.run(Export.export_to_file('ledgerTest', path, segments))
+            elapsed = time.perf_counter() - started
+            print(f'{segments:3d} segments: {items} items in {elapsed:6.2f}s ({items / elapsed:8.0f} items/s), '
+                  f'{os.path.getsize(path) / 1024:.0f} KiB')
+            segments *= 2
+
+
+if __name__ == '__main__':
+    main()
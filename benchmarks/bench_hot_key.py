@@ -0,0 +1,62 @@
+"""DynamoDB reads issued by a burst of concurrent GET /account/{username} for one hot account.
+
+    python -m benchmarks.bench_hot_key --requests 2000 --concurrency 200 --latency-ms 5
+
+Runs AccountHandler.handle_get_account against the local DynamoDB stand-in with read coalescing
+off and on, and reports the reads that reached the table and the elapsed time.
+"""
+import argparse
+import asyncio
+import os
+import time
+from unittest import mock
+
+os.environ['DYNAMO_BACKEND'] = 'local'
+
+from app.handlers.account_handler import AccountHandler
+from app.storage import AsyncDynamo as async_dynamo_module
+from app.storage import Dynamo as dynamo_module
+from app.storage.Dynamo import Dynamo
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+async def burst(requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get():
+        async with semaphore:
+            await AccountHandler.handle_get_account('hot', True)
+
+    await asyncio.gather(*(get() for _ in range(requests)))
+
+
+def run(requests: int, concurrency: int, coalesce: bool, window_ms: float) -> tuple[int, float]:
+    async_dynamo_module.read_coalescer.clear()
+    with mock.patch.object(async_dynamo_module, 'DYNAMO_COALESCE_READS', coalesce), \
+            mock.patch.object(async_dynamo_module, 'DYNAMO_COALESCE_WINDOW_SECONDS', window_ms / 1000), \
+            mock.patch.object(async_dynamo_module.read_coalescer, 'ttl_seconds', window_ms / 1000), \
+            mock.patch.object(Dynamo, 'get_item', wraps=Dynamo.get_item) as get_item:
+        started = time.perf_counter()
+        asyncio.run(burst(requests, concurrency))
+        return get_item.call_count, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--window-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    resource = LocalDynamoResource(latency_ms=args.latency_ms)
+    dynamo_module.dyn_resource = resource
+    resource.Table('ledgerTest').put_item(Item={'name': 'hot', 'balance': 100})
+
+    for label, coalesce in (('without coalescing', False), ('with coalescing', True)):
+        reads, elapsed = run(args.requests, args.concurrency, coalesce, args.window_ms)
+        print(f'{label:20s}: {reads:6d} table reads for {args.requests} requests in {elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
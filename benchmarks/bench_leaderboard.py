@@ -0,0 +1,75 @@
+"""Cost of the incremental leaderboard against scanning and sorting the ledger, at 1M accounts.
+
+    python -m benchmarks.bench_leaderboard --accounts 1000000 --updates 200000 --n 10
+
+Builds the board from the balance of every account, then applies random balance changes with
+Leaderboard.record and reads the top n with Leaderboard.ranked, checking every read against a
+brute force pass over all balances. Reports the time per change and per read of both, the share
+of changes that write the board item, the rebuilds and the size of the board item.
+"""
+import argparse
+import heapq
+import json
+import random
+import time
+from decimal import *
+
+from app.storage import Leaderboard
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=1000000)
+    parser.add_argument('--updates', type=int, default=200000)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--reads', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = [f'user{i}' for i in range(args.accounts)]
+    balances = {name: Decimal(rng.randrange(1000000)) for name in names}
+
+    started = time.perf_counter()
+    board = Leaderboard.build(balances)
+    build_seconds = time.perf_counter() - started
+
+    writes = 0
+    rebuilds = 0
+    record_seconds = 0.0
+    read_seconds = 0.0
+    oracle_seconds = 0.0
+    read_every = max(1, args.updates // args.reads)
+    for update in range(1, args.updates + 1):
+        name = names[rng.randrange(args.accounts)]
+        balances[name] = max(Decimal(0), balances[name] + rng.randrange(-50000, 50000))
+        started = time.perf_counter()
+        writes += Leaderboard.record(board, name, balances[name])
+        record_seconds += time.perf_counter() - started
+        if update % read_every:
+            continue
+        started = time.perf_counter()
+        leaders = Leaderboard.ranked(board, args.n)
+        if leaders is None:
+            rebuilds += 1
+            board = Leaderboard.build(balances)
+            leaders = Leaderboard.ranked(board, args.n)
+        read_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        expected = heapq.nlargest(args.n, balances.values())
+        oracle_seconds += time.perf_counter() - started
+        assert [leader['balance'] for leader in leaders] == expected, (leaders, expected)
+
+    reads = args.updates // read_every
+    item = json.dumps({name: str(balance) for name, balance in board['entries'].items()})
+    print(f'accounts: {args.accounts}, board capacity: {Leaderboard.LEADERBOARD_CAPACITY}, '
+          f'board item ~{len(item) / 1024:.1f} KiB')
+    print(f'build from all balances: {build_seconds * 1000:.0f} ms')
+    print(f'change: {record_seconds / args.updates * 1e6:.2f} us, '
+          f'{writes / args.updates:.2%} of {args.updates} changes write the board')
+    print(f'top {args.n}: board {read_seconds / reads * 1e6:.0f} us, '
+          f'scan of all balances {oracle_seconds / reads * 1e6:.0f} us ({reads} reads, {rebuilds} rebuilds)')
+
+
+if __name__ == '__main__':
+    main()
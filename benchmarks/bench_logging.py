@@ -0,0 +1,106 @@
+"""Logging overhead per request of the old synchronous pipeline and the queued one.
+
+    python -m benchmarks.bench_logging --requests 20000 --budget-us 50
+
+A request logs what an authenticated GET /account/{username} logs: the Request and Response sent
+records of the logging middleware and the debug calls of Auth, the handler and Dynamo. Before is
+the DEBUG level StreamHandler with python-json-logger plus the print() calls those debug calls
+replaced, after is configure_logging at INFO. Output goes to /dev/null. Exits with status 1 when the
+per request overhead on the request path exceeds the budget.
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from pythonjsonlogger import jsonlogger
+
+from app.monitoring import logging_config
+
+DEBUG_CALLS = ['running get_current_user', 'running get_user', 'running get_current_active_user',
+               'trying to get account %s', 'handle getting account %s', 'get_item: %s', 'item found: %s']
+
+
+class LegacyLogFilter(logging.Filter):
+    def filter(self, record):
+        record.service = 'gojenga'
+        record.instance = 'bench'
+        return True
+
+
+class LegacyJsonLogFormatter(jsonlogger.JsonFormatter):
+    def add_fields(self, log_record, record, message_dict):
+        super().add_fields(log_record, record, message_dict)
+        if not log_record.get('timestamp'):
+            log_record['timestamp'] = datetime.utcnow().isoformat()
+        log_record['level'] = record.levelname
+        if not log_record.get('type'):
+            log_record['type'] = 'internal'
+
+
+def configure_legacy(stream):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(LegacyJsonLogFormatter('%(timestamp)s %(level)s %(service)s %(instance)s %(type)s %(message)s'))
+    handler.addFilter(LegacyLogFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(logging.DEBUG)
+
+
+def one_request(logger, print_calls: bool):
+    req_uuid = str(uuid.uuid4())
+    query = {'name': 'alice'}
+    logger.info("Request", extra={'uuid': req_uuid, 'type': 'api-request', 'method': 'GET',
+                                  'url': 'http://bench/account/alice'})
+    for message in DEBUG_CALLS:
+        if print_calls:
+            print(f'--> {message}')
+        if '%s' in message:
+            logger.debug(message, query)
+        else:
+            logger.debug(message)
+    logger.info("Response sent", extra={'uuid': req_uuid, 'type': 'api-response', 'code': 200, 'duration_ms': 1.0})
+
+
+def per_request_us(requests: int, print_calls: bool, drain) -> tuple[float, float]:
+    # returns (time spent on the request path, time including the records still being written)
+    logger = logging.getLogger('bench')
+    started = time.perf_counter()
+    for _ in range(requests):
+        one_request(logger, print_calls)
+    request_path = time.perf_counter() - started
+    drain()
+    total = time.perf_counter() - started
+    return request_path / requests * 1e6, total / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--budget-us', type=float, default=None)
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        configure_legacy(devnull)
+        before = per_request_us(args.requests, True, lambda: None)
+        logging_config.configure_logging(level='INFO', service='gojenga', instance='bench', stream=devnull)
+        after = per_request_us(args.requests, False, logging_config.flush_logs)
+        stats = logging_config.log_stats()
+        logging_config.stop_logging()
+
+    print(f'sync DEBUG + print: {before[0]:8.1f} us/request on the request path')
+    print(f'queued INFO:        {after[0]:8.1f} us/request on the request path, '
+          f'{after[1]:.1f} us/request including the writer thread ({before[0] / after[0]:.1f}x)')
+    print(f'pipeline: {stats}')
+
+    if args.budget_us is not None and after[0] > args.budget_us:
+        print(f'logging overhead exceeds the {args.budget_us:.0f} us budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
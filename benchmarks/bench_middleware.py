@@ -0,0 +1,94 @@
+"""Requests/s of the /health route with the BaseHTTPMiddleware middlewares (before) and the pure ASGI ones (after).
+
+    python -m benchmarks.bench_middleware --requests 5000 --concurrency 50
+
+Both apps mirror app.app (CORS + logging + correlation id middlewares) and are driven in process through
+httpx's ASGI transport, so the numbers measure the middleware stack rather than a network.
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.cors import CORSMiddleware
+
+from app.middlewares.correlation_id_middleware import CorrelationIdMiddleware
+from app.middlewares.logging_middleware import LoggingMiddleware
+
+
+class LegacyCorrelationIdMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        request.state.correlation_id = request.headers.get("x-correlation-id", str(uuid.uuid4()))
+        response = await call_next(request)
+        response.headers["x-correlation-id"] = request.state.correlation_id
+        return response
+
+
+class LegacyLoggingMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app):
+        super().__init__(app)
+        self.logger = logging.getLogger()
+
+    async def dispatch(self, request, call_next):
+        req_uuid = request.state.correlation_id
+        self.logger.info("Request", extra={'uuid': req_uuid, 'type': 'api-request',
+                                           'method': str(request.method).upper(), 'url': str(request.url)})
+        response = await call_next(request)
+        self.logger.info("Response sent", extra={'uuid': req_uuid, 'type': 'api-response',
+                                                 'code': response.status_code})
+        return response
+
+
+def build_app(logging_middleware, correlation_id_middleware) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True,
+                       allow_methods=["*"], allow_headers=["*"])
+    app.add_middleware(logging_middleware)
+    app.add_middleware(correlation_id_middleware)
+
+    @app.get("/health")
+    async def health():
+        return {"message": "Health Check"}
+
+    return app
+
+
+async def requests_per_second(app: FastAPI, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        async def call():
+            async with semaphore:
+                response = await client.get('/health')
+                assert response.status_code == 200 and 'x-correlation-id' in response.headers
+
+        await asyncio.gather(*(call() for _ in range(min(200, requests))))  # warm up
+        started = time.perf_counter()
+        await asyncio.gather(*(call() for _ in range(requests)))
+        return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    # records are still created and filtered like in production, just not written anywhere
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+
+    before = build_app(LegacyLoggingMiddleware, LegacyCorrelationIdMiddleware)
+    after = build_app(LoggingMiddleware, CorrelationIdMiddleware)
+    for round_number in range(1, args.rounds + 1):
+        before_rps = asyncio.run(requests_per_second(before, args.requests, args.concurrency))
+        after_rps = asyncio.run(requests_per_second(after, args.requests, args.concurrency))
+        print(f'round {round_number}: BaseHTTPMiddleware {before_rps:8.0f} req/s   '
+              f'pure ASGI {after_rps:8.0f} req/s   ({after_rps / before_rps:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
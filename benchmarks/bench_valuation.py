@@ -0,0 +1,85 @@
+"""Time to value 100k portfolios against price snapshots, coin by coin in Python and as array operations.
+
+    python -m benchmarks.bench_valuation --portfolios 100000 --coins 2000 --holdings 8 --scenarios 20
+
+Portfolios hold up to --holdings coins drawn from --coins priced ones (plus a few unpriced), with
+Decimal amounts as read from DynamoDB. A single valuation includes flattening the portfolios into
+arrays, which is Python work like the loop; revaluing the same holdings against --scenarios shocked
+price tables reuses the arrays. Both valuations are checked against each other.
+"""
+import argparse
+import random
+import time
+from decimal import *
+
+from app.common import Valuation
+
+
+def value_in_python(portfolios: list[list[dict]], prices: dict[str, float]) -> list[float]:
+    values = []
+    for coins in portfolios:
+        value = 0.0
+        for coin in coins:
+            price = prices.get(coin['id'])
+            if price is not None:
+                value += float(coin['amount']) * price
+        values.append(value)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--portfolios', type=int, default=100000)
+    parser.add_argument('--coins', type=int, default=2000)
+    parser.add_argument('--holdings', type=int, default=8)
+    parser.add_argument('--scenarios', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    prices = {f'coin{i}': rng.uniform(0.0001, 60000) for i in range(args.coins)}
+    portfolios = [[{'id': f'coin{rng.randrange(args.coins + 10)}', 'name': 'coin',
+                    'amount': Decimal(rng.randrange(1, 10 ** 8)) / 10 ** 4}
+                   for _ in range(rng.randrange(1, args.holdings + 1))] for _ in range(args.portfolios)]
+    holdings = sum(len(coins) for coins in portfolios)
+
+    started = time.perf_counter()
+    table = Valuation.PriceTable(prices, time.time())
+    snapshot_ms = (time.perf_counter() - started) * 1000
+
+    python_seconds = min(timed(lambda: value_in_python(portfolios, prices)) for _ in range(args.runs))
+    array_seconds = min(timed(lambda: Valuation.value_batch(portfolios, table)) for _ in range(args.runs))
+    flatten_seconds = min(timed(lambda: Valuation.Holdings(portfolios)) for _ in range(args.runs))
+
+    expected = value_in_python(portfolios, prices)
+    for value, result in zip(expected, Valuation.value_batch(portfolios, table)):
+        assert abs(value - result['value']) <= 1e-9 * max(1.0, value), (value, result)
+
+    scenarios = [{coin_id: price * rng.uniform(0.7, 1.3) for coin_id, price in prices.items()}
+                 for _ in range(args.scenarios)]
+    tables = [Valuation.PriceTable(scenario, time.time()) for scenario in scenarios]
+    started = time.perf_counter()
+    for scenario in scenarios:
+        value_in_python(portfolios, scenario)
+    python_scenarios_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    holdings_arrays = Valuation.Holdings(portfolios)
+    for scenario_table in tables:
+        holdings_arrays.value(scenario_table)
+    array_scenarios_seconds = time.perf_counter() - started
+
+    print(f'{args.portfolios} portfolios, {holdings} holdings, {args.coins} prices (snapshot {snapshot_ms:.1f} ms)')
+    print(f'one valuation:  python loop {python_seconds * 1000:7.1f} ms, '
+          f'arrays {array_seconds * 1000:7.1f} ms of which flattening {flatten_seconds * 1000:.1f} ms')
+    print(f'{args.scenarios} scenarios:   python loop {python_scenarios_seconds * 1000:7.1f} ms, '
+          f'arrays {array_scenarios_seconds * 1000:7.1f} ms ({python_scenarios_seconds / array_scenarios_seconds:.1f}x)')
+
+
+def timed(func) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    main()
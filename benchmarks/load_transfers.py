@@ -0,0 +1,70 @@
+"""Offline load test for AccountHandler.handle_transaction against the local DynamoDB stand-in.
+
+    python -m benchmarks.load_transfers --accounts 50 --transfers 5000 --concurrency 200 --latency-ms 5
+
+Fires random concurrent transfers and checks that money is conserved and no balance goes negative.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from decimal import *
+
+os.environ['DYNAMO_BACKEND'] = 'local'
+
+from app.handlers.account_handler import AccountHandler
+from app.storage import Dynamo as dynamo_module
+from app.storage.AsyncDynamo import pool_stats
+from app.storage.LocalDynamo import LocalDynamoResource
+
+
+async def run(accounts: int, transfers: int, concurrency: int) -> tuple[int, int]:
+    names = [f'user{i}' for i in range(accounts)]
+    semaphore = asyncio.Semaphore(concurrency)
+    ok = failed = 0
+
+    async def transfer():
+        nonlocal ok, failed
+        sender, receiver = random.sample(names, 2)
+        async with semaphore:
+            try:
+                await AccountHandler.handle_transaction(sender, receiver, Decimal(random.randint(1, 20)), True)
+                ok += 1
+            except ValueError:
+                failed += 1
+
+    await asyncio.gather(*(transfer() for _ in range(transfers)))
+    return ok, failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--transfers', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--starting-balance', type=int, default=100)
+    args = parser.parse_args()
+
+    resource = LocalDynamoResource(latency_ms=args.latency_ms)
+    dynamo_module.dyn_resource = resource
+    ledger = resource.Table('ledgerTest')
+    for i in range(args.accounts):
+        ledger.put_item(Item={'name': f'user{i}', 'balance': Decimal(args.starting_balance)})
+
+    started = time.perf_counter()
+    ok, failed = asyncio.run(run(args.accounts, args.transfers, args.concurrency))
+    elapsed = time.perf_counter() - started
+
+    balances = [item['balance'] for item in resource.tables['ledgerTest'].values()]
+    expected_total = args.accounts * args.starting_balance
+    print(f'transfers: {ok} committed, {failed} rejected in {elapsed:.2f}s ({args.transfers / elapsed:.0f} transfers/s)')
+    print(f'total balance: {sum(balances)} (expected {expected_total}), min balance: {min(balances)}')
+    print(f'dynamo pool: {pool_stats.stats()}')
+    if sum(balances) != expected_total or min(balances) < 0:
+        raise SystemExit('ledger invariant violated')
+
+
+if __name__ == '__main__':
+    main()